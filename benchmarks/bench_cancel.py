@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+from typing import Any
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_conversation import _conversation_input, _seed_states, _setup_entry  # noqa: E402
+from fake_zhipuai import FakeZhipuAI, Scenario  # noqa: E402
+
+from homeassistant import loader  # noqa: E402
+from homeassistant.const import CONF_LLM_HASS_API  # noqa: E402
+from homeassistant.core import HomeAssistant  # noqa: E402
+from homeassistant.setup import async_setup_component  # noqa: E402
+from pytest_homeassistant_custom_component.common import async_test_home_assistant  # noqa: E402
+
+from custom_components.zhipuai.connection_pool import get_pool  # noqa: E402
+from custom_components.zhipuai.const import CONF_HEDGE_ENABLED  # noqa: E402
+from custom_components.zhipuai.conversation import ToolCallProcessor  # noqa: E402
+
+# Coroutines the integration starts with ensure_future; none may outlive a cancelled turn.
+TRACKED_TASKS = {"ToolCallProcessor._execute_single_call", "_first", "_Flight._pump"}
+
+
+def leftover_tasks() -> list[str]:
+    names = []
+    for task in asyncio.all_tasks():
+        name = getattr(task.get_coro(), "__qualname__", "")
+        if not task.done() and name in TRACKED_TASKS:
+            names.append(name)
+    return names
+
+
+def acquired_connections(entry_id: str) -> int:
+    pool = get_pool(entry_id)
+    session = pool._session if pool is not None else None
+    if session is None or session.closed:
+        return 0
+    return len(session.connector._acquired)
+
+
+async def cancel_mid_stream(hass: HomeAssistant, server: FakeZhipuAI) -> dict[str, Any]:
+    """Cancel a streamed LLM answer after its first delta."""
+    entry, entity = await _setup_entry(hass, server.chat_url, {CONF_LLM_HASS_API: "none", CONF_HEDGE_ENABLED: True})
+    original = entity._transform_stream
+    first_delta = asyncio.Event()
+
+    async def _watched(stream, llm_api):
+        async for delta in original(stream, llm_api):
+            if delta.get("content"):
+                first_delta.set()
+            yield delta
+
+    entity._transform_stream = _watched
+    disconnects = server.stats["client_disconnects"]
+    try:
+        turn = asyncio.ensure_future(entity.async_process(_conversation_input("今天适合开窗通风吗", "cancel-stream", entry.entry_id)))
+        await asyncio.wait_for(first_delta.wait(), 10)
+        turn.cancel()
+        await asyncio.gather(turn, return_exceptions=True)
+        # Give the fake upstream a few token intervals to notice the closed socket.
+        await asyncio.sleep(0.2)
+        return {
+            "client_disconnects": server.stats["client_disconnects"] - disconnects,
+            "leftover_tasks": leftover_tasks(),
+            "acquired_connections": acquired_connections(entry.entry_id),
+        }
+    finally:
+        entity._transform_stream = original
+        await hass.config_entries.async_unload(entry.entry_id)
+        await hass.config_entries.async_remove(entry.entry_id)
+        await hass.async_block_till_done()
+
+
+async def cancel_during_tools(hass: HomeAssistant, server: FakeZhipuAI) -> dict[str, Any]:
+    """Cancel a turn while ``ToolCallProcessor._execute_tool_calls`` waits on slow tools."""
+    entry, entity = await _setup_entry(hass, server.chat_url, {CONF_LLM_HASS_API: "assist"})
+    original = ToolCallProcessor._execute_tool_calls
+    executing = asyncio.Event()
+
+    async def _slow_service(call) -> None:
+        await asyncio.sleep(30)
+
+    async def _watched(self, tool_calls, user_text):
+        executing.set()
+        return await original(self, tool_calls, user_text)
+
+    for domain in ("light", "climate"):
+        hass.services.async_register(domain, "turn_on", _slow_service)
+    ToolCallProcessor._execute_tool_calls = _watched
+    try:
+        turn = asyncio.ensure_future(entity.async_process(_conversation_input("打开客厅灯和卧室空调", "cancel-tools", entry.entry_id)))
+        await asyncio.wait_for(executing.wait(), 10)
+        await asyncio.sleep(0.05)
+        turn.cancel()
+        await asyncio.gather(turn, return_exceptions=True)
+        await asyncio.sleep(0)
+        return {
+            "leftover_tasks": leftover_tasks(),
+            "acquired_connections": acquired_connections(entry.entry_id),
+        }
+    finally:
+        ToolCallProcessor._execute_tool_calls = original
+        await hass.config_entries.async_unload(entry.entry_id)
+        await hass.config_entries.async_remove(entry.entry_id)
+        await hass.async_block_till_done()
+
+
+async def run(args: argparse.Namespace) -> bool:
+    scenario = Scenario(latency=args.latency, token_rate=args.token_rate, seed=1)
+    ok = True
+    async with FakeZhipuAI(scenario) as server:
+        async with async_test_home_assistant() as hass:
+            hass.config.config_dir = str(REPO_ROOT)
+            hass.data.pop(loader.DATA_CUSTOM_COMPONENTS, None)
+            for component in ("homeassistant", "conversation", "intent"):
+                assert await async_setup_component(hass, component, {})
+            await _seed_states(hass)
+
+            stream = await cancel_mid_stream(hass, server)
+            print(f"cancel mid-stream:   {stream}")
+            ok &= stream["client_disconnects"] > 0 and not stream["leftover_tasks"] and not stream["acquired_connections"]
+
+            tools = await cancel_during_tools(hass, server)
+            print(f"cancel during tools: {tools}")
+            ok &= not tools["leftover_tasks"] and not tools["acquired_connections"]
+            await hass.async_stop(force=True)
+    print("no orphaned tasks or connections" if ok else "FAILED: a cancelled turn left work behind")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cancelled turns leave no tasks, streams or connections behind")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake upstream time to first byte in seconds")
+    parser.add_argument("--token-rate", type=float, default=20.0, help="slow enough that the answer is still streaming when cancelled")
+    args = parser.parse_args()
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
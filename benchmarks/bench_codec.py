@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+CODEC_PATH = Path(__file__).resolve().parents[1] / "custom_components" / "zhipuai" / "codec.py"
+
+
+def _load_codec(disable_orjson: bool = False):
+    saved = sys.modules.get("orjson", ...)
+    if disable_orjson:
+        sys.modules["orjson"] = None
+    try:
+        spec = importlib.util.spec_from_file_location(f"zhipuai_codec_{int(disable_orjson)}", CODEC_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    finally:
+        if saved is ...:
+            sys.modules.pop("orjson", None)
+        else:
+            sys.modules["orjson"] = saved
+
+
+def build_payload(tokens: int) -> dict:
+    """A chat payload whose system prompt is roughly ``tokens`` tokens long.
+
+    One CJK character counts as one token and an English word as 1.3, so the
+    mix below matches the estimate the API bills for typical HA prompts.
+    """
+    rng = random.Random(7)
+    zh = "客厅卧室厨房灯光空调温度湿度窗帘打开关闭亮度模式传感器状态设备区域"
+    en = ["light", "sensor", "climate", "state", "entity", "area", "brightness", "temperature", "on", "off"]
+    lines = []
+    count = 0.0
+    while count < tokens:
+        entity = f"sensor.room_{rng.randint(1, 999)}"
+        name = "".join(rng.choice(zh) for _ in range(rng.randint(4, 10)))
+        words = " ".join(rng.choice(en) for _ in range(rng.randint(3, 8)))
+        line = f"- {entity} '{name}': {words} {rng.randint(0, 100)}"
+        lines.append(line)
+        count += len(name) + len(words.split()) * 1.3 + 6
+    tools = [
+        {
+            "type": "function",
+            "function": {
+                "name": f"HassTool{index}",
+                "description": "控制家庭设备的工具 " * 3,
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string"},
+                        "area": {"type": "string"},
+                        "domain": {"type": "array", "items": {"type": "string"}},
+                        "brightness": {"type": "integer", "minimum": 0, "maximum": 100},
+                    },
+                    "required": ["name"],
+                },
+            },
+        }
+        for index in range(40)
+    ]
+    return {
+        "model": "glm-4-flash-250414",
+        "messages": [
+            {"role": "system", "content": "\n".join(lines)},
+            {"role": "user", "content": "打开客厅灯并把空调调到二十六度"},
+        ],
+        "tools": tools,
+        "stream": True,
+        "temperature": 0.1,
+    }
+
+
+def build_chunks(count: int) -> list[str]:
+    rng = random.Random(3)
+    chunks = []
+    for _ in range(count):
+        chunk = {
+            "id": "chatcmpl-bench",
+            "created": 1700000000,
+            "model": "glm-4-flash-250414",
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": rng.choice(["好的", "客厅", "温度", " the", " light"])}}],
+        }
+        chunks.append(json.dumps(chunk, ensure_ascii=False))
+    return chunks
+
+
+def legacy_request(payload: dict, chunks: list[str]) -> int:
+    # send_request used to json.dumps the payload for LOGGER.info, then aiohttp's
+    # json= encoded it again with the default ensure_ascii=True.
+    log_line = "发送给AI的消息: %s" % json.dumps(payload, ensure_ascii=False)
+    body = json.dumps(payload).encode("utf-8")
+    for chunk in chunks:
+        json.loads(chunk)
+    return len(body) + len(log_line)
+
+
+def codec_request(codec, payload: dict, chunks: list[str]) -> int:
+    body = codec.dumps_bytes(payload)
+    for chunk in chunks:
+        codec.loads(chunk)
+    return len(body)
+
+
+def measure(func, repeat: int) -> float:
+    func()
+    start = time.process_time()
+    for _ in range(repeat):
+        func()
+    return (time.process_time() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-request CPU of payload encoding, logging and SSE chunk decoding")
+    parser.add_argument("--tokens", type=int, default=10_000)
+    parser.add_argument("--chunks", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    payload = build_payload(args.tokens)
+    chunks = build_chunks(args.chunks)
+    body_size = len(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+    print(f"payload: ~{args.tokens} tokens, {body_size / 1024:.1f} KiB UTF-8, {args.chunks} SSE chunks")
+
+    results = {"legacy (json + eager log)": measure(lambda: legacy_request(payload, chunks), args.repeat)}
+    stdlib_codec = _load_codec(disable_orjson=True)
+    results[f"codec ({stdlib_codec.BACKEND}, lazy log)"] = measure(lambda: codec_request(stdlib_codec, payload, chunks), args.repeat)
+    codec = _load_codec()
+    if codec.BACKEND != stdlib_codec.BACKEND:
+        results[f"codec ({codec.BACKEND}, lazy log)"] = measure(lambda: codec_request(codec, payload, chunks), args.repeat)
+    else:
+        print("orjson is not installed, only the stdlib fallback was measured")
+
+    baseline = results["legacy (json + eager log)"]
+    for name, seconds in results.items():
+        saved = baseline - seconds
+        print(f"{name:<30} {seconds * 1e6:10.1f} µs/request  saved {saved * 1e6:9.1f} µs ({saved / baseline:6.1%})")
+
+
+if __name__ == "__main__":
+    main()
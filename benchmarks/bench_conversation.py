@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import dataclasses
+import gc
+import json
+import math
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_zhipuai import FakeZhipuAI, Scenario  # noqa: E402
+
+from homeassistant import loader  # noqa: E402
+from homeassistant.components import conversation  # noqa: E402
+from homeassistant.const import CONF_API_KEY, CONF_LLM_HASS_API  # noqa: E402
+from homeassistant.core import Context, HomeAssistant  # noqa: E402
+from homeassistant.setup import async_setup_component  # noqa: E402
+from pytest_homeassistant_custom_component.common import (  # noqa: E402
+    MockConfigEntry,
+    async_test_home_assistant,
+)
+
+DOMAIN = "zhipuai"
+LAG_INTERVAL = 0.005
+
+
+@dataclasses.dataclass
+class Route:
+    name: str
+    text: str
+    options: dict[str, Any]
+    expects_delta: bool
+
+
+ROUTES = [
+    Route("service_fast_path", "暂停客厅音箱", {CONF_LLM_HASS_API: "none"}, False),
+    Route("intent_path", "sensor.living_room_temperature 现在多少度", {CONF_LLM_HASS_API: "none"}, False),
+    Route("llm_stream", "今天适合开窗通风吗", {CONF_LLM_HASS_API: "none"}, True),
+    Route("tool_loop", "打开客厅灯和卧室空调", {CONF_LLM_HASS_API: "assist"}, True),
+]
+
+
+def percentile(samples: list[float], pct: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: list[float], scale: float = 1000.0) -> dict[str, float | None]:
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    return {
+        "p50": round(percentile(samples, 50) * scale, 3),
+        "p95": round(percentile(samples, 95) * scale, 3),
+        "p99": round(percentile(samples, 99) * scale, 3),
+        "mean": round(statistics.fmean(samples) * scale, 3),
+        "max": round(max(samples) * scale, 3),
+    }
+
+
+class LoopLagMonitor:
+    """Samples how late a short sleep wakes up while a route is running."""
+
+    def __init__(self, interval: float = LAG_INTERVAL) -> None:
+        self.interval = interval
+        self.samples: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def start(self) -> None:
+        self.samples.clear()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def _conversation_input(text: str, conversation_id: str, agent_id: str) -> conversation.ConversationInput:
+    fields = {field.name for field in dataclasses.fields(conversation.ConversationInput)}
+    values = {
+        "text": text,
+        "context": Context(),
+        "conversation_id": conversation_id,
+        "device_id": None,
+        "language": "zh-cn",
+        "agent_id": agent_id,
+        "satellite_id": None,
+        "extra_system_prompt": None,
+    }
+    return conversation.ConversationInput(**{key: value for key, value in values.items() if key in fields})
+
+
+async def _seed_states(hass: HomeAssistant) -> None:
+    hass.states.async_set("media_player.living_room_speaker", "playing", {"friendly_name": "客厅音箱"})
+    hass.states.async_set("sensor.living_room_temperature", "23.5", {"friendly_name": "客厅温度", "unit_of_measurement": "°C"})
+    hass.states.async_set("light.living_room", "off", {"friendly_name": "客厅灯"})
+    hass.states.async_set("climate.bedroom", "off", {"friendly_name": "卧室空调", "current_temperature": 26})
+    for index in range(200):
+        hass.states.async_set(f"sensor.bench_{index}", str(index), {"friendly_name": f"测试传感器 {index}"})
+
+    async def _noop(call) -> None:
+        return None
+
+    for domain, service in (("media_player", "media_pause"), ("sensor", "get_state"), ("light", "turn_on"), ("climate", "turn_on")):
+        hass.services.async_register(domain, service, _noop)
+
+
+async def _setup_entry(hass: HomeAssistant, chat_url: str, options: dict[str, Any]) -> tuple[MockConfigEntry, Any]:
+    entry = MockConfigEntry(
+        domain=DOMAIN,
+        title="ZhipuAI bench",
+        data={CONF_API_KEY: "bench-key"},
+        options={"base_url": chat_url, "chat_model": "glm-4-flash-250414", **options},
+    )
+    entry.add_to_hass(hass)
+    assert await hass.config_entries.async_setup(entry.entry_id)
+    await hass.async_block_till_done()
+    entity = hass.data[DOMAIN][entry.entry_id]
+    return entry, entity
+
+
+def _instrument_first_delta(entity: Any, marks: dict[str, float]) -> Callable[[], None]:
+    original = entity._transform_stream
+
+    async def _timed(stream, llm_api):
+        async for delta in original(stream, llm_api):
+            if "first_delta" not in marks and delta.get("content"):
+                marks["first_delta"] = time.perf_counter()
+            yield delta
+
+    entity._transform_stream = _timed
+
+    def _restore() -> None:
+        entity._transform_stream = original
+
+    return _restore
+
+
+async def run_route(hass: HomeAssistant, server: FakeZhipuAI, route: Route, iterations: int, warmup: int, alloc_iterations: int) -> dict[str, Any]:
+    entry, entity = await _setup_entry(hass, server.chat_url, route.options)
+    marks: dict[str, float] = {}
+    restore = _instrument_first_delta(entity, marks)
+    monitor = LoopLagMonitor()
+    wall: list[float] = []
+    first_delta: list[float] = []
+    failures = 0
+
+    async def _once(index: int) -> tuple[float, float | None, bool]:
+        marks.clear()
+        user_input = _conversation_input(route.text, f"bench-{route.name}-{index}", entry.entry_id)
+        start = time.perf_counter()
+        result = await entity.async_process(user_input)
+        elapsed = time.perf_counter() - start
+        delta = marks["first_delta"] - start if "first_delta" in marks else None
+        ok = result is not None and result.response is not None and result.response.response_type.value != "error"
+        return elapsed, delta, ok
+
+    try:
+        for index in range(warmup):
+            await _once(-index - 1)
+
+        requests_before = sum(server.stats[key] for key in ("chat", "tool_calls"))
+        tokens_before = (server.stats["prompt_tokens"], server.stats["cached_tokens"])
+        monitor.start()
+        for index in range(iterations):
+            elapsed, delta, ok = await _once(index)
+            wall.append(elapsed)
+            if delta is not None:
+                first_delta.append(delta)
+            failures += not ok
+        await monitor.stop()
+        upstream_requests = sum(server.stats[key] for key in ("chat", "tool_calls")) - requests_before
+        prompt_tokens = server.stats["prompt_tokens"] - tokens_before[0]
+        cached_tokens = server.stats["cached_tokens"] - tokens_before[1]
+
+        peaks: list[int] = []
+        net: list[int] = []
+        if alloc_iterations:
+            gc.collect()
+            tracemalloc.start()
+            for index in range(alloc_iterations):
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+                await _once(iterations + index)
+                after, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - before)
+                net.append(after - before)
+            tracemalloc.stop()
+    finally:
+        await monitor.stop()
+        restore()
+        await hass.config_entries.async_unload(entry.entry_id)
+        await hass.config_entries.async_remove(entry.entry_id)
+        await hass.async_block_till_done()
+
+    return {
+        "iterations": iterations,
+        "failures": failures,
+        "upstream_requests_per_turn": round(upstream_requests / iterations, 3) if iterations else 0,
+        "prompt_tokens_per_turn": round(prompt_tokens / iterations, 1) if iterations else 0,
+        "prompt_cache_hit_ratio": round(cached_tokens / prompt_tokens, 4) if prompt_tokens else None,
+        "wall_ms": summarize(wall),
+        "first_delta_ms": summarize(first_delta) if route.expects_delta else None,
+        "first_delta_missing": iterations - len(first_delta) if route.expects_delta else None,
+        "loop_lag_ms": summarize(monitor.samples),
+        "alloc_peak_kib": summarize([value / 1024 for value in peaks], 1.0),
+        "alloc_retained_kib": summarize([value / 1024 for value in net], 1.0),
+    }
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    scenario = Scenario(latency=args.latency, token_rate=args.token_rate, seed=1)
+    selected = [route for route in ROUTES if not args.route or route.name in args.route]
+    results: dict[str, Any] = {}
+    async with FakeZhipuAI(scenario) as server:
+        async with async_test_home_assistant() as hass:
+            hass.config.config_dir = str(REPO_ROOT)
+            hass.data.pop(loader.DATA_CUSTOM_COMPONENTS, None)
+            for component in ("homeassistant", "conversation", "intent"):
+                assert await async_setup_component(hass, component, {})
+            await _seed_states(hass)
+            for route in selected:
+                print(f"running {route.name} ...", flush=True)
+                results[route.name] = await run_route(hass, server, route, args.iterations, args.warmup, args.alloc_iterations)
+            await hass.async_stop(force=True)
+    return {
+        "benchmark": "conversation.async_process",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "config": {
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "alloc_iterations": args.alloc_iterations,
+            "upstream_latency_s": args.latency,
+            "upstream_token_rate": args.token_rate,
+        },
+        "routes": results,
+    }
+
+
+def _print_table(report: dict[str, Any]) -> None:
+    print(f"{'route':<20}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ttfd p50':>10}{'lag p99':>10}{'peak KiB':>10}")
+    for name, result in report["routes"].items():
+        first_delta = (result["first_delta_ms"] or {}).get("p50")
+        print(
+            f"{name:<20}"
+            f"{result['wall_ms']['p50']:>10}"
+            f"{result['wall_ms']['p95']:>10}"
+            f"{result['wall_ms']['p99']:>10}"
+            f"{first_delta if first_delta is not None else '-':>10}"
+            f"{result['loop_lag_ms']['p99'] if result['loop_lag_ms']['p99'] is not None else '-':>10}"
+            f"{result['alloc_peak_kib']['p50'] if result['alloc_peak_kib']['p50'] is not None else '-':>10}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end latency of ZhipuAIConversationEntity.async_process per route")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--alloc-iterations", type=int, default=5, help="extra runs under tracemalloc, 0 to skip")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake upstream time to first byte in seconds")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="fake upstream SSE chunks per second")
+    parser.add_argument("--route", action="append", choices=[route.name for route in ROUTES])
+    parser.add_argument("--output", default="bench_conversation.json")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    _print_table(report)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
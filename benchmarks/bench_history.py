@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from custom_components.zhipuai.const import HISTORY_MAX_USER_MESSAGE_LENGTH  # noqa: E402
+from custom_components.zhipuai.context_builder import (  # noqa: E402
+    chat_turns,
+    estimate_message_tokens,
+    estimate_tokens,
+    merge_history,
+)
+
+RECORDING = Path(__file__).resolve().parent / "recordings" / "conversation_20_turns.json"
+
+
+def history_cost(prompt_lines: list[str], turns: list[dict]) -> tuple[int, int]:
+    """(tokens, distinct messages) of the history part of a request."""
+    prompt = "\n用户历史消息\n" + "\n".join(prompt_lines) if prompt_lines else ""
+    tokens = estimate_tokens(prompt) + sum(estimate_message_tokens(turn) for turn in turns)
+    distinct = {line[len("- user: "):] for line in prompt_lines} | {turn["content"] for turn in turns}
+    return tokens, len(distinct)
+
+
+def legacy(log: list, stored: list, question: str, max_history: int) -> tuple[int, int]:
+    """History as sent before: every stored user message in the prompt, plus the chat turns."""
+    lines = [f"- {message.role}: {message.content}" for message in stored if message.role == "user"][-max_history:]
+    return history_cost(lines, chat_turns(log[-max_history:], question))
+
+
+def unified(log: list, stored: list, question: str, max_history: int) -> tuple[int, int]:
+    turns, lines = merge_history(chat_turns(log, question), stored, question, max_history)
+    return history_cost(lines, turns)
+
+
+def replay(content: list[dict], max_history: int, restart_after: int | None) -> list[tuple[tuple[int, int], tuple[int, int]]]:
+    """Per-turn history (tokens, distinct messages), legacy and unified, replaying the recording.
+
+    ``restart_after`` empties the chat log after that many turns, as after an
+    HA restart, while the persisted history store keeps its messages.
+    """
+    messages = [SimpleNamespace(role=item["role"], content=item.get("content"), tool_calls=item.get("tool_calls")) for item in content]
+    results = []
+    log: list = []
+    stored: list = []
+    turn = 0
+    for index, message in enumerate(messages):
+        if message.role == "user":
+            turn += 1
+            if restart_after is not None and turn == restart_after + 1:
+                log = []
+            log.append(message)
+            if len(message.content) <= HISTORY_MAX_USER_MESSAGE_LENGTH:
+                stored.append(message)
+            results.append((legacy(log, stored, message.content, max_history), unified(log, stored, message.content, max_history)))
+            continue
+        log.append(message)
+        final = message.role == "assistant" and message.content and not message.tool_calls
+        if final:
+            stored.append(message)
+    return results
+
+
+def report(name: str, results: list) -> None:
+    before = sum(old[0] for old, _ in results)
+    after = sum(new[0] for _, new in results)
+    print(f"{name}: {len(results)} turns")
+    print(f"  history tokens   legacy {before:6d}  unified {after:6d}  saved {before - after:6d} ({(before - after) / before:.1%})")
+    print(f"  per distinct msg legacy {before / max(1, sum(old[1] for old, _ in results)):6.1f}  unified {after / max(1, sum(new[1] for _, new in results)):6.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="History tokens per turn, replaying a recorded conversation")
+    parser.add_argument("--recording", default=str(RECORDING))
+    parser.add_argument("--restart-after", type=int, default=10, help="turn after which the chat log is lost")
+    parser.add_argument("--per-turn", action="store_true")
+    args = parser.parse_args()
+
+    data = json.loads(Path(args.recording).read_text(encoding="utf-8"))
+    max_history = data.get("max_history_messages", 30)
+    for name, restart_after in (("chat log intact", None), (f"restart after turn {args.restart_after}", args.restart_after)):
+        results = replay(data["content"], max_history, restart_after)
+        report(name, results)
+        if args.per_turn:
+            for turn, (old, new) in enumerate(results, 1):
+                print(f"    turn {turn:2d}  {old[0]:5d} tokens / {old[1]:2d} msgs -> {new[0]:5d} tokens / {new[1]:2d} msgs")
+
+
+if __name__ == "__main__":
+    main()
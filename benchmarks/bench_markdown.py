@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from custom_components.zhipuai.markdown_filter import (  # noqa: E402
+    MarkdownStreamFilter,
+    filter_markdown_content,
+)
+
+RECORDING = Path(__file__).resolve().parent / "recordings" / "markdown_answers.json"
+
+# The multi-pass filter as it was, one whole-text substitution per rule.
+_LEGACY_PATTERNS = [
+    re.compile(r'^#{1,6}\s+.*$', re.MULTILINE),
+    re.compile(r'^\s*[-*+]\s+', re.MULTILINE),
+    re.compile(r'^\s*>\s+', re.MULTILINE),
+    re.compile(r'```[a-zA-Z0-9_-]*', re.MULTILINE),
+    re.compile(r'```\s*$', re.MULTILINE),
+    re.compile(r'\n{3,}'),
+    re.compile(r'\*\*[^*\n]*\*\*'),
+    re.compile(r'\*[^*\n]*\*'),
+    re.compile(r'__[^_\n]*__'),
+    re.compile(r'_[^_\n]*_'),
+    re.compile(r'^\|[^\n]*\|$', re.MULTILINE),
+    re.compile(r'^\|[\s-]*\|[\s-]*\|$', re.MULTILINE),
+    re.compile(r'~~[^~\n]*~~'),
+    re.compile(r'`[^`\n]*`'),
+    re.compile(r'^-{3,}$|^_{3,}$|^\*{3,}$', re.MULTILINE),
+    re.compile(r'\[\^[^\]]*\]'),
+    re.compile(r'^\[\^[^\]]*\]:.*$', re.MULTILINE),
+    re.compile(r'<[^>]*>'),
+    re.compile(r'^\s*$\n^\s*$', re.MULTILINE),
+    re.compile(r'^`[a-zA-Z0-9_-]*$', re.MULTILINE),
+]
+
+
+def legacy_filter(content: str) -> str:
+    if not content:
+        return ""
+    content = re.compile(r'').sub('', content)
+    for pattern in _LEGACY_PATTERNS:
+        if pattern.pattern == r'\n{3,}':
+            continue
+        content = pattern.sub('', content)
+    content = re.sub(r'\n{3,}', '\n\n', content)
+    content = re.sub(r'^\s+$', '', content, flags=re.MULTILINE)
+    return content.strip()
+
+
+def stream_filter(content: str, rng: random.Random) -> str:
+    stream, out, index = MarkdownStreamFilter(), [], 0
+    while index < len(content):
+        size = rng.choice((1, 2, 3, 5, 8, 13))
+        out.append(stream.feed(content[index:index + size]))
+        index += size
+    out.append(stream.flush())
+    return "".join(out)
+
+
+def check_golden(corpus: list[dict]) -> int:
+    rng = random.Random(0)
+    failures = 0
+    for number, case in enumerate(corpus):
+        for name, got in (
+            ("legacy", legacy_filter(case["input"])),
+            ("batch", filter_markdown_content(case["input"], True)),
+            ("stream", stream_filter(case["input"], rng)),
+        ):
+            if got != case["expected"]:
+                failures += 1
+                print(f"answer {number}: {name} differs\n  want {case['expected']!r}\n  got  {got!r}")
+    return failures
+
+
+def throughput(function, size: int, seconds: float) -> float:
+    """MB/s of ``function``, which filters ``size`` bytes, run for about ``seconds``."""
+    runs, start = 0, time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < seconds:
+        function()
+        runs += 1
+    return runs * size / elapsed / 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Markdown filter: golden corpus and throughput")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[8, 32, 128], help="response sizes in KB")
+    parser.add_argument("--seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    corpus = json.loads(RECORDING.read_text(encoding="utf-8"))
+    failures = check_golden(corpus)
+    print(f"golden corpus: {len(corpus)} answers, {failures} mismatches")
+
+    inputs = [case["input"] for case in corpus]
+    size = sum(len(text.encode()) for text in inputs)
+    old = throughput(lambda: [legacy_filter(text) for text in inputs], size, args.seconds)
+    new = throughput(lambda: [filter_markdown_content(text, True) for text in inputs], size, args.seconds)
+    print(f"answer by answer  multi-pass {old:7.2f} MB/s  single-pass {new:7.2f} MB/s  ({new / old:.2f}x)")
+
+    answers = "\n\n".join(inputs)
+    for size in args.sizes:
+        text = (answers + "\n\n") * (size * 1024 // len(answers.encode()) + 1)
+        assert legacy_filter(text) == filter_markdown_content(text, True)
+        size = len(text.encode())
+        old = throughput(lambda: legacy_filter(text), size, args.seconds)
+        new = throughput(lambda: filter_markdown_content(text, True), size, args.seconds)
+        print(f"{size / 1024:6.0f} KB  multi-pass {old:7.2f} MB/s  single-pass {new:7.2f} MB/s  ({new / old:.2f}x)")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
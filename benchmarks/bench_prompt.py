@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from homeassistant.helpers import llm, template  # noqa: E402
+from pytest_homeassistant_custom_component.common import async_test_home_assistant  # noqa: E402
+
+from custom_components.zhipuai.prompt_renderer import SystemPromptRenderer, normalize_lines  # noqa: E402
+
+
+def build_prompt(lines: int) -> str:
+    """A custom prompt of ``lines`` lines with a handful of templated ones."""
+    rng = random.Random(11)
+    zh = "客厅卧室厨房灯光空调温度湿度窗帘打开关闭亮度模式传感器状态设备区域"
+    body = []
+    for index in range(lines):
+        if index % 200 == 0:
+            body.append("当前用户: {{ user_name or '访客' }}，家庭: {{ ha_name }}")
+        elif index % 500 == 1:
+            body.append("{% if user_name %}")
+            body.append(f"  - 以 {{{{ user_name }}}} 的习惯回答第 {index} 条规则")
+            body.append("{% endif %}")
+        else:
+            body.append(f"  - 规则 {index}: " + "".join(rng.choice(zh) for _ in range(rng.randint(10, 40))))
+    return "\n".join(body)
+
+
+def build_history(messages: int) -> str:
+    return "\n用户历史消息\n" + "\n".join(f"- user: 把客厅空调调到 {20 + index % 8} 度" for index in range(messages))
+
+
+def legacy_render(hass, custom_prompt: str, history_prompt: str, variables: dict) -> list[str]:
+    combined = "\n".join([llm.BASE_PROMPT, custom_prompt, history_prompt, ""])
+    rendered = template.Template(combined, hass).async_render(variables, parse_result=False)
+    base = [line.strip() if line.startswith(" ") else line for line in rendered.split("\n") if line.strip()]
+    return [line.strip() if line.startswith(" ") else line for line in base]
+
+
+def cached_render(renderer: SystemPromptRenderer, custom_prompt: str, history_prompt: str, variables: dict) -> list[str]:
+    lines = renderer.async_render("\n".join([llm.BASE_PROMPT, custom_prompt]), variables)
+    lines.extend(normalize_lines(history_prompt))
+    return lines
+
+
+def measure(func, repeat: int) -> float:
+    func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+async def run(args: argparse.Namespace) -> None:
+    custom_prompt = build_prompt(args.lines)
+    history_prompt = build_history(args.history)
+    variables = {"ha_name": "家", "user_name": "小王", "llm_context": None, "exposed_entities": []}
+    async with async_test_home_assistant() as hass:
+        renderer = SystemPromptRenderer(hass)
+        legacy = legacy_render(hass, custom_prompt, history_prompt, variables)
+        cached = cached_render(renderer, custom_prompt, history_prompt, variables)
+        if legacy != cached:
+            print(f"warning: outputs differ ({len(legacy)} vs {len(cached)} lines)")
+
+        cold = measure(lambda: (renderer.invalidate(), cached_render(renderer, custom_prompt, history_prompt, variables)), args.repeat)
+        results = {
+            "legacy (template per turn)": measure(lambda: legacy_render(hass, custom_prompt, history_prompt, variables), args.repeat),
+            "renderer, cold (options changed)": cold,
+            "renderer, warm": measure(lambda: cached_render(renderer, custom_prompt, history_prompt, variables), args.repeat),
+        }
+        await hass.async_stop(force=True)
+
+    print(f"prompt: {args.lines} lines, {len(custom_prompt) / 1024:.1f} KiB, {args.history} history messages")
+    baseline = results["legacy (template per turn)"]
+    for name, seconds in results.items():
+        print(f"{name:<34} {seconds * 1e3:9.3f} ms/turn  {baseline / seconds:6.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="System prompt build time per turn with a large custom prompt")
+    parser.add_argument("--lines", type=int, default=2000)
+    parser.add_argument("--history", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
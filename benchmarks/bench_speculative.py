@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import aiohttp
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_zhipuai import FakeZhipuAI, Scenario  # noqa: E402
+
+from homeassistant.helpers import intent  # noqa: E402
+
+from custom_components.zhipuai.speculative import LocalGate, SpeculativeRace  # noqa: E402
+
+# (utterance, whether the built-in agent's sentences match it)
+UTTERANCES = [
+    ("打开客厅灯", True),
+    ("关闭卧室灯", True),
+    ("客厅温度是多少", True),
+    ("把卧室空调调到26度", True),
+    ("打开窗帘", True),
+    ("今天适合出门跑步吗", False),
+    ("帮我想一个周末的晚餐菜单", False),
+    ("家里哪些灯还开着，帮我都关了", False),
+    ("给我讲个睡前故事", False),
+    ("明早七点提醒我带伞", False),
+]
+
+
+async def local_agent(text: str, matches: bool, latency: float) -> SimpleNamespace:
+    await asyncio.sleep(latency)
+    response_type = intent.IntentResponseType.ACTION_DONE if matches else intent.IntentResponseType.ERROR
+    return SimpleNamespace(response=SimpleNamespace(response_type=response_type), text=text)
+
+
+async def llm_turn(session: aiohttp.ClientSession, server: FakeZhipuAI, text: str, gate: LocalGate | None) -> str:
+    payload = {"model": "glm-4-flash-250414", "stream": True, "messages": [{"role": "user", "content": text}]}
+
+    async def _raw():
+        async with session.post(server.chat_url, json=payload) as response:
+            async for line in response.content:
+                if line.startswith(b"data: {"):
+                    yield json.loads(line[6:])
+
+    async def _transform(stream, _llm_api=None):
+        async for chunk in stream:
+            yield chunk["choices"][0]["delta"].get("content") or ""
+
+    transform = gate.wrap(_transform) if gate else _transform
+    content = ""
+    async for delta in transform(_raw(), None):
+        content += delta
+    return content
+
+
+async def run(args: argparse.Namespace) -> None:
+    scenario = Scenario(latency=args.latency, token_rate=args.token_rate, prefix_cache=False)
+    async with FakeZhipuAI(scenario) as server, aiohttp.ClientSession() as session:
+        serial, speculative = [], []
+        serial_events = speculative_events = 0
+        race = SpeculativeRace()
+        for _ in range(args.rounds):
+            for text, matches in UTTERANCES:
+                # Today: the LLM answers every turn the heuristics do not.
+                before = server.stats["chat_events_sent"]
+                start = time.perf_counter()
+                await llm_turn(session, server, text, None)
+                serial.append(time.perf_counter() - start)
+                serial_events += server.stats["chat_events_sent"] - before
+
+                before = server.stats["chat_events_sent"]
+                start = time.perf_counter()
+                await race.async_run(
+                    lambda: local_agent(text, matches, args.local_latency),
+                    lambda gate: llm_turn(session, server, text, gate),
+                )
+                speculative.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+                speculative_events += server.stats["chat_events_sent"] - before
+
+    stats = race.stats()
+    turns = len(serial)
+    print(f"{turns} turns, local agent {args.local_latency * 1e3:.0f} ms, LLM first token {args.latency * 1e3:.0f} ms at {args.token_rate:.0f} tok/s")
+    print(f"local-win rate: {stats['win_rate']:.0%} ({stats['local_wins']}/{stats['races']})")
+    print(f"turn latency p50: LLM only {statistics.median(serial) * 1e3:7.1f} ms  speculative {statistics.median(speculative) * 1e3:7.1f} ms")
+    print(f"turn latency mean: LLM only {statistics.mean(serial) * 1e3:7.1f} ms  speculative {statistics.mean(speculative) * 1e3:7.1f} ms")
+    print(f"streamed chunks: LLM only {serial_events}  speculative {speculative_events}  ({1 - speculative_events / serial_events:.1%} fewer)")
+    print(f"race stats: {stats}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Speculative race between the built-in agent and the LLM")
+    parser.add_argument("--local-latency", type=float, default=0.03)
+    parser.add_argument("--latency", type=float, default=0.4, help="upstream time to first token")
+    parser.add_argument("--token-rate", type=float, default=60.0)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
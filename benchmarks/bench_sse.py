@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import random
+import time
+import tracemalloc
+from pathlib import Path
+
+SSE_PATH = Path(__file__).resolve().parents[1] / "custom_components" / "zhipuai" / "sse.py"
+
+
+def _load_sse():
+    spec = importlib.util.spec_from_file_location("zhipuai_sse", SSE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_stream(tokens: int) -> bytes:
+    words = ["客厅", "温度", "现在是", "二十三度", "湿度", "百分之四十五", "，", "。", "the", "light", " is", " on", "😀"]
+    rng = random.Random(42)
+    parts = []
+    for index in range(tokens):
+        chunk = {
+            "id": "chatcmpl-bench",
+            "created": 1700000000,
+            "model": "glm-4-flash-250414",
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": rng.choice(words)}}],
+        }
+        parts.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+    parts.append("data: [DONE]\n\n")
+    return "".join(parts).encode("utf-8")
+
+
+def split_lines(raw: bytes) -> list[bytes]:
+    return raw.splitlines(keepends=True)
+
+
+def split_random(raw: bytes, seed: int = 7) -> list[bytes]:
+    rng = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(raw):
+        size = rng.randint(1, 512)
+        chunks.append(raw[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def split_fixed(raw: bytes, size: int = 4096) -> list[bytes]:
+    return [raw[pos:pos + size] for pos in range(0, len(raw), size)]
+
+
+async def _aiter(chunks: list[bytes]):
+    for chunk in chunks:
+        await asyncio.sleep(0)
+        yield chunk
+
+
+async def legacy_async(chunks: list[bytes]) -> int:
+    count = 0
+    buffer = ""
+    async for chunk in _aiter(chunks):
+        if not chunk:
+            continue
+        buffer += chunk.decode("utf-8")
+        lines = buffer.split("\n")
+        if len(lines) > 1:
+            buffer = lines.pop()
+            for line in lines:
+                line = line.strip()
+                if not line or line == "data: [DONE]":
+                    continue
+                if line.startswith("data: "):
+                    try:
+                        json.loads(line[6:])
+                        count += 1
+                    except Exception:
+                        pass
+    return count
+
+
+async def decoder_async(sse, chunks: list[bytes]) -> int:
+    count = 0
+    decoder = sse.SSEDecoder()
+    async for chunk in _aiter(chunks):
+        for event in decoder.feed(chunk):
+            if event.data == "[DONE]":
+                return count
+            json.loads(event.data)
+            count += 1
+    return count
+
+
+def legacy_loop(chunks: list[bytes], parse: bool = True) -> int:
+    count = 0
+    buffer = ""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        chunk_text = chunk.decode("utf-8")
+        buffer += chunk_text
+        lines = buffer.split("\n")
+        if len(lines) > 1:
+            buffer = lines.pop()
+            for line in lines:
+                line = line.strip()
+                if not line or line == "data: [DONE]":
+                    continue
+                if line.startswith("data: "):
+                    if not parse:
+                        count += 1
+                        continue
+                    try:
+                        json.loads(line[6:])
+                        count += 1
+                    except Exception:
+                        pass
+    return count
+
+
+def decoder_loop(sse, chunks: list[bytes], parse: bool = True) -> int:
+    count = 0
+    decoder = sse.SSEDecoder()
+    for chunk in chunks:
+        for event in decoder.feed(chunk):
+            if event.data == "[DONE]":
+                return count
+            if parse:
+                json.loads(event.data)
+            count += 1
+    for event in decoder.flush():
+        if event.data != "[DONE]":
+            if parse:
+                json.loads(event.data)
+            count += 1
+    return count
+
+
+def measure(label: str, func, repeat: int) -> dict:
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"label": label, "events": result, "best_ms": round(best * 1000, 3), "peak_kib": round(peak / 1024, 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the legacy SSE loop with SSEDecoder")
+    parser.add_argument("--tokens", type=int, default=4000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    sse = _load_sse()
+    raw = build_stream(args.tokens)
+    line_chunks = split_lines(raw)
+    random_chunks = split_random(raw)
+    network_chunks = split_fixed(raw)
+    loop = asyncio.new_event_loop()
+
+    results = [
+        measure("legacy, line chunks", lambda: legacy_loop(line_chunks), args.repeat),
+        measure("decoder, line chunks", lambda: decoder_loop(sse, line_chunks), args.repeat),
+        measure("decoder, random chunks", lambda: decoder_loop(sse, random_chunks), args.repeat),
+        # Without JSON parsing, which otherwise dominates, to show the framing cost alone.
+        measure("legacy framing, lines", lambda: legacy_loop(line_chunks, parse=False), args.repeat),
+        measure("decoder framing, lines", lambda: decoder_loop(sse, line_chunks, parse=False), args.repeat),
+        measure("legacy, async per line", lambda: loop.run_until_complete(legacy_async(line_chunks)), args.repeat),
+        measure("decoder, async 4 KiB", lambda: loop.run_until_complete(decoder_async(sse, network_chunks)), args.repeat),
+    ]
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+    try:
+        legacy_loop(random_chunks)
+        legacy_random = "ok"
+    except UnicodeDecodeError as err:
+        legacy_random = f"fails: {err.reason}"
+
+    print(f"stream: {args.tokens} tokens, {len(raw) / 1024:.1f} KiB")
+    for item in results:
+        print(f"{item['label']:<26} events={item['events']:<6} best={item['best_ms']:>9} ms  peak={item['peak_kib']:>8} KiB")
+    print(f"{'legacy, random chunks':<26} {legacy_random}")
+
+
+if __name__ == "__main__":
+    main()
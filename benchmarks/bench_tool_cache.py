@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from homeassistant import loader  # noqa: E402
+from homeassistant.components import conversation  # noqa: E402
+from homeassistant.components.homeassistant.exposed_entities import async_expose_entity  # noqa: E402
+from homeassistant.core import Context, HomeAssistant  # noqa: E402
+from homeassistant.helpers import llm  # noqa: E402
+from homeassistant.setup import async_setup_component  # noqa: E402
+from pytest_homeassistant_custom_component.common import async_test_home_assistant  # noqa: E402
+
+from custom_components.zhipuai.const import DOMAIN  # noqa: E402
+from custom_components.zhipuai.conversation import _describe_tools, _format_tool  # noqa: E402
+from custom_components.zhipuai.tool_cache import ToolSpecCache, tool_set_hash  # noqa: E402
+
+# Scripts with fields become ScriptTools whose schemas hold fresh selector objects on every API lookup.
+SCRIPTS = {
+    "coming_home": {
+        "alias": "回家模式",
+        "description": "打开玄关灯和客厅灯，空调调到指定温度",
+        "fields": {
+            "temperature": {"description": "空调目标温度", "required": True, "selector": {"number": {"min": 16, "max": 30, "step": 0.5}}},
+            "room": {"description": "先打开哪个房间", "selector": {"select": {"options": ["客厅", "卧室", "书房"]}}},
+        },
+        "sequence": [],
+    },
+    "good_night": {
+        "alias": "晚安模式",
+        "description": "关闭客厅灯光和电视，卧室空调睡眠模式",
+        "fields": {"delay": {"description": "延迟关灯的分钟数", "default": 5, "selector": {"number": {"min": 0, "max": 60}}}},
+        "sequence": [],
+    },
+    "feed_cat": {"alias": "喂猫", "description": "启动自动喂食器投喂一份猫粮", "sequence": []},
+}
+
+
+async def _api_instance(hass: HomeAssistant) -> llm.APIInstance:
+    context = llm.LLMContext(platform=DOMAIN, context=Context(), user_prompt="打开回家模式", language="zh-cn", assistant=conversation.DOMAIN, device_id=None)
+    return await llm.async_get_api(hass, llm.LLM_API_ASSIST, context)
+
+
+async def run(args: argparse.Namespace) -> bool:
+    async with async_test_home_assistant() as hass:
+        hass.config.config_dir = str(REPO_ROOT)
+        hass.data.pop(loader.DATA_CUSTOM_COMPONENTS, None)
+        for component in ("homeassistant", "conversation", "intent"):
+            assert await async_setup_component(hass, component, {})
+        assert await async_setup_component(hass, "script", {"script": SCRIPTS})
+        await hass.async_block_till_done()
+        for script_id in SCRIPTS:
+            async_expose_entity(hass, conversation.DOMAIN, f"script.{script_id}", True)
+
+        first, second = await _api_instance(hass), await _api_instance(hass)
+        script_tools = [tool.name for tool in first.tools if tool.name in SCRIPTS]
+        rebuilt = all(a.parameters is not b.parameters for a, b in zip(first.tools, second.tools) if a.name in SCRIPTS)
+        cache = ToolSpecCache(hass, _format_tool, _describe_tools)
+        cache.get(llm.LLM_API_ASSIST, first)
+        cache.get(llm.LLM_API_ASSIST, second)
+        print(f"script tools: {sorted(script_tools)}, schemas rebuilt per lookup: {rebuilt}")
+        print(f"two separately built API instances: {cache.stats()}")
+        ok = len(script_tools) == len(SCRIPTS) and rebuilt and cache.hits == 1 and cache.misses == 1
+
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            tool_set_hash(first.tools)
+        key_ms = (time.perf_counter() - start) / args.rounds * 1000
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            [_format_tool(tool, first.custom_serializer) for tool in first.tools]
+        format_ms = (time.perf_counter() - start) / args.rounds * 1000
+        print(f"{len(first.tools)} tools: cache key {key_ms:.3f} ms, formatting {format_ms:.3f} ms")
+        await hass.async_stop(force=True)
+    print("tool cache hits across API lookups" if ok else "FAILED: identical tool sets did not share a cache entry")
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Tool spec cache keys stay stable across LLM API lookups")
+    parser.add_argument("--rounds", type=int, default=200, help="repetitions for the key and formatting timings")
+    args = parser.parse_args()
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import aiohttp
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_zhipuai import FakeZhipuAI, Scenario  # noqa: E402
+
+from custom_components.zhipuai.codec import dumps  # noqa: E402
+from custom_components.zhipuai.context_builder import estimate_tokens  # noqa: E402
+from custom_components.zhipuai.tool_selector import ToolSelector  # noqa: E402
+
+NAME = {"type": "string", "description": "Name of a device or entity"}
+AREA = {"type": "string", "description": "Name of an area"}
+DOMAIN_LIST = {"type": "array", "items": {"type": "string"}, "description": "Domain of devices/entities in an area"}
+
+INTENT_TOOLS = {
+    "GetLiveContext": ("Provides real-time information about the CURRENT state, value, or mode of devices, sensors, entities, or areas.", {}),
+    "HassTurnOn": ("Turns on/opens/presses a device or entity. For locks, this performs a 'lock' action.", {"name": NAME, "area": AREA, "domain": DOMAIN_LIST}),
+    "HassTurnOff": ("Turns off/closes a device or entity. For locks, this performs an 'unlock' action.", {"name": NAME, "area": AREA, "domain": DOMAIN_LIST}),
+    "HassCancelAllTimers": ("Cancels all timers", {"area": AREA}),
+    "HassLightSet": ("Sets the brightness percentage or color of a light", {"name": NAME, "area": AREA, "brightness": {"type": "integer", "minimum": 0, "maximum": 100}, "color": {"type": "string"}}),
+    "HassClimateSetTemperature": ("Sets the target temperature of a climate device or entity", {"name": NAME, "area": AREA, "temperature": {"type": "number"}}),
+    "HassMediaPause": ("Pauses a media player", {"name": NAME, "area": AREA}),
+    "HassMediaUnpause": ("Resumes a media player", {"name": NAME, "area": AREA}),
+    "HassMediaNext": ("Skips a media player to the next item", {"name": NAME, "area": AREA}),
+    "HassMediaPrevious": ("Replays the previous item for a media player", {"name": NAME, "area": AREA}),
+    "HassSetVolume": ("Sets the volume percentage of a media player", {"name": NAME, "area": AREA, "volume_level": {"type": "integer", "minimum": 0, "maximum": 100}}),
+    "HassMediaSearchAndPlay": ("Searches for media and plays the first result", {"search_query": {"type": "string"}, "media_class": {"type": "string"}, "name": NAME, "area": AREA}),
+    "HassSetPosition": ("Sets the position of a device or entity, such as a cover or valve", {"name": NAME, "area": AREA, "position": {"type": "integer", "minimum": 0, "maximum": 100}}),
+    "HassVacuumStart": ("Starts a vacuum", {"name": NAME, "area": AREA}),
+    "HassVacuumReturnToBase": ("Returns a vacuum to base", {"name": NAME, "area": AREA}),
+    "HassShoppingListAddItem": ("Adds an item to the shopping list", {"item": {"type": "string"}}),
+    "HassListAddItem": ("Add item to a todo list", {"item": {"type": "string"}, "name": NAME}),
+    "HassStartTimer": ("Starts a new timer", {"hours": {"type": "integer"}, "minutes": {"type": "integer"}, "seconds": {"type": "integer"}, "name": {"type": "string"}}),
+    "HassGetWeather": ("Gets the current weather", {"name": NAME}),
+    "HassFanSetSpeed": ("Sets a fan's speed by percentage", {"name": NAME, "area": AREA, "percentage": {"type": "integer", "minimum": 0, "maximum": 100}}),
+}
+
+SCRIPT_TOPICS = [
+    ("coming_home", "回家模式：打开玄关灯和客厅灯，空调调到 26 度，关闭安防"),
+    ("leaving_home", "离家模式：关闭所有灯和空调，启动扫地机器人，开启安防"),
+    ("good_night", "晚安模式：关闭客厅灯光，关闭电视，卧室空调睡眠模式"),
+    ("movie_time", "观影模式：关闭主灯，打开氛围灯带，投影仪开机，拉上窗帘"),
+    ("morning_call", "起床模式：缓慢打开卧室窗帘，播放早间新闻"),
+    ("feed_cat", "启动自动喂食器投喂一份猫粮"),
+    ("water_plants", "阳台花园浇水五分钟"),
+    ("boil_water", "烧水壶烧水到 85 度"),
+    ("dehumidify", "打开除湿机并把湿度目标设为 50%"),
+    ("open_garage", "打开车库门并开启车库照明"),
+]
+
+
+def build_tools(scripts: int) -> list[dict]:
+    tools = [
+        {"type": "function", "function": {"name": name, "description": description, "parameters": {"type": "object", "properties": properties}}}
+        for name, (description, properties) in INTENT_TOOLS.items()
+    ]
+    for index in range(scripts):
+        object_id, description = SCRIPT_TOPICS[index % len(SCRIPT_TOPICS)]
+        suffix = f"_{index // len(SCRIPT_TOPICS)}" if index >= len(SCRIPT_TOPICS) else ""
+        tools.append({"type": "function", "function": {
+            "name": f"{object_id}{suffix}",
+            "description": f"{description}（房间 {index // len(SCRIPT_TOPICS) + 1}）",
+            "parameters": {"type": "object", "properties": {}},
+        }})
+    return sorted(tools, key=lambda tool: tool["function"]["name"])
+
+
+UTTERANCES = [
+    ("开灯", "HassTurnOn"),
+    ("把客厅灯调到百分之三十", "HassLightSet"),
+    ("卧室空调调到二十六度", "HassClimateSetTemperature"),
+    ("暂停音乐", "HassMediaPause"),
+    ("音量小一点", "HassSetVolume"),
+    ("播放周杰伦的歌", "HassMediaSearchAndPlay"),
+    ("窗帘拉到一半", "HassSetPosition"),
+    ("让扫地机器人回去充电", "HassVacuumReturnToBase"),
+    ("把牛奶加到购物清单", "HassShoppingListAddItem"),
+    ("设置一个十分钟的计时器", "HassStartTimer"),
+    ("今天天气怎么样", "HassGetWeather"),
+    ("执行回家模式", "coming_home"),
+    ("该喂猫了", "feed_cat"),
+    ("帮我烧点水", "boil_water"),
+    ("客厅温度多少", "GetLiveContext"),
+]
+
+
+def describe(tools: list[dict]) -> str:
+    return "\n".join(f"- {tool['function']['name']}: {tool['function']['description']}" for tool in tools)
+
+
+def prompt_tokens(tools: list[dict]) -> int:
+    return estimate_tokens(dumps(tools)) + estimate_tokens(describe(tools))
+
+
+async def measure_ttft(server: FakeZhipuAI, tools: list[dict], text: str) -> float:
+    payload = {
+        "model": "glm-4-flash-250414",
+        "stream": True,
+        "tools": tools,
+        "messages": [{"role": "system", "content": "你是家庭助手。\n" + describe(tools)}, {"role": "user", "content": text}],
+    }
+    async with aiohttp.ClientSession() as session:
+        start = time.perf_counter()
+        async with session.post(server.chat_url, json=payload) as response:
+            async for line in response.content:
+                if line.startswith(b"data: "):
+                    elapsed = time.perf_counter() - start
+                    break
+            await response.read()
+    return elapsed
+
+
+async def run(args: argparse.Namespace) -> None:
+    tools = build_tools(args.scripts)
+    selector = ToolSelector(tools)
+    full_tokens = prompt_tokens(tools)
+    print(f"tool set: {len(tools)} tools ({len(INTENT_TOOLS)} intents, {args.scripts} scripts), {full_tokens} prompt tokens, top-k {args.top_k}")
+    rows = []
+    for text, expected in UTTERANCES:
+        selected = selector.select(text, args.top_k)
+        names = [tool["function"]["name"] for tool in selected]
+        rows.append((text, len(selected), prompt_tokens(selected), expected in names))
+        print(f"  {text:<16} {len(selected):3d} tools {rows[-1][2]:6d} tokens  {'hit' if rows[-1][3] else 'MISS ' + expected}")
+    selected_tokens = statistics.mean(row[2] for row in rows)
+    print(f"prompt tokens per turn: full {full_tokens}  selected {selected_tokens:.0f}  ({1 - selected_tokens / full_tokens:.1%} fewer), recall {sum(row[3] for row in rows)}/{len(rows)}")
+
+    for prefix_cache in (False, True):
+        scenario = Scenario(latency=args.latency, token_rate=0, prefix_cache=prefix_cache, prefill_rate=args.prefill_rate)
+        async with FakeZhipuAI(scenario) as server:
+            results = {"full": [], "selected": []}
+            for _ in range(args.rounds):
+                for text, _expected in UTTERANCES:
+                    results["full"].append(await measure_ttft(server, tools, text))
+                    results["selected"].append(await measure_ttft(server, selector.select(text, args.top_k), text))
+        full, selected = statistics.median(results["full"]), statistics.median(results["selected"])
+        label = "prefix cache on " if prefix_cache else "prefix cache off"
+        print(f"TTFT p50 ({label}, {args.prefill_rate:.0f} tok/s prefill): full {full * 1e3:7.1f} ms  selected {selected * 1e3:7.1f} ms  ({1 - selected / full:.1%} faster)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prompt tokens and TTFT with relevance-ranked tool subsets")
+    parser.add_argument("--scripts", type=int, default=60, help="exposed scripts in the tool set")
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--prefill-rate", type=float, default=4000.0, help="uncached prompt tokens per second on the fake server")
+    parser.add_argument("--rounds", type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,574 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from collections import Counter, deque
+from pathlib import Path
+from typing import Any
+
+import aiohttp
+from aiohttp import web
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+UPSTREAM_BASE = "https://open.bigmodel.cn/api/paas/v4"
+API_PREFIX = "/api/paas/v4"
+ROUTES = ("chat", "tool_calls", "web_search", "images")
+PREFIX_CACHE_BLOCK = 64
+
+# 1x1 transparent PNG served for generated image downloads.
+PNG_PIXEL = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+
+class Scenario:
+    """Runtime knobs of the fake upstream, changeable through /_fake/scenario."""
+
+    def __init__(
+        self,
+        latency: float = 0.2,
+        jitter: float = 0.0,
+        token_rate: float = 50.0,
+        chunk_chars: int = 2,
+        argument_chunk_chars: int = 8,
+        repeat_tool_call_id: bool = True,
+        error_rate: float = 0.0,
+        faults: list[str] | None = None,
+        retry_after: float | None = None,
+        prefix_cache: bool = True,
+        prefill_rate: float = 0.0,
+        seed: int | None = None,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.token_rate = token_rate
+        self.chunk_chars = chunk_chars
+        self.argument_chunk_chars = argument_chunk_chars
+        self.repeat_tool_call_id = repeat_tool_call_id
+        self.error_rate = error_rate
+        self.faults: deque[str] = deque(faults or [])
+        self.retry_after = retry_after
+        self.prefix_cache = prefix_cache
+        self.prefill_rate = prefill_rate
+        self.rng = random.Random(seed)
+
+    def update(self, data: dict[str, Any]) -> None:
+        for key in ("latency", "jitter", "token_rate", "error_rate", "retry_after", "prefill_rate"):
+            if key in data:
+                setattr(self, key, None if data[key] is None else float(data[key]))
+        for key in ("chunk_chars", "argument_chunk_chars"):
+            if key in data:
+                setattr(self, key, max(1, int(data[key])))
+        for key in ("repeat_tool_call_id", "prefix_cache"):
+            if key in data:
+                setattr(self, key, bool(data[key]))
+        if "faults" in data:
+            self.faults = deque(data["faults"])
+        if "seed" in data:
+            self.rng = random.Random(data["seed"])
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "latency": self.latency,
+            "jitter": self.jitter,
+            "token_rate": self.token_rate,
+            "chunk_chars": self.chunk_chars,
+            "argument_chunk_chars": self.argument_chunk_chars,
+            "repeat_tool_call_id": self.repeat_tool_call_id,
+            "error_rate": self.error_rate,
+            "faults": list(self.faults),
+            "retry_after": self.retry_after,
+            "prefix_cache": self.prefix_cache,
+            "prefill_rate": self.prefill_rate,
+        }
+
+    def next_fault(self, route: str) -> str | None:
+        """Pop the next scripted fault for ``route``.
+
+        Faults are strings such as ``"429"``, ``"503"``, ``"timeout"`` or
+        ``"disconnect"``, optionally prefixed with a route (``"chat:429"``).
+        """
+        for index, fault in enumerate(self.faults):
+            target, sep, kind = fault.rpartition(":")
+            if not sep or target == route:
+                del self.faults[index]
+                return kind
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return self.rng.choice(["429", "500", "503"])
+        return None
+
+    def first_delay(self, prefill_tokens: int = 0) -> float:
+        """Latency plus jitter, plus prefill time for uncached prompt tokens."""
+        prefill = prefill_tokens / self.prefill_rate if self.prefill_rate else 0.0
+        return max(0.0, self.latency + (self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)) + prefill
+
+    def token_delay(self) -> float:
+        return 1.0 / self.token_rate if self.token_rate > 0 else 0.0
+
+
+class FixtureStore:
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.fixtures: dict[str, list[dict[str, Any]]] = {route: [] for route in ROUTES}
+        self.reload()
+
+    def reload(self) -> None:
+        for route in ROUTES:
+            self.fixtures[route].clear()
+        if not self.directory.is_dir():
+            return
+        for path in sorted(self.directory.glob("*.json")):
+            data = json.loads(path.read_text(encoding="utf-8"))
+            data.setdefault("name", path.stem)
+            self.fixtures.setdefault(data.get("route", "chat"), []).append(data)
+
+    def select(self, route: str, text: str = "", name: str | None = None, stage: str = "initial") -> dict[str, Any] | None:
+        """Pick a fixture by explicit name, then by ``match`` substring.
+
+        ``stage`` separates the first answer of a turn from the answer given
+        after tool results were sent back (``"after_tool"``).
+        """
+        candidates = self.fixtures.get(route, [])
+        if name:
+            return next((fixture for fixture in candidates if fixture["name"] == name), None)
+        fallback = None
+        for fixture in candidates:
+            if fixture.get("stage", "initial") != stage:
+                continue
+            match = fixture.get("match", "")
+            if match and match in text:
+                return fixture
+            if not match and fallback is None:
+                fallback = fixture
+        return fallback
+
+    def save(self, name: str, data: dict[str, Any]) -> Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{name}.json"
+        path.write_text(json.dumps(data, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        data.setdefault("name", name)
+        self.fixtures.setdefault(data.get("route", "chat"), []).append(data)
+        return path
+
+
+def _last_user_text(payload: dict[str, Any]) -> str:
+    for message in reversed(payload.get("messages") or []):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content")
+        if isinstance(content, str):
+            return content
+        if isinstance(content, list):
+            return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return ""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough GLM token count: one per CJK character, one per four other characters."""
+    wide = sum(1 for char in text if ord(char) >= 0x2E80)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def prompt_text(payload: dict[str, Any]) -> str:
+    return json.dumps({"tools": payload.get("tools"), "messages": payload.get("messages")}, ensure_ascii=False)
+
+
+class PrefixCache:
+    """Mimics upstream context caching.
+
+    The longest prefix a request shares with one of the recent requests is
+    reported as ``cached_tokens``, rounded down to whole cache blocks, the way
+    the real API only reuses complete blocks of an identical prefix.
+    """
+
+    def __init__(self, size: int = 32) -> None:
+        self._prompts: deque[str] = deque(maxlen=size)
+
+    def usage(self, payload: dict[str, Any]) -> dict[str, Any]:
+        prompt = prompt_text(payload)
+        shared = max((len(os.path.commonprefix([prompt, previous])) for previous in self._prompts), default=0)
+        self._prompts.append(prompt)
+        prompt_tokens = estimate_tokens(prompt)
+        cached = estimate_tokens(prompt[:shared]) // PREFIX_CACHE_BLOCK * PREFIX_CACHE_BLOCK
+        return {"prompt_tokens": prompt_tokens, "prompt_tokens_details": {"cached_tokens": min(cached, prompt_tokens)}}
+
+
+def _split(text: str, size: int) -> list[str]:
+    return [text[index:index + size] for index in range(0, len(text), size)]
+
+
+def build_chat_events(fixture: dict[str, Any], model: str, scenario: Scenario) -> list[dict[str, Any]]:
+    """Expand a fixture into the SSE chunks the real API would send.
+
+    Recorded fixtures carry their ``events`` verbatim; synthetic ones are
+    split into content deltas and fragmented ``tool_calls`` the same way
+    open.bigmodel.cn streams them.
+    """
+    if "events" in fixture:
+        return [dict(event, model=event.get("model", model)) for event in fixture["events"]]
+
+    chunk_id = f"chatcmpl-{uuid.uuid4().hex[:16]}"
+    created = int(time.time())
+
+    def _chunk(delta: dict[str, Any], finish_reason: str | None = None) -> dict[str, Any]:
+        choice: dict[str, Any] = {"index": 0, "delta": delta}
+        if finish_reason:
+            choice["finish_reason"] = finish_reason
+        return {"id": chunk_id, "created": created, "model": model, "choices": [choice]}
+
+    events = []
+    for piece in _split(fixture.get("content", ""), scenario.chunk_chars):
+        events.append(_chunk({"role": "assistant", "content": piece}))
+    for index, tool_call in enumerate(fixture.get("tool_calls") or []):
+        function = tool_call["function"]
+        events.append(_chunk({
+            "role": "assistant",
+            "tool_calls": [{
+                "index": index,
+                "id": tool_call["id"],
+                "type": tool_call.get("type", "function"),
+                "function": {"name": function["name"], "arguments": ""},
+            }],
+        }))
+        for piece in _split(function.get("arguments", ""), scenario.argument_chunk_chars):
+            fragment: dict[str, Any] = {"index": index, "function": {"arguments": piece}}
+            if scenario.repeat_tool_call_id:
+                fragment["id"] = tool_call["id"]
+            events.append(_chunk({"tool_calls": [fragment]}))
+    final = _chunk({"role": "assistant", "content": ""}, "tool_calls" if fixture.get("tool_calls") else "stop")
+    if fixture.get("usage"):
+        final["usage"] = fixture["usage"]
+    events.append(final)
+    return events
+
+
+def build_chat_response(events: list[dict[str, Any]]) -> dict[str, Any]:
+    content = []
+    tool_calls: dict[int, dict[str, Any]] = {}
+    finish_reason = "stop"
+    usage = None
+    for event in events:
+        usage = event.get("usage", usage)
+        for choice in event.get("choices", []):
+            finish_reason = choice.get("finish_reason") or finish_reason
+            delta = choice.get("delta", {})
+            if delta.get("content"):
+                content.append(delta["content"])
+            for fragment in delta.get("tool_calls") or []:
+                call = tool_calls.setdefault(fragment.get("index", 0), {"type": "function", "function": {"name": "", "arguments": ""}})
+                if fragment.get("id"):
+                    call["id"] = fragment["id"]
+                function = fragment.get("function", {})
+                call["function"]["name"] += function.get("name", "")
+                call["function"]["arguments"] += function.get("arguments", "")
+    message: dict[str, Any] = {"role": "assistant", "content": "".join(content)}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+    response = {
+        "id": events[0]["id"] if events else f"chatcmpl-{uuid.uuid4().hex[:16]}",
+        "created": int(time.time()),
+        "model": events[0].get("model", "") if events else "",
+        "choices": [{"index": 0, "finish_reason": finish_reason, "message": message}],
+    }
+    if usage:
+        response["usage"] = usage
+    return response
+
+
+class FakeZhipuAI:
+    """In-process stand-in for the ZhipuAI HTTP API.
+
+    Point the integration at it with the ``base_url`` option set to
+    ``server.chat_url``; web search, image generation and the vision
+    services derive their URLs from the same option.
+    """
+
+    def __init__(
+        self,
+        scenario: Scenario | None = None,
+        fixtures_dir: Path = FIXTURES_DIR,
+        record_dir: Path | None = None,
+        upstream_base: str = UPSTREAM_BASE,
+    ) -> None:
+        self.scenario = scenario or Scenario()
+        self.fixtures = FixtureStore(fixtures_dir)
+        self.recorder = FixtureStore(record_dir) if record_dir else None
+        self.upstream_base = upstream_base.rstrip("/")
+        self.stats: Counter[str] = Counter()
+        self.requests: deque[dict[str, Any]] = deque(maxlen=200)
+        self.prefix_cache = PrefixCache()
+        self._runner: web.AppRunner | None = None
+        self._upstream: aiohttp.ClientSession | None = None
+        self.base_url = ""
+
+    @property
+    def chat_url(self) -> str:
+        return f"{self.base_url}{API_PREFIX}/chat/completions"
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(f"{API_PREFIX}/chat/completions", self._handle_chat)
+        app.router.add_post(f"{API_PREFIX}/chat/completions/tool_calls", self._handle_tool_calls)
+        app.router.add_post(f"{API_PREFIX}/tool_calls", self._handle_tool_calls)
+        app.router.add_post(f"{API_PREFIX}/web_search", self._handle_web_search)
+        app.router.add_post(f"{API_PREFIX}/images/generations", self._handle_images)
+        app.router.add_get("/_fake/image.png", self._handle_image_file)
+        app.router.add_get("/_fake/scenario", self._handle_get_scenario)
+        app.router.add_post("/_fake/scenario", self._handle_set_scenario)
+        app.router.add_get("/_fake/stats", self._handle_stats)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{bound_port}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._upstream is not None:
+            await self._upstream.close()
+            self._upstream = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "FakeZhipuAI":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def _read(self, request: web.Request, route: str) -> dict[str, Any]:
+        payload = await request.json()
+        self.stats[route] += 1
+        self.requests.append({"route": route, "time": time.time(), "payload": payload})
+        return payload
+
+    async def _fault_response(self, fault: str | None) -> web.StreamResponse | None:
+        if fault is None:
+            return None
+        self.stats[f"fault:{fault}"] += 1
+        if fault == "timeout":
+            await asyncio.sleep(3600)
+        if fault.isdigit():
+            headers = {}
+            if self.scenario.retry_after is not None:
+                headers["Retry-After"] = str(int(self.scenario.retry_after))
+            body = {"error": {"code": fault, "message": f"injected {fault}"}}
+            return web.json_response(body, status=int(fault), headers=headers)
+        if fault == "disconnect":
+            return None
+        raise web.HTTPBadRequest(text=f"unknown fault {fault}")
+
+    def _fixture_name(self, request: web.Request) -> str | None:
+        return request.headers.get("X-Fake-Fixture") or request.query.get("fixture")
+
+    async def _handle_chat(self, request: web.Request) -> web.StreamResponse:
+        payload = await self._read(request, "chat")
+        if self.recorder is not None:
+            return await self._record_chat(request, payload)
+        fault = self.scenario.next_fault("chat")
+        if (response := await self._fault_response(fault)) is not None:
+            return response
+        messages = payload.get("messages") or []
+        stage = "after_tool" if messages and messages[-1].get("role") == "tool" else "initial"
+        fixture = self.fixtures.select("chat", _last_user_text(payload), self._fixture_name(request), stage)
+        if fixture is None:
+            raise web.HTTPNotFound(text="no chat fixture")
+        events = build_chat_events(fixture, payload.get("model", ""), self.scenario)
+        prefill_tokens = 0
+        if self.scenario.prefix_cache and events:
+            usage = dict(events[-1].get("usage") or {}, **self.prefix_cache.usage(payload))
+            usage["total_tokens"] = usage["prompt_tokens"] + usage.get("completion_tokens", 0)
+            events[-1] = dict(events[-1], usage=usage)
+            self.stats["prompt_tokens"] += usage["prompt_tokens"]
+            self.stats["cached_tokens"] += usage["prompt_tokens_details"]["cached_tokens"]
+            prefill_tokens = usage["prompt_tokens"] - usage["prompt_tokens_details"]["cached_tokens"]
+        elif self.scenario.prefill_rate:
+            prefill_tokens = estimate_tokens(prompt_text(payload))
+
+        await asyncio.sleep(self.scenario.first_delay(prefill_tokens))
+        if not payload.get("stream"):
+            await asyncio.sleep(self.scenario.token_delay() * len(events))
+            return web.json_response(build_chat_response(events))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        token_delay = self.scenario.token_delay()
+        try:
+            await response.prepare(request)
+            for index, event in enumerate(events):
+                if index and token_delay:
+                    await asyncio.sleep(token_delay)
+                if fault == "disconnect" and index == len(events) // 2:
+                    request.transport.close()
+                    return response
+                await response.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.stats["chat_events_sent"] += 1
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client went away mid-stream, e.g. a cancelled voice turn.
+            self.stats["client_disconnects"] += 1
+        return response
+
+    async def _record_chat(self, request: web.Request, payload: dict[str, Any]) -> web.StreamResponse:
+        if self._upstream is None:
+            self._upstream = aiohttp.ClientSession()
+        headers = {"Authorization": request.headers.get("Authorization", ""), "Content-Type": "application/json"}
+        upstream_payload = dict(payload, stream=True)
+        events = []
+        async with self._upstream.post(f"{self.upstream_base}/chat/completions", json=upstream_payload, headers=headers) as upstream:
+            if upstream.status != 200:
+                return web.Response(status=upstream.status, body=await upstream.read(), content_type="application/json")
+            async for line in upstream.content:
+                line = line.strip()
+                if line.startswith(b"data: ") and line[6:] != b"[DONE]":
+                    events.append(json.loads(line[6:]))
+        digest = hashlib.sha1(json.dumps(payload.get("messages"), sort_keys=True).encode("utf-8")).hexdigest()[:10]
+        path = self.recorder.save(f"recorded_chat_{digest}", {
+            "route": "chat",
+            "match": _last_user_text(payload)[:20],
+            "events": events,
+        })
+        print(f"recorded {len(events)} events to {path}")
+        self.fixtures.fixtures["chat"].insert(0, self.recorder.fixtures["chat"][-1])
+        if not payload.get("stream"):
+            return web.json_response(build_chat_response(events))
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for event in events:
+            await response.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _handle_json_route(self, request: web.Request, route: str) -> web.StreamResponse:
+        payload = await self._read(request, route)
+        if (response := await self._fault_response(self.scenario.next_fault(route))) is not None:
+            return response
+        fixture = self.fixtures.select(route, json.dumps(payload, ensure_ascii=False), self._fixture_name(request))
+        if fixture is None:
+            raise web.HTTPNotFound(text=f"no {route} fixture")
+        await asyncio.sleep(self.scenario.first_delay())
+        body = json.loads(json.dumps(fixture["response"], ensure_ascii=False).replace("{base}", self.base_url))
+        return web.json_response(body)
+
+    async def _handle_tool_calls(self, request: web.Request) -> web.StreamResponse:
+        return await self._handle_json_route(request, "tool_calls")
+
+    async def _handle_images(self, request: web.Request) -> web.StreamResponse:
+        return await self._handle_json_route(request, "images")
+
+    async def _handle_web_search(self, request: web.Request) -> web.StreamResponse:
+        payload = await self._read(request, "web_search")
+        if (response := await self._fault_response(self.scenario.next_fault("web_search"))) is not None:
+            return response
+        fixture = self.fixtures.select("web_search", payload.get("search_query", ""), self._fixture_name(request))
+        if fixture is None:
+            raise web.HTTPNotFound(text="no web_search fixture")
+        await asyncio.sleep(self.scenario.first_delay())
+        if not payload.get("stream"):
+            return web.json_response(fixture["response"])
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for result in fixture["response"].get("search_result", []):
+            chunk = {"choices": [{"delta": {"content": f"{result.get('title', '')}: {result.get('content', '')}\n"}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await asyncio.sleep(self.scenario.token_delay())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _handle_image_file(self, request: web.Request) -> web.StreamResponse:
+        return web.Response(body=PNG_PIXEL, content_type="image/png")
+
+    async def _handle_get_scenario(self, request: web.Request) -> web.StreamResponse:
+        return web.json_response(self.scenario.as_dict())
+
+    async def _handle_set_scenario(self, request: web.Request) -> web.StreamResponse:
+        data = await request.json()
+        self.scenario.update(data)
+        if data.get("reload_fixtures"):
+            self.fixtures.reload()
+        return web.json_response(self.scenario.as_dict())
+
+    async def _handle_stats(self, request: web.Request) -> web.StreamResponse:
+        return web.json_response({"counts": dict(self.stats), "recent": list(self.requests)[-20:]})
+
+
+async def _self_check(server: FakeZhipuAI) -> None:
+    async with aiohttp.ClientSession() as session:
+        async with session.post(server.chat_url, json={"model": "glm-4-flash-250414", "stream": True, "messages": [{"role": "user", "content": "打开客厅灯"}]}) as response:
+            body = await response.read()
+        print(f"chat stream: {response.status}, {body.count(b'data: ')} events")
+        async with session.post(f"{server.base_url}{API_PREFIX}/web_search", json={"search_query": "天气"}) as response:
+            print(f"web_search: {response.status}, {len((await response.json())['search_result'])} results")
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    scenario = Scenario(
+        latency=args.latency,
+        jitter=args.jitter,
+        token_rate=args.token_rate,
+        repeat_tool_call_id=not args.openai_tool_fragments,
+        error_rate=args.error_rate,
+        faults=args.fault,
+        retry_after=args.retry_after,
+        prefix_cache=not args.no_prefix_cache,
+        prefill_rate=args.prefill_rate,
+        seed=args.seed,
+    )
+    server = FakeZhipuAI(
+        scenario,
+        Path(args.fixtures),
+        Path(args.record) if args.record else None,
+    )
+    await server.start(args.host, args.port)
+    print(f"fake ZhipuAI listening on {server.base_url}")
+    print(f"set the integration option base_url to {server.chat_url}")
+    try:
+        if args.check:
+            await _self_check(server)
+            return
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in for the ZhipuAI API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first byte")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- jitter on latency")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="SSE chunks per second, 0 for unthrottled")
+    parser.add_argument("--openai-tool-fragments", action="store_true", help="send the tool call id only on the first fragment")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a random 429/5xx")
+    parser.add_argument("--fault", action="append", default=[], help="scripted fault, e.g. 429, chat:503, timeout, disconnect")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After header sent with injected errors")
+    parser.add_argument("--no-prefix-cache", action="store_true", help="do not report cached_tokens in usage")
+    parser.add_argument("--prefill-rate", type=float, default=0.0, help="uncached prompt tokens prefilled per second before the first byte, 0 to ignore prompt size")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--fixtures", default=str(FIXTURES_DIR))
+    parser.add_argument("--record", default=None, help="proxy chat requests to the real API and save them as fixtures here")
+    parser.add_argument("--check", action="store_true", help="send one chat and one web search request, then exit")
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,11 @@ from homeassistant.core import HomeAssistant, callback
 from homeassistant.exceptions import ConfigEntryNotReady
 from homeassistant.helpers.dispatcher import async_dispatcher_send
 from .const import DOMAIN, LOGGER
+from .coalescing import async_cancel_flights
+from .connection_pool import ZhipuAIConnectionPool, async_register_pool, async_unregister_pool
+from .entity_index import async_acquire_entity_index, async_release_entity_index
+from .entity_history import async_acquire_entity_history, async_release_entity_history
+from .history_store import async_remove_history
 from .intents import get_intent_handler, async_setup_intents
 from .services import async_setup_services
 from .web_search import async_setup_web_search
@@ -12,7 +17,7 @@ from .image_gen import async_setup_image_gen
 from .entity_analysis import async_setup_entity_analysis
 from .process_with_ha import async_setup as async_setup_process_with_ha
 
-PLATFORMS: list[Platform] = [Platform.CONVERSATION]
+PLATFORMS: list[Platform] = [Platform.CONVERSATION, Platform.SENSOR]
 
 class ZhipuAIConfigEntry:
     def __init__(self, hass: HomeAssistant, config_entry: ConfigEntry):
@@ -23,6 +28,7 @@ class ZhipuAIConfigEntry:
         self._unsub_options_update_listener = None
         self._cleanup_callbacks = []
         self.intent_handler = get_intent_handler(hass)
+        self.connection_pool = ZhipuAIConnectionPool(hass, config_entry.entry_id, config_entry.options)
 
     @property
     def entry_id(self):
@@ -33,6 +39,15 @@ class ZhipuAIConfigEntry:
         return self.config_entry.title
 
     async def async_setup(self) -> None:
+        # Everything taken here is handed back through async_on_unload, so a
+        # setup that fails halfway releases exactly what it took.
+        async_register_pool(self.connection_pool)
+        self.async_on_unload(lambda: async_unregister_pool(self.entry_id))
+        self.connection_pool.async_start_prewarm()
+        self.entity_index = async_acquire_entity_index(self.hass)
+        self.async_on_unload(lambda: async_release_entity_index(self.hass))
+        self.entity_history = async_acquire_entity_history(self.hass)
+        self.async_on_unload(lambda: async_release_entity_history(self.hass))
         self._unsub_options_update_listener = self.config_entry.add_update_listener(
             self.async_options_updated
         )
@@ -44,6 +59,8 @@ class ZhipuAIConfigEntry:
         for cleanup_callback in self._cleanup_callbacks:
             cleanup_callback()
         self._cleanup_callbacks.clear()
+        await async_cancel_flights(self.entry_id)
+        await self.connection_pool.async_close()
 
     def async_on_unload(self, func):
         self._cleanup_callbacks.append(func)
@@ -51,12 +68,15 @@ class ZhipuAIConfigEntry:
     @callback
     async def async_options_updated(self, hass: HomeAssistant, entry: ConfigEntry) -> None:
         self.options = entry.options
+        await self.connection_pool.async_update_options(entry.options)
         async_dispatcher_send(hass, f"{DOMAIN}_options_updated", entry)
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    zhipuai_entry = None
     try:
         zhipuai_entry = ZhipuAIConfigEntry(hass, entry)
         await zhipuai_entry.async_setup()
+        entry.runtime_data = zhipuai_entry
         hass.data.setdefault(DOMAIN, {})[entry.entry_id] = zhipuai_entry
         
         unload_services = await async_setup_services(hass)
@@ -73,16 +93,25 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         return True
         
     except Exception as ex:
+        hass.data.get(DOMAIN, {}).pop(entry.entry_id, None)
+        if zhipuai_entry is not None:
+            try:
+                await zhipuai_entry.async_unload()
+            except Exception as err:
+                LOGGER.warning("清理未完成的配置项失败: %s", err)
         raise ConfigEntryNotReady from ex
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     try:
-        zhipuai_entry = hass.data[DOMAIN].get(entry.entry_id)
+        zhipuai_entry = getattr(entry, "runtime_data", None)
         if zhipuai_entry is not None and hasattr(zhipuai_entry, 'async_unload'):
             await zhipuai_entry.async_unload()
     except Exception:
         pass
     finally:
         hass.data[DOMAIN].pop(entry.entry_id, None)
-    return unload_ok
\ No newline at end of file
+    return unload_ok
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    await async_remove_history(hass, entry.entry_id)
@@ -1,173 +1,221 @@
 from __future__ import annotations
 import aiohttp
-import json
 import asyncio
 import time
 from typing import AsyncGenerator, Dict, Any, Protocol, Callable
 from homeassistant.exceptions import HomeAssistantError
 from homeassistant.core import HomeAssistant
 from .const import (
-    LOGGER, ZHIPUAI_URL, CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT,
-    ERROR_INVALID_AUTH, ERROR_TOO_MANY_REQUESTS, ERROR_SERVER_ERROR, ERROR_TIMEOUT, ERROR_UNKNOWN
+    LOGGER, ZHIPUAI_URL, ZHIPUAI_API_BASE, CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT,
+    ERROR_INVALID_AUTH, ERROR_TOO_MANY_REQUESTS, ERROR_SERVER_ERROR, ERROR_TIMEOUT, ERROR_UNKNOWN,
+    CONF_HEDGE_ENABLED, DEFAULT_HEDGE_ENABLED, CONF_HEDGE_PERCENTILE, DEFAULT_HEDGE_PERCENTILE,
+    CONF_HEDGE_MODEL, DEFAULT_HEDGE_MODEL, CONF_CHAT_MODEL, RECOMMENDED_CHAT_MODEL,
+    CONF_REQUEST_COALESCING, DEFAULT_REQUEST_COALESCING
+)
+from .connection_pool import async_get_session
+from .sse import SSEDecoder
+from .codec import JSONDecodeError, LazyJSON, dumps_bytes, loads
+from .coalescing import async_coalesced_stream, coalesce_key
+from .hedging import async_hedged_stream, async_timed_stream
+from .metrics import RequestTimer
+from .retry import (
+    ENDPOINT_CHAT, ENDPOINT_TOOL_CALLS, UpstreamStatusError, async_call_with_retry, parse_retry_after
 )
 
-_SESSION = None
+async def get_session(entry_id: str) -> aiohttp.ClientSession:
+    return await async_get_session(entry_id)
 
-async def get_session() -> aiohttp.ClientSession:
-    global _SESSION
-    if _SESSION is None:
-        connector = aiohttp.TCPConnector(
-            limit=10,             
-            limit_per_host=5,      
-            keepalive_timeout=20.0
-        )
-        _SESSION = aiohttp.ClientSession(connector=connector)
-    return _SESSION
+def resolve_api_url(options: Dict[str, Any], url: str = ZHIPUAI_URL) -> str:
+    base_url = options.get("base_url")
+    if not base_url or not url.startswith(ZHIPUAI_API_BASE):
+        return url
+    if url == ZHIPUAI_URL:
+        return base_url
+    root = base_url.rstrip("/").removesuffix("/chat/completions")
+    return f"{root}{url[len(ZHIPUAI_API_BASE):]}"
 
 class AIRequestHandler(Protocol):
     async def send_request(self, api_key: str, payload: Dict[str, Any], options: Dict[str, Any]) -> Any: pass
     async def handle_tool_call(self, api_key: str, tool_call: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]: pass
 
-def _handle_error_status(status: int, error_text: str) -> None:
+def _handle_error_status(status: int, error_text: str, headers: Any = None) -> None:
+    retry_after = parse_retry_after(headers.get("Retry-After")) if headers else None
     if status == 401:
-        raise HomeAssistantError(ERROR_INVALID_AUTH)
+        raise UpstreamStatusError(ERROR_INVALID_AUTH, status)
     elif status == 429:
-        raise HomeAssistantError(ERROR_TOO_MANY_REQUESTS)
+        raise UpstreamStatusError(ERROR_TOO_MANY_REQUESTS, status, retry_after)
     elif status in [500, 502, 503, 504]:
-        raise HomeAssistantError(ERROR_SERVER_ERROR)
+        raise UpstreamStatusError(ERROR_SERVER_ERROR, status, retry_after)
     else:
-        raise HomeAssistantError(f"{ERROR_UNKNOWN}: {error_text}")
+        raise UpstreamStatusError(f"{ERROR_UNKNOWN}: {error_text}", status)
+
+def _wrap_error(e: Exception) -> HomeAssistantError:
+    if isinstance(e, HomeAssistantError):
+        return e
+    if isinstance(e, asyncio.TimeoutError):
+        return HomeAssistantError(ERROR_TIMEOUT)
+    return HomeAssistantError(f"{ERROR_UNKNOWN}: {str(e)}")
+
+async def _async_post(entry_id: str, url: str, api_key: str, payload: Dict[str, Any], options: Dict[str, Any], timer: RequestTimer | None = None) -> aiohttp.ClientResponse:
+    session = await get_session(entry_id)
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    timeout = aiohttp.ClientTimeout(total=options.get(CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT))
+    if timer is not None:
+        timer.begin_attempt()
+    response = await session.post(url, data=dumps_bytes(payload), headers=headers, timeout=timeout, trace_request_ctx=timer)
+    if response.status != 200:
+        try:
+            error_text = await response.text()
+        finally:
+            response.release()
+        _handle_error_status(response.status, error_text, response.headers)
+    if timer is not None:
+        timer.mark_first_byte()
+    return response
 
 class StreamingRequestHandler:
+    def __init__(self, entry_id: str) -> None:
+        self.entry_id = entry_id
+
     async def send_request(self, api_key: str, payload: Dict[str, Any], options: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
         payload["stream"] = True
         if "request_id" not in payload:
             payload["request_id"] = f"req_{int(time.time() * 1000)}"
         
-        LOGGER.info("发送给AI的消息: %s", json.dumps(payload, ensure_ascii=False))
-
-        for attempt in range(3):
-            try:
-                session = await get_session()
-                headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-                timeout = aiohttp.ClientTimeout(total=options.get(CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT))
-                api_url = options.get("base_url", ZHIPUAI_URL)
-                
-                async with session.post(api_url, json=payload, headers=headers, timeout=timeout) as response:
-                    if response.status != 200:
-                        _handle_error_status(response.status, await response.text())
-
-                    buffer = ""
-                    async for chunk in response.content:
-                        if not chunk: 
-                            continue
-                            
-                        chunk_text = chunk.decode('utf-8')
-                        buffer += chunk_text
-                        
-                        lines = buffer.split("\n")
-                        if len(lines) > 1:
-                            buffer = lines.pop()
-                            
-                            for line in lines:
-                                line = line.strip()
-                                if not line or line == "data: [DONE]":
-                                    continue
-                                    
-                                if line.startswith("data: "):
-                                    try:
-                                        yield json.loads(line[6:])
-                                    except:
-                                        pass
-                    
-                    if buffer.startswith("data: ") and "data: [DONE]" not in buffer:
-                        try:
-                            yield json.loads(buffer[6:])
-                        except:
-                            pass
-                    
-                    return
-                    
-            except (aiohttp.ClientConnectorError, aiohttp.ServerTimeoutError, aiohttp.ClientOSError, asyncio.TimeoutError):
-                if attempt < 2: 
-                    await asyncio.sleep(1.0)
-            except Exception as e:
-                raise HomeAssistantError(f"{ERROR_UNKNOWN}: {str(e)}")
-        
-        raise HomeAssistantError(f"{ERROR_UNKNOWN}")
+        LOGGER.debug("发送给AI的消息: %s", LazyJSON(payload))
+
+        api_url = resolve_api_url(options)
+        timer = RequestTimer(ENDPOINT_CHAT, payload.get("model"))
+        try:
+            response = await async_call_with_retry(
+                ENDPOINT_CHAT, lambda: _async_post(self.entry_id, api_url, api_key, payload, options, timer)
+            )
+        except Exception as e:
+            raise _wrap_error(e) from e
+
+        try:
+            decoder = SSEDecoder()
+            async for chunk in response.content.iter_any():
+                for event in decoder.feed(chunk):
+                    if event.data == "[DONE]":
+                        timer.finish()
+                        return
+                    try:
+                        data = loads(event.data)
+                    except JSONDecodeError:
+                        LOGGER.debug("无法解析的流式数据: %s", event.data)
+                        continue
+                    timer.mark_token()
+                    if "usage" in data:
+                        timer.record_usage(data["usage"])
+                    yield data
+            
+            for event in decoder.flush():
+                if event.data != "[DONE]":
+                    try:
+                        data = loads(event.data)
+                    except JSONDecodeError:
+                        LOGGER.debug("无法解析的流式数据: %s", event.data)
+                        continue
+                    timer.mark_token()
+                    if "usage" in data:
+                        timer.record_usage(data["usage"])
+                    yield data
+            timer.finish()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise _wrap_error(e) from e
+        except (asyncio.CancelledError, GeneratorExit):
+            response.close()
+            raise
+        finally:
+            response.release()
 
     async def handle_tool_call(self, api_key: str, tool_call: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
-        for attempt in range(3):
-            try:
-                session = await get_session()
-                headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-                timeout = aiohttp.ClientTimeout(total=options.get(CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT))
-                api_url = options.get("base_url", ZHIPUAI_URL)
-                tool_url = f"{api_url}/tool_calls"
-                
-                payload = {
-                    "tool_call_id": tool_call["id"],
-                    "name": tool_call["function"]["name"],
-                    "arguments": tool_call["function"]["arguments"],
-                    "stream": False
-                }
-                
-                async with session.post(tool_url, json=payload, headers=headers, timeout=timeout) as response:
-                    if response.status != 200:
-                        _handle_error_status(response.status, await response.text())
-                    return await response.json()
-                    
-            except (aiohttp.ClientConnectorError, aiohttp.ServerTimeoutError, aiohttp.ClientOSError, asyncio.TimeoutError):
-                if attempt < 2: 
-                    await asyncio.sleep(1.0)
-            except Exception as e:
-                raise HomeAssistantError(f"{ERROR_UNKNOWN}: {str(e)}")
-                
-        raise HomeAssistantError(f"{ERROR_UNKNOWN}")
+        api_url = resolve_api_url(options)
+        tool_url = f"{api_url}/tool_calls"
+        payload = {
+            "tool_call_id": tool_call["id"],
+            "name": tool_call["function"]["name"],
+            "arguments": tool_call["function"]["arguments"],
+            "stream": False
+        }
+        timer = RequestTimer(ENDPOINT_TOOL_CALLS, options.get(CONF_CHAT_MODEL, RECOMMENDED_CHAT_MODEL))
+
+        async def _send() -> Dict[str, Any]:
+            response = await _async_post(self.entry_id, tool_url, api_key, payload, options, timer)
+            async with response:
+                return loads(await response.read())
+
+        try:
+            result = await async_call_with_retry(ENDPOINT_TOOL_CALLS, _send)
+            timer.finish()
+            return result
+        except Exception as e:
+            raise _wrap_error(e) from e
 
 class DirectRequestHandler:
+    def __init__(self, entry_id: str) -> None:
+        self.entry_id = entry_id
+
     async def send_request(self, api_key: str, payload: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
-        for attempt in range(3):
-            try:
-                session = await get_session()
-                headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-                timeout = aiohttp.ClientTimeout(total=options.get(CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT))
-                payload_copy = dict(payload)
-                payload_copy["stream"] = False
-                
-                api_url = options.get("base_url", ZHIPUAI_URL)
-                async with session.post(api_url, json=payload_copy, headers=headers, timeout=timeout) as response:
-                    response_json = await response.json()
-                    if response.status != 200:
-                        _handle_error_status(response.status, str(response_json))
-                    return response_json
-                    
-            except (aiohttp.ClientConnectorError, aiohttp.ServerTimeoutError, aiohttp.ClientOSError, asyncio.TimeoutError):
-                if attempt < 2: 
-                    await asyncio.sleep(1.0)
-            except Exception as e:
-                raise HomeAssistantError(f"{ERROR_UNKNOWN}: {str(e)}")
-                
-        raise HomeAssistantError(f"{ERROR_UNKNOWN}")
+        payload_copy = dict(payload)
+        payload_copy["stream"] = False
+        api_url = resolve_api_url(options)
+        timer = RequestTimer(ENDPOINT_CHAT, payload_copy.get("model"))
+
+        async def _send() -> Dict[str, Any]:
+            response = await _async_post(self.entry_id, api_url, api_key, payload_copy, options, timer)
+            async with response:
+                return loads(await response.read())
+
+        try:
+            result = await async_call_with_retry(ENDPOINT_CHAT, _send)
+            timer.finish()
+            timer.record_usage(result.get("usage"))
+            return result
+        except Exception as e:
+            raise _wrap_error(e) from e
 
     async def handle_tool_call(self, api_key: str, tool_call: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
-        return await StreamingRequestHandler().handle_tool_call(api_key, tool_call, options)
+        return await StreamingRequestHandler(self.entry_id).handle_tool_call(api_key, tool_call, options)
 
-def create_request_handler(streaming: bool = True) -> AIRequestHandler:
-    return StreamingRequestHandler() if streaming else DirectRequestHandler()
+def create_request_handler(entry_id: str, streaming: bool = True) -> AIRequestHandler:
+    return StreamingRequestHandler(entry_id) if streaming else DirectRequestHandler(entry_id)
 
-async def send_ai_request(api_key: str, payload: Dict[str, Any], options: Dict[str, Any] = None, timeout=30) -> AsyncGenerator[Dict[str, Any], None]:
+async def send_ai_request(entry_id: str, api_key: str, payload: Dict[str, Any], options: Dict[str, Any] = None, timeout=30) -> AsyncGenerator[Dict[str, Any], None]:
     options = options or {}
-    handler = create_request_handler(True)
-    async for chunk in handler.send_request(api_key, payload, options):
-        yield chunk
+    handler = create_request_handler(entry_id, True)
+
+    def _stream(request_payload: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+        return handler.send_request(api_key, request_payload, options)
+
+    def _upstream() -> AsyncGenerator[Dict[str, Any], None]:
+        if options.get(CONF_HEDGE_ENABLED, DEFAULT_HEDGE_ENABLED):
+            return async_hedged_stream(
+                _stream,
+                payload,
+                options.get(CONF_HEDGE_PERCENTILE, DEFAULT_HEDGE_PERCENTILE),
+                options.get(CONF_HEDGE_MODEL, DEFAULT_HEDGE_MODEL),
+            )
+        return async_timed_stream(_stream(payload), payload.get("model", ""))
+
+    # Tool turns act on the home, so each one goes upstream on its own.
+    if options.get(CONF_REQUEST_COALESCING, DEFAULT_REQUEST_COALESCING) and not payload.get("tools"):
+        stream = async_coalesced_stream(coalesce_key(entry_id, api_key, resolve_api_url(options), payload), _upstream)
+    else:
+        stream = _upstream()
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await stream.aclose()
 
-async def send_api_request(api_key: str, payload: Dict[str, Any], options: Dict[str, Any] = None, timeout=30) -> Dict[str, Any]:
+async def send_api_request(entry_id: str, api_key: str, payload: Dict[str, Any], options: Dict[str, Any] = None, timeout=30) -> Dict[str, Any]:
     options = options or {}
-    handler = create_request_handler(False)
+    handler = create_request_handler(entry_id, False)
     return await handler.send_request(api_key, payload, options)
 
-async def handle_tool_call(api_key: str, tool_call: Dict[str, Any], options: Dict[str, Any] = None) -> Dict[str, Any]:
+async def handle_tool_call(entry_id: str, api_key: str, tool_call: Dict[str, Any], options: Dict[str, Any] = None) -> Dict[str, Any]:
     options = options or {}
-    handler = create_request_handler(False)
+    handler = create_request_handler(entry_id, False)
     return await handler.handle_tool_call(api_key, tool_call, options)
\ No newline at end of file
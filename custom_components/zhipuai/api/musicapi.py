@@ -1,7 +1,8 @@
-import random, json, asyncio, aiohttp, base64, urllib3, tempfile, os, shutil
+import random, json, asyncio, base64, urllib3, tempfile, os, shutil
 from Crypto.Cipher import AES
 import aiofiles
 from functools import partial
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
 try:
     from mutagen.mp3 import MP3
@@ -39,7 +40,7 @@ def get_encrypted_params(song_id):
     random_str = generate_random_str(16)
     return aes_encrypt(first_enc, random_str), rsa_encrypt(random_str, E, F)
 
-async def async_get_song_id(query, prefer_non_vip=False):
+async def async_get_song_id(hass, query, prefer_non_vip=False):
     search_url = "https://music.163.com/api/search/get/web"
     params = {'s': query, 'type': 1, 'limit': 20, 'offset': 0}
     artist_query = None
@@ -49,72 +50,72 @@ async def async_get_song_id(query, prefer_non_vip=False):
         song_query, artist_query = [p.strip() for p in query.split(" - ", 1)]
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(search_url, params=params, headers=HEADERS, ssl=False) as response:
-                result = await response.json()
-                if 'result' in result and 'songs' in result['result'] and result['result']['songs']:
-                    songs = result['result']['songs']
-                    scored_songs = []
+        session = async_get_clientsession(hass)
+        async with session.post(search_url, params=params, headers=HEADERS, ssl=False) as response:
+            result = await response.json()
+            if 'result' in result and 'songs' in result['result'] and result['result']['songs']:
+                songs = result['result']['songs']
+                scored_songs = []
                     
-                    for song in songs:
-                        song_name = song.get('name', '')
-                        artist_names = [artist.get('name', '') for artist in song.get('artists', [])]
-                        is_vip = song.get('fee', 0) == 1
-                        score = 0
+                for song in songs:
+                    song_name = song.get('name', '')
+                    artist_names = [artist.get('name', '') for artist in song.get('artists', [])]
+                    is_vip = song.get('fee', 0) == 1
+                    score = 0
                         
-                        if song_name.lower() == song_query.lower(): score += 100
-                        elif song_name.lower().startswith(song_query.lower()): score += 80
-                        elif song_query.lower() in song_name.lower(): score += 60
+                    if song_name.lower() == song_query.lower(): score += 100
+                    elif song_name.lower().startswith(song_query.lower()): score += 80
+                    elif song_query.lower() in song_name.lower(): score += 60
                         
-                        if artist_query:
-                            artist_score = max([100 if artist.lower() == artist_query.lower() else 80 if artist_query.lower() in artist.lower() else 60 if artist.lower() in artist_query.lower() else 0 for artist in artist_names])
-                            score += artist_score
+                    if artist_query:
+                        artist_score = max([100 if artist.lower() == artist_query.lower() else 80 if artist_query.lower() in artist.lower() else 60 if artist.lower() in artist_query.lower() else 0 for artist in artist_names])
+                        score += artist_score
                         
-                        if song.get('sq'): score += 15
-                        elif song.get('h'): score += 10
-                        if prefer_non_vip and not is_vip: score += 5
+                    if song.get('sq'): score += 15
+                    elif song.get('h'): score += 10
+                    if prefer_non_vip and not is_vip: score += 5
                         
-                        scored_songs.append((song, score))
+                    scored_songs.append((song, score))
                     
-                    scored_songs.sort(key=lambda x: x[1], reverse=True)
-                    return scored_songs[0][0]['id'] if scored_songs else None
+                scored_songs.sort(key=lambda x: x[1], reverse=True)
+                return scored_songs[0][0]['id'] if scored_songs else None
     except Exception:
         return None
 
-async def async_get_mp3_url_advanced(song_id):
+async def async_get_mp3_url_advanced(hass, song_id):
     try:
         payload = {"url": f"https://music.163.com/#/song?id={song_id}", "level": "exhigh", "type": "song", "token": TOUBIEC_API_TOKEN}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(TOUBIEC_API_URL, json=payload, headers=TOUBIEC_API_HEADERS) as response:
-                result = await response.json()
-                if result.get('status') == 200:
-                    return {
-                        "url": result.get('url_info', {}).get('url', ''),
-                        "song_info": {
-                            "name": result.get('song_info', {}).get('name', ''),
-                            "artist": result.get('song_info', {}).get('artist', ''),
-                            "album": result.get('song_info', {}).get('album', ''),
-                            "cover": result.get('song_info', {}).get('cover', '')
-                        },
-                        "lrc": result.get('lrc', {}).get('lyric', '')
-                    }
+        session = async_get_clientsession(hass)
+        async with session.post(TOUBIEC_API_URL, json=payload, headers=TOUBIEC_API_HEADERS) as response:
+            result = await response.json()
+            if result.get('status') == 200:
+                return {
+                    "url": result.get('url_info', {}).get('url', ''),
+                    "song_info": {
+                        "name": result.get('song_info', {}).get('name', ''),
+                        "artist": result.get('song_info', {}).get('artist', ''),
+                        "album": result.get('song_info', {}).get('album', ''),
+                        "cover": result.get('song_info', {}).get('cover', '')
+                    },
+                    "lrc": result.get('lrc', {}).get('lyric', '')
+                }
     except Exception:
         pass
     return {"url": f'http://music.163.com/song/media/outer/url?id={song_id}.mp3', "song_info": {}, "lrc": ""}
 
-async def async_get_mp3_url(song_id):
+async def async_get_mp3_url(hass, song_id):
     try:
         params, encSecKey = get_encrypted_params(song_id)
-        async with aiohttp.ClientSession() as session:
-            async with session.post('https://music.163.com/weapi/song/enhance/player/url/v1?csrf_token=', data={'params': params, 'encSecKey': encSecKey}, headers=HEADERS, ssl=False) as response:
-                result = await response.json()
-                if result.get('data') and result['data'] and result['data'][0].get('url'):
-                    return {"url": result['data'][0]['url'], "song_info": {}, "lrc": ""}
+        session = async_get_clientsession(hass)
+        async with session.post('https://music.163.com/weapi/song/enhance/player/url/v1?csrf_token=', data={'params': params, 'encSecKey': encSecKey}, headers=HEADERS, ssl=False) as response:
+            result = await response.json()
+            if result.get('data') and result['data'] and result['data'][0].get('url'):
+                return {"url": result['data'][0]['url'], "song_info": {}, "lrc": ""}
     except Exception:
         pass
-    return await async_get_mp3_url_advanced(song_id)
+    return await async_get_mp3_url_advanced(hass, song_id)
 
-async def async_get_song_duration(url):
+async def async_get_song_duration(hass, url):
     if not HAS_MUTAGEN:
         return 0
         
@@ -123,13 +124,13 @@ async def async_get_song_duration(url):
         temp_dir = tempfile.mkdtemp()
         temp_file = os.path.join(temp_dir, "temp_song.mp3")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=HEADERS, ssl=False) as response:
-                if response.status != 200:
-                    return 0
+        session = async_get_clientsession(hass)
+        async with session.get(url, headers=HEADERS, ssl=False) as response:
+            if response.status != 200:
+                return 0
                     
-                async with aiofiles.open(temp_file, 'wb') as f:
-                    await f.write(await response.read())
+            async with aiofiles.open(temp_file, 'wb') as f:
+                await f.write(await response.read())
         
         loop = asyncio.get_event_loop()
         duration = await loop.run_in_executor(None, lambda: int(MP3(temp_file).info.length))
@@ -144,46 +145,46 @@ async def async_get_song_duration(url):
             except Exception:
                 pass
 
-async def async_search_song(query, prefer_non_vip=False):
-    song_id = await async_get_song_id(query, prefer_non_vip)
+async def async_search_song(hass, query, prefer_non_vip=False):
+    song_id = await async_get_song_id(hass, query, prefer_non_vip)
     if song_id:
         try:
             payload = {"url": f"https://music.163.com/#/song?id={song_id}", "level": "exhigh", "type": "song", "token": TOUBIEC_API_TOKEN}
-            async with aiohttp.ClientSession() as session:
-                async with session.post(TOUBIEC_API_URL, json=payload, headers=TOUBIEC_API_HEADERS) as response:
-                    result = await response.json()
-                    if result.get('status') == 200:
-                        song_url = result['url_info']['url']
-                        song_info = result['song_info']
-                        song_info['duration'] = await async_get_song_duration(song_url)
-                        return {"success": True, "url": song_url, "song_id": song_id, "song_info": song_info}
+            session = async_get_clientsession(hass)
+            async with session.post(TOUBIEC_API_URL, json=payload, headers=TOUBIEC_API_HEADERS) as response:
+                result = await response.json()
+                if result.get('status') == 200:
+                    song_url = result['url_info']['url']
+                    song_info = result['song_info']
+                    song_info['duration'] = await async_get_song_duration(hass, song_url)
+                    return {"success": True, "url": song_url, "song_id": song_id, "song_info": song_info}
         except Exception:
             pass
     return {"success": False, "message": f"未找到歌曲: {query}"}
 
-def search_song(query):
+def search_song(hass, query):
     loop = asyncio.get_event_loop()
-    return loop.run_until_complete(async_search_song(query)) if not loop.is_running() else {"success": False, "message": "不能在事件循环中同步调用"}
+    return loop.run_until_complete(async_search_song(hass, query)) if not loop.is_running() else {"success": False, "message": "不能在事件循环中同步调用"}
 
-async def async_get_playlist_songs(playlist_id):
+async def async_get_playlist_songs(hass, playlist_id):
     try:
         payload = {"url": f"https://music.163.com/#/playlist?id={playlist_id}", "type": "playlist", "token": TOUBIEC_API_TOKEN}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(TOUBIEC_API_URL, json=payload, headers=TOUBIEC_API_HEADERS) as response:
-                result = await response.json()
-                if result.get('status') == 200 and 'playlist' in result:
-                    tracks = result.get('playlist', {}).get('tracks', [])
-                    return {
-                        "success": True,
-                        "playlist_name": result.get('playlist', {}).get('name', ''),
-                        "songs": [{
-                            "id": track.get('id'),
-                            "name": track.get('name', ''),
-                            "artist": track.get('ar', [{}])[0].get('name', ''),
-                            "album": track.get('al', {}).get('name', ''),
-                            "cover": track.get('al', {}).get('picUrl', '')
-                        } for track in tracks]
-                    }
+        session = async_get_clientsession(hass)
+        async with session.post(TOUBIEC_API_URL, json=payload, headers=TOUBIEC_API_HEADERS) as response:
+            result = await response.json()
+            if result.get('status') == 200 and 'playlist' in result:
+                tracks = result.get('playlist', {}).get('tracks', [])
+                return {
+                    "success": True,
+                    "playlist_name": result.get('playlist', {}).get('name', ''),
+                    "songs": [{
+                        "id": track.get('id'),
+                        "name": track.get('name', ''),
+                        "artist": track.get('ar', [{}])[0].get('name', ''),
+                        "album": track.get('al', {}).get('name', ''),
+                        "cover": track.get('al', {}).get('picUrl', '')
+                    } for track in tracks]
+                }
     except Exception as e:
         return {"success": False, "message": f"处理播放列表时出错: {str(e)}"}
     return {"success": False, "message": f"获取播放列表失败: {playlist_id}"}
\ No newline at end of file
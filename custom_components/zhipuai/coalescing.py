@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+
+from homeassistant.exceptions import HomeAssistantError
+
+from .codec import dumps_bytes
+from .const import LOGGER
+
+CoalesceKey = Tuple[str, str, str, bytes]
+
+
+class CoalesceStats:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.upstream = 0
+        self.coalesced = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "upstream": self.upstream,
+            "coalesced": self.coalesced,
+            "coalesce_rate": round(self.coalesced / self.requests, 4) if self.requests else 0.0,
+        }
+
+
+class _Flight:
+    """One upstream stream, buffered so every caller sees all of it."""
+
+    def __init__(self, key: CoalesceKey, stream: AsyncGenerator[Dict[str, Any], None]) -> None:
+        self.key = key
+        self.chunks: List[Dict[str, Any]] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._pump(stream))
+
+    async def _pump(self, stream: AsyncGenerator[Dict[str, Any], None]) -> None:
+        try:
+            async for chunk in stream:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = HomeAssistantError("合并的请求已被取消")
+            raise
+        except Exception as err:
+            self.error = err
+        finally:
+            self.finished = True
+            self._notify()
+            if _INFLIGHT.get(self.key) is self:
+                del _INFLIGHT[self.key]
+            with contextlib.suppress(Exception):
+                await stream.aclose()
+
+    def _notify(self) -> None:
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    async def subscribe(self) -> AsyncGenerator[Dict[str, Any], None]:
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                if index < len(self.chunks):
+                    index += 1
+                    yield self.chunks[index - 1]
+                elif self.finished:
+                    if self.error is not None:
+                        # A fresh error per caller; re-raising the shared one grows its traceback.
+                        raise HomeAssistantError(str(self.error)) from self.error
+                    return
+                else:
+                    await self._wakeup.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.finished:
+                # Every caller left, nobody needs the rest of the answer.
+                if _INFLIGHT.get(self.key) is self:
+                    del _INFLIGHT[self.key]
+                self._task.cancel()
+                await asyncio.gather(self._task, return_exceptions=True)
+
+
+_INFLIGHT: Dict[CoalesceKey, _Flight] = {}
+_STATS = CoalesceStats()
+
+
+def get_coalesce_stats() -> Dict[str, Any]:
+    return _STATS.as_dict()
+
+
+def coalesce_key(entry_id: str, api_key: str, url: str, payload: Dict[str, Any]) -> CoalesceKey:
+    """Requests of one entry equal but for ``request_id`` share a key.
+
+    Payloads are built by the same code, so their fields come in the same
+    order and the serialised form is enough to compare them.
+    """
+    return entry_id, api_key, url, dumps_bytes({name: value for name, value in payload.items() if name != "request_id"})
+
+
+async def async_cancel_flights(entry_id: str) -> None:
+    """Stop the upstream streams an unloading entry still has in flight."""
+    flights = [flight for key, flight in _INFLIGHT.items() if key[0] == entry_id]
+    for flight in flights:
+        del _INFLIGHT[flight.key]
+        flight._task.cancel()
+    if flights:
+        await asyncio.gather(*(flight._task for flight in flights), return_exceptions=True)
+
+
+async def async_coalesced_stream(
+    key: CoalesceKey,
+    factory: Callable[[], AsyncGenerator[Dict[str, Any], None]],
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Join the in-flight request under ``key``, or start it.
+
+    The upstream stream runs on its own, so a caller leaving early does not
+    cut off the others; it is cancelled only when all of them have left.
+    Chunks that arrived before a caller joined are replayed to it first.
+    """
+    _STATS.requests += 1
+    flight = _INFLIGHT.get(key)
+    if flight is None:
+        _STATS.upstream += 1
+        flight = _INFLIGHT[key] = _Flight(key, factory())
+    else:
+        _STATS.coalesced += 1
+        LOGGER.debug("合并相同的进行中请求, 已有 %d 个等待者", flight.subscribers)
+    stream = flight.subscribe()
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await stream.aclose()
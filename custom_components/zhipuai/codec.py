@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson ships with Home Assistant
+    orjson = None
+
+JSONDecodeError = json.JSONDecodeError
+
+if orjson is not None:
+    BACKEND = "orjson"
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def loads(data: str | bytes | bytearray | memoryview) -> Any:
+        return orjson.loads(data)
+
+    def dumps_bytes(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+        except TypeError:
+            return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+    def dumps(obj: Any) -> str:
+        return dumps_bytes(obj).decode("utf-8")
+
+else:
+    BACKEND = "json"
+
+    def loads(data: str | bytes | bytearray | memoryview) -> Any:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return dumps(obj).encode("utf-8")
+
+
+class LazyJSON:
+    """Defers serialisation to the logging call that actually emits the record."""
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj: Any) -> None:
+        self.obj = obj
+
+    def __str__(self) -> str:
+        try:
+            return dumps(self.obj)
+        except (TypeError, ValueError):
+            return repr(self.obj)
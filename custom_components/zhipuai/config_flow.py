@@ -13,6 +13,7 @@ from homeassistant.config_entries import (
 from homeassistant import exceptions
 from homeassistant.const import CONF_API_KEY, CONF_NAME, CONF_LLM_HASS_API
 from homeassistant.helpers import llm
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.selector import (
     NumberSelector,
@@ -63,6 +64,36 @@ from .const import (
     DEFAULT_FILTER_MARKDOWN,
     CONF_NOTIFY_SERVICE,
     DEFAULT_NOTIFY_SERVICE,
+    CONF_POOL_LIMIT,
+    DEFAULT_POOL_LIMIT,
+    CONF_POOL_LIMIT_PER_HOST,
+    DEFAULT_POOL_LIMIT_PER_HOST,
+    CONF_DNS_CACHE_TTL,
+    DEFAULT_DNS_CACHE_TTL,
+    CONF_KEEPALIVE_TIMEOUT,
+    DEFAULT_KEEPALIVE_TIMEOUT,
+    CONF_PREWARM,
+    DEFAULT_PREWARM,
+    CONF_PREWARM_CONNECTIONS,
+    DEFAULT_PREWARM_CONNECTIONS,
+    CONF_HEDGE_ENABLED,
+    DEFAULT_HEDGE_ENABLED,
+    CONF_HEDGE_PERCENTILE,
+    DEFAULT_HEDGE_PERCENTILE,
+    CONF_HEDGE_MODEL,
+    DEFAULT_HEDGE_MODEL,
+    CONF_CONTEXT_TOKEN_BUDGET,
+    DEFAULT_CONTEXT_TOKEN_BUDGET,
+    CONF_PERSIST_HISTORY,
+    DEFAULT_PERSIST_HISTORY,
+    CONF_TOOL_TOP_K,
+    DEFAULT_TOOL_TOP_K,
+    CONF_SPECULATIVE_LOCAL,
+    DEFAULT_SPECULATIVE_LOCAL,
+    CONF_RESPONSE_CACHE,
+    DEFAULT_RESPONSE_CACHE,
+    CONF_REQUEST_COALESCING,
+    DEFAULT_REQUEST_COALESCING,
 )
 
 
@@ -216,23 +247,23 @@ class ZhipuAIConfigFlow(ConfigFlow, domain=DOMAIN):
             "messages": [{"role": "user", "content": "你好"}]
         }
         
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, headers=headers, json=data) as response:
-                    if response.status == 200:
-                        return
-                    elif response.status == 401:
-                        raise UnauthorizedError()
+        session = async_get_clientsession(self.hass)
+        try:
+            async with session.post(url, headers=headers, json=data) as response:
+                if response.status == 200:
+                    return
+                elif response.status == 401:
+                    raise UnauthorizedError()
+                else:
+                    response_json = await response.json()
+                    error = response_json.get("error", {})
+                    error_message = error.get("message", "")
+                    if "model not found" in error_message.lower():
+                        raise ModelNotFound()
                     else:
-                        response_json = await response.json()
-                        error = response_json.get("error", {})
-                        error_message = error.get("message", "")
-                        if "model not found" in error_message.lower():
-                            raise ModelNotFound()
-                        else:
-                            raise InvalidAPIKey()
-            except aiohttp.ClientError as e:
-                raise
+                        raise InvalidAPIKey()
+        except aiohttp.ClientError as e:
+            raise
 
     @staticmethod
     @callback
@@ -394,6 +425,11 @@ def zhipuai_config_option_schema(
             description={"suggested_value": options.get(CONF_MAX_HISTORY_MESSAGES)},
             default=RECOMMENDED_MAX_HISTORY_MESSAGES,
         ): int,
+        vol.Optional(
+            CONF_PERSIST_HISTORY,
+            default=options.get(CONF_PERSIST_HISTORY, DEFAULT_PERSIST_HISTORY),
+            description={"suggested_value": options.get(CONF_PERSIST_HISTORY, DEFAULT_PERSIST_HISTORY)},
+        ): bool,
         vol.Optional(
             CONF_MAX_TOOL_ITERATIONS,
             description={"suggested_value": options.get(CONF_MAX_TOOL_ITERATIONS, DEFAULT_MAX_TOOL_ITERATIONS)},
@@ -511,6 +547,85 @@ def zhipuai_config_option_schema(
                     translation_key="tool_choice"
                 )
             ),
+            vol.Optional(
+                CONF_POOL_LIMIT,
+                description={"suggested_value": options.get(CONF_POOL_LIMIT, DEFAULT_POOL_LIMIT)},
+                default=DEFAULT_POOL_LIMIT,
+            ): vol.All(vol.Coerce(int), vol.Range(min=1, max=100)),
+            vol.Optional(
+                CONF_POOL_LIMIT_PER_HOST,
+                description={"suggested_value": options.get(CONF_POOL_LIMIT_PER_HOST, DEFAULT_POOL_LIMIT_PER_HOST)},
+                default=DEFAULT_POOL_LIMIT_PER_HOST,
+            ): vol.All(vol.Coerce(int), vol.Range(min=1, max=50)),
+            vol.Optional(
+                CONF_DNS_CACHE_TTL,
+                description={"suggested_value": options.get(CONF_DNS_CACHE_TTL, DEFAULT_DNS_CACHE_TTL)},
+                default=DEFAULT_DNS_CACHE_TTL,
+            ): vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+            vol.Optional(
+                CONF_KEEPALIVE_TIMEOUT,
+                description={"suggested_value": options.get(CONF_KEEPALIVE_TIMEOUT, DEFAULT_KEEPALIVE_TIMEOUT)},
+                default=DEFAULT_KEEPALIVE_TIMEOUT,
+            ): vol.All(vol.Coerce(float), vol.Range(min=5, max=300)),
+            vol.Optional(
+                CONF_PREWARM,
+                default=options.get(CONF_PREWARM, DEFAULT_PREWARM),
+                description={"suggested_value": options.get(CONF_PREWARM, DEFAULT_PREWARM)},
+            ): bool,
+            vol.Optional(
+                CONF_PREWARM_CONNECTIONS,
+                description={"suggested_value": options.get(CONF_PREWARM_CONNECTIONS, DEFAULT_PREWARM_CONNECTIONS)},
+                default=DEFAULT_PREWARM_CONNECTIONS,
+            ): vol.All(vol.Coerce(int), vol.Range(min=1, max=8)),
+            vol.Optional(
+                CONF_HEDGE_ENABLED,
+                default=options.get(CONF_HEDGE_ENABLED, DEFAULT_HEDGE_ENABLED),
+                description={"suggested_value": options.get(CONF_HEDGE_ENABLED, DEFAULT_HEDGE_ENABLED)},
+            ): bool,
+            vol.Optional(
+                CONF_HEDGE_PERCENTILE,
+                description={"suggested_value": options.get(CONF_HEDGE_PERCENTILE, DEFAULT_HEDGE_PERCENTILE)},
+                default=DEFAULT_HEDGE_PERCENTILE,
+            ): vol.All(vol.Coerce(int), vol.Range(min=50, max=99)),
+            vol.Optional(
+                CONF_HEDGE_MODEL,
+                description={"suggested_value": options.get(CONF_HEDGE_MODEL, DEFAULT_HEDGE_MODEL)},
+                default=DEFAULT_HEDGE_MODEL,
+            ): SelectSelector(SelectSelectorConfig(
+                options=[
+                    SelectOptionDict(
+                        value=model_id,
+                        label=model_id
+                    )
+                    for model_id in ZHIPUAI_MODELS
+                ],
+                translation_key="model_descriptions"
+            )),
+            vol.Optional(
+                CONF_CONTEXT_TOKEN_BUDGET,
+                description={"suggested_value": options.get(CONF_CONTEXT_TOKEN_BUDGET, DEFAULT_CONTEXT_TOKEN_BUDGET)},
+                default=DEFAULT_CONTEXT_TOKEN_BUDGET,
+            ): vol.All(vol.Coerce(int), vol.Range(min=1000, max=128000)),
+            vol.Optional(
+                CONF_TOOL_TOP_K,
+                description={"suggested_value": options.get(CONF_TOOL_TOP_K, DEFAULT_TOOL_TOP_K)},
+                default=DEFAULT_TOOL_TOP_K,
+            ): vol.All(vol.Coerce(int), vol.Range(min=0, max=64)),
+            vol.Optional(
+                CONF_SPECULATIVE_LOCAL,
+                description={"suggested_value": options.get(CONF_SPECULATIVE_LOCAL, DEFAULT_SPECULATIVE_LOCAL)},
+                default=DEFAULT_SPECULATIVE_LOCAL,
+            ): bool,
+            vol.Optional(
+                CONF_RESPONSE_CACHE,
+                description={"suggested_value": options.get(CONF_RESPONSE_CACHE, DEFAULT_RESPONSE_CACHE)},
+                default=DEFAULT_RESPONSE_CACHE,
+            ): bool,
+            vol.Optional(
+                CONF_REQUEST_COALESCING,
+                description={"suggested_value": options.get(CONF_REQUEST_COALESCING, DEFAULT_REQUEST_COALESCING)},
+                default=DEFAULT_REQUEST_COALESCING,
+            ): bool,
         })
 
     return schema
@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import timedelta
+from typing import Any, Mapping
+
+import aiohttp
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.event import async_call_later, async_track_time_interval
+from yarl import URL
+
+from .const import (
+    LOGGER,
+    CONF_POOL_LIMIT,
+    DEFAULT_POOL_LIMIT,
+    CONF_POOL_LIMIT_PER_HOST,
+    DEFAULT_POOL_LIMIT_PER_HOST,
+    CONF_DNS_CACHE_TTL,
+    DEFAULT_DNS_CACHE_TTL,
+    CONF_KEEPALIVE_TIMEOUT,
+    DEFAULT_KEEPALIVE_TIMEOUT,
+    CONF_REQUEST_TIMEOUT,
+    DEFAULT_REQUEST_TIMEOUT,
+    CONF_PREWARM,
+    DEFAULT_PREWARM,
+    CONF_PREWARM_CONNECTIONS,
+    DEFAULT_PREWARM_CONNECTIONS,
+    PREWARM_RENEW_RATIO,
+    PREWARM_TIMEOUT,
+    PREWARM_MIN_INTERVAL,
+    ZHIPUAI_URL,
+)
+from .metrics import RequestTimer
+from .retry import ENDPOINT_CHAT
+
+_POOLS: dict[str, "ZhipuAIConnectionPool"] = {}
+
+
+def _pool_config(options: Mapping[str, Any]) -> dict[str, Any]:
+    limit = int(options.get(CONF_POOL_LIMIT, DEFAULT_POOL_LIMIT))
+    return {
+        "limit": limit,
+        "limit_per_host": min(int(options.get(CONF_POOL_LIMIT_PER_HOST, DEFAULT_POOL_LIMIT_PER_HOST)), limit),
+        "ttl_dns_cache": int(options.get(CONF_DNS_CACHE_TTL, DEFAULT_DNS_CACHE_TTL)),
+        "keepalive_timeout": float(options.get(CONF_KEEPALIVE_TIMEOUT, DEFAULT_KEEPALIVE_TIMEOUT)),
+    }
+
+
+def _prewarm_config(options: Mapping[str, Any]) -> dict[str, Any]:
+    return {
+        "enabled": bool(options.get(CONF_PREWARM, DEFAULT_PREWARM)),
+        "connections": int(options.get(CONF_PREWARM_CONNECTIONS, DEFAULT_PREWARM_CONNECTIONS)),
+        "url": str(URL(options.get("base_url") or ZHIPUAI_URL).origin()),
+    }
+
+
+def _is_chat_request(trace_config_ctx) -> bool:
+    request_ctx = getattr(trace_config_ctx, "trace_request_ctx", None)
+    return isinstance(request_ctx, RequestTimer) and request_ctx.endpoint == ENDPOINT_CHAT
+
+
+class ZhipuAIConnectionPool:
+    def __init__(self, hass: HomeAssistant, entry_id: str, options: Mapping[str, Any]) -> None:
+        self.hass = hass
+        self.entry_id = entry_id
+        self._config = _pool_config(options)
+        self._retire_delay = float(options.get(CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT))
+        self._session: aiohttp.ClientSession | None = None
+        self._retired: list[aiohttp.ClientSession] = []
+        self._retire_unsubs: list = []
+        self._lock = asyncio.Lock()
+        self._closed = False
+        self._prewarm = _prewarm_config(options)
+        self._prewarm_unsub = None
+        self._prewarm_task: asyncio.Task | None = None
+        self._last_prewarm = 0.0
+        self._stats = {"warm_hits": 0, "cold_connects": 0, "prewarm_runs": 0, "prewarm_failures": 0}
+
+    @property
+    def config(self) -> dict[str, Any]:
+        return dict(self._config)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        requests = self._stats["warm_hits"] + self._stats["cold_connects"]
+        return {
+            **self._stats,
+            "warm_hit_rate": round(self._stats["warm_hits"] / requests, 4) if requests else None,
+        }
+
+    async def async_get_session(self) -> aiohttp.ClientSession:
+        if self._closed:
+            raise HomeAssistantError("连接池已关闭")
+        if self._session is None or self._session.closed:
+            async with self._lock:
+                if self._session is None or self._session.closed:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self._config["limit"],
+            limit_per_host=self._config["limit_per_host"],
+            use_dns_cache=True,
+            ttl_dns_cache=self._config["ttl_dns_cache"],
+            keepalive_timeout=self._config["keepalive_timeout"],
+            enable_cleanup_closed=True,
+        )
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+        trace_config.on_connection_create_start.append(self._on_connection_create_start)
+        trace_config.on_connection_create_end.append(self._on_connection_created)
+        LOGGER.debug("创建连接池会话: %s", self._config)
+        return aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+
+    async def _on_connection_reused(self, session, trace_config_ctx, params) -> None:
+        if _is_chat_request(trace_config_ctx):
+            self._stats["warm_hits"] += 1
+
+    async def _on_connection_create_start(self, session, trace_config_ctx, params) -> None:
+        trace_config_ctx.connect_start = time.monotonic()
+
+    async def _on_connection_created(self, session, trace_config_ctx, params) -> None:
+        if _is_chat_request(trace_config_ctx):
+            self._stats["cold_connects"] += 1
+        timer = getattr(trace_config_ctx, "trace_request_ctx", None)
+        if isinstance(timer, RequestTimer) and hasattr(trace_config_ctx, "connect_start"):
+            timer.record_connect(time.monotonic() - trace_config_ctx.connect_start)
+
+    @callback
+    def async_start_prewarm(self) -> None:
+        self._stop_prewarm_timer()
+        if not self._prewarm["enabled"] or self._closed:
+            return
+        interval = max(PREWARM_MIN_INTERVAL, self._config["keepalive_timeout"] * PREWARM_RENEW_RATIO)
+        self._prewarm_unsub = async_track_time_interval(
+            self.hass, self._async_prewarm_interval, timedelta(seconds=interval)
+        )
+        self.async_request_prewarm()
+
+    def _stop_prewarm_timer(self) -> None:
+        if self._prewarm_unsub is not None:
+            self._prewarm_unsub()
+            self._prewarm_unsub = None
+
+    @callback
+    def _async_prewarm_interval(self, _now) -> None:
+        self.async_request_prewarm(force=True)
+
+    @callback
+    def async_request_prewarm(self, force: bool = False) -> None:
+        if not self._prewarm["enabled"] or self._closed:
+            return
+        if self._prewarm_task is not None and not self._prewarm_task.done():
+            return
+        if not force and time.monotonic() - self._last_prewarm < PREWARM_MIN_INTERVAL:
+            return
+        self._last_prewarm = time.monotonic()
+        self._prewarm_task = self.hass.async_create_background_task(
+            self.async_prewarm(), f"zhipuai_prewarm_{self.entry_id}"
+        )
+
+    async def async_prewarm(self) -> None:
+        session = await self.async_get_session()
+        timeout = aiohttp.ClientTimeout(total=PREWARM_TIMEOUT)
+        count = max(1, min(self._prewarm["connections"], self._config["limit_per_host"]))
+
+        async def _open_connection() -> None:
+            async with session.head(self._prewarm["url"], timeout=timeout):
+                pass
+
+        results = await asyncio.gather(*(_open_connection() for _ in range(count)), return_exceptions=True)
+        failures = sum(isinstance(result, Exception) for result in results)
+        self._stats["prewarm_runs"] += 1
+        self._stats["prewarm_failures"] += failures
+        LOGGER.debug("连接预热完成: %s 个连接，失败 %s 个，统计: %s", count, failures, self.stats)
+
+    async def async_update_options(self, options: Mapping[str, Any]) -> None:
+        self._retire_delay = float(options.get(CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT))
+        config = _pool_config(options)
+        prewarm = _prewarm_config(options)
+        if config == self._config and prewarm == self._prewarm:
+            return
+        self._prewarm = prewarm
+        if config != self._config:
+            self._config = config
+            async with self._lock:
+                old_session, self._session = self._session, None
+            if old_session is not None and not old_session.closed:
+                self._retire_session(old_session)
+        self.async_start_prewarm()
+
+    def _retire_session(self, session: aiohttp.ClientSession) -> None:
+        self._retired.append(session)
+
+        @callback
+        def _close_retired(_now) -> None:
+            if session in self._retired:
+                self._retired.remove(session)
+                self.hass.async_create_task(session.close())
+
+        self._retire_unsubs.append(async_call_later(self.hass, self._retire_delay, _close_retired))
+
+    async def async_close(self) -> None:
+        self._closed = True
+        self._stop_prewarm_timer()
+        if self._prewarm_task is not None and not self._prewarm_task.done():
+            self._prewarm_task.cancel()
+        for unsub in self._retire_unsubs:
+            unsub()
+        self._retire_unsubs.clear()
+        sessions = [*self._retired, self._session]
+        self._retired.clear()
+        self._session = None
+        for session in sessions:
+            if session is not None and not session.closed:
+                await session.close()
+
+
+@callback
+def async_register_pool(pool: ZhipuAIConnectionPool) -> None:
+    _POOLS[pool.entry_id] = pool
+
+
+@callback
+def async_unregister_pool(entry_id: str) -> None:
+    _POOLS.pop(entry_id, None)
+
+
+def get_pool(entry_id: str) -> ZhipuAIConnectionPool | None:
+    return _POOLS.get(entry_id)
+
+
+async def async_get_session(entry_id: str) -> aiohttp.ClientSession:
+    pool = get_pool(entry_id)
+    if pool is None:
+        raise HomeAssistantError(f"配置项 {entry_id} 的连接池未初始化")
+    return await pool.async_get_session()
@@ -31,7 +31,8 @@ STATE_READY = "就绪"
 STATE_SPEAKING = "说话中"
 STATE_ERROR = "错误"
 
-ZHIPUAI_URL = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
+ZHIPUAI_API_BASE = "https://open.bigmodel.cn/api/paas/v4"
+ZHIPUAI_URL = f"{ZHIPUAI_API_BASE}/chat/completions"
 
 
 DEFAULT_LANGUAGE = "zh-CN"
@@ -43,10 +44,93 @@ ERROR_SERVER_ERROR = "AI服务器暂时不可用，请稍后再试"
 ERROR_TIMEOUT = "请求超时，请稍后再试"
 ERROR_UNKNOWN = "未知错误"
 
+CONF_POOL_LIMIT = "pool_limit"
+DEFAULT_POOL_LIMIT = 20
+CONF_POOL_LIMIT_PER_HOST = "pool_limit_per_host"
+DEFAULT_POOL_LIMIT_PER_HOST = 8
+CONF_DNS_CACHE_TTL = "dns_cache_ttl"
+DEFAULT_DNS_CACHE_TTL = 300
+CONF_KEEPALIVE_TIMEOUT = "keepalive_timeout"
+DEFAULT_KEEPALIVE_TIMEOUT = 60.0
+CONF_PREWARM = "prewarm"
+DEFAULT_PREWARM = False
+CONF_PREWARM_CONNECTIONS = "prewarm_connections"
+DEFAULT_PREWARM_CONNECTIONS = 2
+PREWARM_RENEW_RATIO = 0.75
+PREWARM_TIMEOUT = 5.0
+PREWARM_MIN_INTERVAL = 2.0
+
+CONF_HEDGE_ENABLED = "hedge_enabled"
+DEFAULT_HEDGE_ENABLED = False
+CONF_HEDGE_PERCENTILE = "hedge_percentile"
+DEFAULT_HEDGE_PERCENTILE = 90
+CONF_HEDGE_MODEL = "hedge_model"
+DEFAULT_HEDGE_MODEL = "glm-4-flash-250414"
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.3
+HEDGE_BUDGET_RATIO = 0.1
+HEDGE_BUDGET_MIN_PER_SECOND = 0.02
+HEDGE_BUDGET_MAX_TOKENS = 3.0
+TTFT_WINDOW_SIZE = 200
+
+METRICS_WINDOW_SIZE = 500
+METRICS_SCAN_INTERVAL = 30
+
+CONF_CONTEXT_TOKEN_BUDGET = "context_token_budget"
+DEFAULT_CONTEXT_TOKEN_BUDGET = 8000
+CONTEXT_MIN_BUDGET = 1024
+CONTEXT_RECENT_MESSAGES = 4
+CONTEXT_MESSAGE_OVERHEAD = 4
+DEFAULT_MODEL_CONTEXT_WINDOW = 128000
+MODEL_CONTEXT_WINDOWS = (
+    ("glm-4-long", 1000000),
+    ("glm-4v", 8000),
+    ("glm-z1", 32000),
+    ("glm-zero", 16000),
+    ("charglm", 8000),
+    ("emohaa", 8000),
+    ("glm-4", 128000),
+)
+
 MAX_RETRIES = 3  
 RETRY_DELAY = 1  
+RETRY_MAX_DELAY = 8.0
+MAX_RETRY_AFTER = 10.0
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MIN_PER_SECOND = 0.5
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30.0
+ERROR_CIRCUIT_OPEN = "AI服务连续失败，已暂停请求，请稍后再试"
 MAX_HISTORY_LENGTH = 10  
 
+CONF_PERSIST_HISTORY = "persist_history"
+DEFAULT_PERSIST_HISTORY = False
+HISTORY_TTL = 6 * 3600
+HISTORY_MAX_CONVERSATIONS = 50
+HISTORY_MAX_CHARS = 200000
+HISTORY_MAX_USER_MESSAGE_LENGTH = 300
+HISTORY_SAVE_DELAY = 10
+HISTORY_STORAGE_VERSION = 1
+
+TOOL_CACHE_SIZE = 8
+CONF_TOOL_TOP_K = "tool_top_k"
+DEFAULT_TOOL_TOP_K = 8
+TOOL_CORE_SET = frozenset({"GetLiveContext", "HassTurnOn", "HassTurnOff"})
+TOOL_SCORE_RATIO = 0.3
+
+CONF_SPECULATIVE_LOCAL = "speculative_local"
+DEFAULT_SPECULATIVE_LOCAL = False
+SPECULATIVE_STATS_WINDOW = 50
+
+CONF_RESPONSE_CACHE = "response_cache"
+DEFAULT_RESPONSE_CACHE = False
+RESPONSE_CACHE_TTL = 1800
+RESPONSE_CACHE_SIZE = 64
+RESPONSE_CACHE_READ_ONLY_TOOLS = frozenset({"GetLiveContext", "HassGetState", "HassGetWeather"})
+
+CONF_REQUEST_COALESCING = "request_coalescing"
+DEFAULT_REQUEST_COALESCING = False
+
 ZHIPUAI_WEB_SEARCH_URL = "https://open.bigmodel.cn/api/paas/v4/tools"
 
 CONF_WEB_SEARCH_STREAM = "web_search_stream"
@@ -78,6 +162,8 @@ DEFAULT_HISTORY_INTERVAL = 10
 DEFAULT_HISTORY_ANALYSIS = False
 DEFAULT_HISTORY_DAYS = 1
 MAX_HISTORY_DAYS = 15
+ENTITY_HISTORY_MAX_ENTITIES = 64
+ENTITY_HISTORY_MAX_SAMPLES = 2000
 
 CONF_PRESENCE_PENALTY = "presence_penalty"
 CONF_FREQUENCY_PENALTY = "frequency_penalty"
@@ -93,6 +179,7 @@ DEFAULT_LOGIT_BIAS = {}
 
 CONF_FILTER_MARKDOWN = "filter_markdown"
 DEFAULT_FILTER_MARKDOWN = "off"
+MARKDOWN_STREAM_MAX_PENDING = 1024
 
 CONF_NOTIFY_SERVICE = "notify_service"
 DEFAULT_NOTIFY_SERVICE = "persistent_notification"
@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import math
+import re
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from .codec import dumps
+from .const import (
+    CONF_CONTEXT_TOKEN_BUDGET,
+    CONF_MAX_TOKENS,
+    CONTEXT_MESSAGE_OVERHEAD,
+    CONTEXT_MIN_BUDGET,
+    CONTEXT_RECENT_MESSAGES,
+    DEFAULT_CONTEXT_TOKEN_BUDGET,
+    DEFAULT_MODEL_CONTEXT_WINDOW,
+    MODEL_CONTEXT_WINDOWS,
+    RECOMMENDED_MAX_TOKENS,
+)
+
+SECTION_SYSTEM = "system"
+SECTION_TOOLS = "tools"
+SECTION_QUESTION = "question"
+SECTION_RECENT = "recent_turns"
+SECTION_OLDER = "older_turns"
+SECTION_HISTORY_ANALYSIS = "history_analysis"
+
+SECTIONS = (SECTION_SYSTEM, SECTION_TOOLS, SECTION_QUESTION, SECTION_RECENT, SECTION_OLDER, SECTION_HISTORY_ANALYSIS)
+
+_TOKEN_PATTERN = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]|[A-Za-z]+|\d+|\S")
+_ELLIPSIS = "…"
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Token estimate for mixed Chinese/English text.
+
+    GLM tokenizers spend about one token per CJK character or full-width
+    punctuation mark, 1.3 per English word, one per three digits and one per
+    other symbol.
+    """
+    if not text:
+        return 0
+    total = 0.0
+    for match in _TOKEN_PATTERN.finditer(text):
+        piece = match.group()
+        first = piece[0]
+        if first.isascii() and first.isalpha():
+            total += 1.3
+        elif first.isdigit():
+            total += math.ceil(len(piece) / 3)
+        else:
+            total += 1
+    return math.ceil(total)
+
+
+def estimate_message_tokens(message: Mapping[str, Any]) -> int:
+    content = message.get("content")
+    if not isinstance(content, str):
+        content = dumps(content) if content else ""
+    tokens = estimate_tokens(content) + CONTEXT_MESSAGE_OVERHEAD
+    if message.get("tool_calls"):
+        tokens += estimate_tokens(dumps(message["tool_calls"]))
+    return tokens
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle]) + 1 <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low].rstrip() + _ELLIPSIS if low else ""
+
+
+def model_context_window(model: str) -> int:
+    name = (model or "").lower()
+    for prefix, window in MODEL_CONTEXT_WINDOWS:
+        if name.startswith(prefix):
+            return window
+    return DEFAULT_MODEL_CONTEXT_WINDOW
+
+
+def context_budget(options: Mapping[str, Any], model: str) -> int:
+    budget = int(options.get(CONF_CONTEXT_TOKEN_BUDGET, DEFAULT_CONTEXT_TOKEN_BUDGET))
+    reply = int(options.get(CONF_MAX_TOKENS, RECOMMENDED_MAX_TOKENS))
+    return max(CONTEXT_MIN_BUDGET, min(budget, model_context_window(model) - reply))
+
+
+def chat_turns(content: Sequence[Any], question: str) -> List[Dict[str, Any]]:
+    """User and final assistant messages from a chat log, without tool noise.
+
+    Assistant messages carrying tool calls and tool results are dropped, and
+    so is a trailing copy of the current question, which is sent separately.
+    """
+    turns: List[Dict[str, Any]] = []
+    for message in content:
+        if message.role == "user" and message.content:
+            turns.append({"role": "user", "content": message.content})
+        elif message.role == "assistant" and message.content and not getattr(message, "tool_calls", None):
+            turns.append({"role": "assistant", "content": message.content})
+    if turns and turns[-1]["role"] == "user" and turns[-1]["content"] == question:
+        turns.pop()
+    return turns
+
+
+def merge_history(
+    turns: Sequence[Dict[str, Any]], stored: Sequence[Any], question: str, max_messages: int
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Merge stored history into the chat turns so every message is sent once.
+
+    Stored messages from the first user message the chat log also has onward
+    are already in ``turns``. Earlier ones (the chat log expired, HA
+    restarted) are sent as chat messages when they form user/assistant
+    pairs; user messages that never got a reply only go into the system
+    prompt as a short list. The newest ``max_messages`` of the merged
+    history are kept.
+    """
+    stored = list(stored)
+    if stored and stored[-1].role == "user" and stored[-1].content == question:
+        stored.pop()
+    seen = {turn["content"] for turn in turns if turn["role"] == "user"}
+    for index, message in enumerate(stored):
+        if message.role == "user" and message.content in seen:
+            stored = stored[:index]
+            break
+
+    merged: List[Tuple[bool, Dict[str, Any]]] = []
+    for index, message in enumerate(stored):
+        if message.role == "assistant":
+            if merged and merged[-1][0] and merged[-1][1]["role"] == "user":
+                merged.append((True, {"role": "assistant", "content": message.content}))
+            continue
+        following = stored[index + 1] if index + 1 < len(stored) else None
+        merged.append((following is not None and following.role == "assistant", {"role": "user", "content": message.content}))
+    merged.extend((True, turn) for turn in turns)
+
+    merged = merged[-max_messages:] if max_messages > 0 else []
+    while merged and merged[0][0] and merged[0][1]["role"] == "assistant":
+        merged.pop(0)
+    messages = [message for as_message, message in merged if as_message]
+    prompt_lines = [f"- user: {message['content']}" for as_message, message in merged if not as_message]
+    return messages, prompt_lines
+
+
+class ContextPlan:
+    def __init__(self, messages: List[Dict[str, Any]], usage: Dict[str, int], budget: int, dropped: Dict[str, int]) -> None:
+        self.messages = messages
+        self.usage = usage
+        self.budget = budget
+        self.dropped = dropped
+
+    @property
+    def total(self) -> int:
+        return sum(self.usage.values())
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"budget": self.budget, "total": self.total, "sections": dict(self.usage), "dropped": dict(self.dropped)}
+
+
+class ContextBuilder:
+    """Fills a token budget in priority order.
+
+    The system core, tools and the current question are always sent; recent
+    turns, older turns and history analysis share what is left, in that
+    order. Recent turns are shortened before they are dropped, older turns
+    are dropped whole, history analysis is cut line by line.
+    """
+
+    def __init__(self, budget: int, recent_messages: int = CONTEXT_RECENT_MESSAGES) -> None:
+        self.budget = budget
+        self.recent_messages = recent_messages
+
+    def build(
+        self,
+        system: str,
+        question: str,
+        turns: Sequence[Dict[str, Any]] = (),
+        tools: Optional[Sequence[Dict[str, Any]]] = None,
+        history_analysis: Sequence[str] = (),
+    ) -> ContextPlan:
+        usage = dict.fromkeys(SECTIONS, 0)
+        dropped = {SECTION_RECENT: 0, SECTION_OLDER: 0, SECTION_HISTORY_ANALYSIS: 0}
+        usage[SECTION_SYSTEM] = estimate_tokens(system) + CONTEXT_MESSAGE_OVERHEAD
+        usage[SECTION_TOOLS] = estimate_tokens(dumps(list(tools))) if tools else 0
+        question_message = {"role": "user", "content": question}
+        usage[SECTION_QUESTION] = estimate_message_tokens(question_message)
+        remaining = self.budget - usage[SECTION_SYSTEM] - usage[SECTION_TOOLS] - usage[SECTION_QUESTION]
+
+        split = max(0, len(turns) - self.recent_messages)
+        kept: List[Dict[str, Any]] = []
+        for index in range(len(turns) - 1, -1, -1):
+            message = turns[index]
+            section = SECTION_RECENT if index >= split else SECTION_OLDER
+            cost = estimate_message_tokens(message)
+            if cost > remaining and section == SECTION_RECENT and isinstance(message.get("content"), str) and not message.get("tool_calls"):
+                if content := truncate_to_tokens(message["content"], remaining - CONTEXT_MESSAGE_OVERHEAD):
+                    message = dict(message, content=content)
+                    cost = estimate_message_tokens(message)
+            if cost > remaining:
+                dropped[SECTION_RECENT] = max(0, index + 1 - split)
+                dropped[SECTION_OLDER] = min(index + 1, split)
+                break
+            kept.append(message)
+            usage[section] += cost
+            remaining -= cost
+        kept.reverse()
+
+        analysis: List[str] = []
+        for line in history_analysis:
+            cost = estimate_tokens(line) + 1
+            if cost > remaining:
+                dropped[SECTION_HISTORY_ANALYSIS] = len(history_analysis) - len(analysis)
+                break
+            analysis.append(line)
+            usage[SECTION_HISTORY_ANALYSIS] += cost
+            remaining -= cost
+        if len(analysis) == 1:
+            dropped[SECTION_HISTORY_ANALYSIS] = len(history_analysis)
+            usage[SECTION_HISTORY_ANALYSIS] = 0
+            analysis = []
+
+        system_content = "\n".join([system, *analysis]) if analysis else system
+        messages = [{"role": "system", "content": system_content}, *kept, question_message]
+        return ContextPlan(messages, usage, self.budget, dropped)
@@ -1,9 +1,9 @@
 from __future__ import annotations
 import json
 import asyncio
+import contextlib
 import time
 import re
-from datetime import datetime, timedelta
 from typing import Any, TypedDict, Dict, List, Optional, AsyncGenerator
 from voluptuous_openapi import convert 
 from homeassistant.components import assist_pipeline, conversation
@@ -15,13 +15,23 @@ from homeassistant.helpers import entity_registry as er
 from homeassistant.helpers import device_registry as dr, intent, llm, template, entity_registry, chat_session
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.exceptions import HomeAssistantError
-from homeassistant.components.recorder import get_instance
-from homeassistant.components.recorder.history import get_significant_states
 from homeassistant.util import ulid
 from home_assistant_intents import get_languages
 from .ai_request import send_ai_request, send_api_request
+from .coalescing import get_coalesce_stats
+from .connection_pool import get_pool
+from .entity_index import get_entity_index
+from .entity_history import async_get_entity_history
+from .codec import JSONDecodeError, LazyJSON, dumps, loads
 from .intents import IntentHandler, extract_intent_info
-from .markdown_filter import filter_markdown_content
+from .markdown_filter import MarkdownStreamFilter, filter_markdown_content
+from .context_builder import ContextBuilder, chat_turns, context_budget, merge_history
+from .history_store import ConversationHistoryStore
+from .prework import async_run_stages
+from .speculative import LocalGate, SpeculativeRace
+from .response_cache import ResponseCache, tool_dependencies
+from .tool_cache import ToolSpecCache
+from .prompt_renderer import SystemPromptRenderer, join_sections, normalize_lines
 from .const import (
     CONF_CHAT_MODEL,
     CONF_MAX_TOKENS,
@@ -30,6 +40,13 @@ from .const import (
     CONF_TOP_P,
     CONF_MAX_HISTORY_MESSAGES, 
     DOMAIN,
+    HISTORY_MAX_USER_MESSAGE_LENGTH,
+    CONF_TOOL_TOP_K,
+    DEFAULT_TOOL_TOP_K,
+    CONF_SPECULATIVE_LOCAL,
+    DEFAULT_SPECULATIVE_LOCAL,
+    CONF_RESPONSE_CACHE,
+    DEFAULT_RESPONSE_CACHE,
     RECOMMENDED_CHAT_MODEL,
     RECOMMENDED_MAX_TOKENS,
     RECOMMENDED_TEMPERATURE,
@@ -68,8 +85,6 @@ from .prompts import (
     get_tools_for_text,
     get_web_search_tool,
     is_web_search_request,
-    detect_keywords_in_text
-
 )
 
 
@@ -101,6 +116,15 @@ def _format_tool(tool: llm.Tool, custom_serializer: Any | None) -> ChatCompletio
     }
     return ChatCompletionToolParam(type="function", function=tool_spec)
 
+def _describe_tools(tools: list[ChatCompletionToolParam]) -> list[str]:
+    lines = []
+    for tool in tools:
+        required = tool["function"].get("parameters", {}).get("required", [])
+        lines.append(f"- {tool['function']['name']}: {tool['function'].get('description', '')}")
+        if required:
+            lines.append(f"  Required parameters: {', '.join(required)}")
+    return lines
+
 def is_service_call(user_input: str) -> bool:
     patterns = {
         "control": ["让", "请", "帮我", "麻烦", "把", "将", "计时", "要", "想", "希望", "需要", "能否", "能不能", "可不可以", "可以", "帮忙", "给我", "替我", "为我", "我要", "我想", "我希望"],
@@ -123,6 +147,8 @@ def is_service_call(user_input: str) -> bool:
 
 def extract_service_info(user_input: str, hass: HomeAssistant) -> Optional[Dict[str, Any]]:
     def find_entity(domain: str, text: str) -> Optional[str]:
+        if (index := get_entity_index(hass)) is not None:
+            return index.find(domain, text)
         text = text.lower()
         entity_id = next((entity_id for entity_id in hass.states.async_entity_ids(domain) 
                     if text in entity_id.split(".")[1].lower() or 
@@ -212,18 +238,26 @@ def extract_service_info(user_input: str, hass: HomeAssistant) -> Optional[Dict[
 
     return None
 
+async def _aclose_streams(*streams) -> None:
+    for stream in streams:
+        if stream is not None:
+            with contextlib.suppress(Exception):
+                await stream.aclose()
+
 class AIResponseStrategy:
     @staticmethod
-    async def direct_stream(api_key, payload, options, chat_log, entity_id, transform_stream_func, llm_api, on_tool_call):
+    async def direct_stream(entry_id, api_key, payload, options, chat_log, entity_id, transform_stream_func, llm_api, on_tool_call):
         timeout = options.get(CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT)
-        stream_generator = send_ai_request(api_key, payload, options, timeout=timeout)
+        stream_generator = send_ai_request(entry_id, api_key, payload, options, timeout=timeout)
+        content_stream = delta_stream = None
         final_content = ""
         tool_calls_detected = []
         
         try:
             content_stream = transform_stream_func(stream_generator, llm_api)
+            delta_stream = chat_log.async_add_delta_content_stream(entity_id, content_stream)
             
-            async for content in chat_log.async_add_delta_content_stream(entity_id, content_stream):
+            async for content in delta_stream:
                 if isinstance(content, conversation.AssistantContent):
                     if content.content:
                         final_content += content.content
@@ -251,9 +285,11 @@ class AIResponseStrategy:
             
             LOGGER.info("流处理过程中发生错误: %s", str(e))
             return final_content
+        finally:
+            await _aclose_streams(delta_stream, content_stream, stream_generator)
     
     @staticmethod
-    async def collect_stream(api_key, payload, options):
+    async def collect_stream(entry_id, api_key, payload, options):
         timeout = options.get(CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT)
         tool_calls_from_ai = []
         ai_content = ""
@@ -263,25 +299,26 @@ class AIResponseStrategy:
             tool_names = [t.get("function", {}).get("name", "unknown") for t in payload.get("tools", [])]
 
         
-        async for chunk in send_ai_request(api_key, payload, options, timeout=timeout):
-            choice = chunk.get("choices", [{}])[0]
-            delta = choice.get("delta", {})
-            
-            if delta.get("content"):
-                ai_content += delta["content"]
-            
-            if "tool_calls" in delta and delta["tool_calls"]:
-                for tool_call in delta["tool_calls"]:
-                    if (tool_call.get("type") == "function" and "function" in tool_call and
-                        "name" in tool_call["function"] and "arguments" in tool_call["function"]):
-                        tool_calls_from_ai.append(tool_call)
+        async with contextlib.aclosing(send_ai_request(entry_id, api_key, payload, options, timeout=timeout)) as stream:
+            async for chunk in stream:
+                choice = chunk.get("choices", [{}])[0]
+                delta = choice.get("delta", {})
+                
+                if delta.get("content"):
+                    ai_content += delta["content"]
+                
+                if "tool_calls" in delta and delta["tool_calls"]:
+                    for tool_call in delta["tool_calls"]:
+                        if (tool_call.get("type") == "function" and "function" in tool_call and
+                            "name" in tool_call["function"] and "arguments" in tool_call["function"]):
+                            tool_calls_from_ai.append(tool_call)
         
         return ai_content, tool_calls_from_ai
 
     @staticmethod
-    async def non_stream_request(hass, api_key, payload, options):
+    async def non_stream_request(hass, entry_id, api_key, payload, options):
         
-        return await send_api_request(api_key, payload, options)
+        return await send_api_request(entry_id, api_key, payload, options)
 
 class ToolCallProcessor:
     def __init__(self, entity, api_key, options):
@@ -293,11 +330,14 @@ class ToolCallProcessor:
         self.result_handler = ResultHandler(entity)
         self.window_id = f"tool_call_{int(time.time())}"
     
-    async def process(self, tool_calls, ai_content, messages, user_input, base_payload):
+    async def process(self, tool_calls, ai_content, messages, user_input, base_payload, cache_key=None):
         request_id = f"req_{int(time.time())}"
         current_content = ai_content or ""
         max_iterations = self.entity.max_tool_iterations
         pending_calls = tool_calls.copy() if tool_calls else []
+        executed = []
+        cacheable = cache_key is not None
+        streamed = False
         
         LOGGER.info("开始处理工具调用，最大迭代次数: %s，工具调用数: %s", 
                    max_iterations, len(pending_calls) if pending_calls else 0)
@@ -327,6 +367,7 @@ class ToolCallProcessor:
             
             
             results = await self._execute_tool_calls([new_call], user_input.text)
+            executed.extend(results)
             
             
             for result in results:
@@ -344,6 +385,8 @@ class ToolCallProcessor:
                         payload, chat_log, self.entity.entity_id)
                     
                     current_content = response_data.get("content", current_content)
+                    streamed = True
+                    cacheable = cacheable and not response_data.get("error")
                     new_pending_calls = response_data.get("tool_calls", [])
                     
                     if new_pending_calls:
@@ -361,11 +404,13 @@ class ToolCallProcessor:
                     LOGGER.exception("工具调用迭代 %s/%s 处理响应时出错: %s", 
                                     iteration + 1, max_iterations, str(e))
                     pending_calls = [call for call in pending_calls if call != new_call]
+                    cacheable = False
         
         
         final_content = current_content or ai_content or getattr(self.entity, '_last_error_message', "")
         
-        filtered_content = self.entity._filter_response_content(final_content)
+        # Streamed answers were filtered delta by delta in _transform_stream.
+        filtered_content = final_content.strip() if streamed and current_content else self.entity._filter_response_content(final_content)
         await self.entity._update_response(filtered_content)
         
         
@@ -373,16 +418,23 @@ class ToolCallProcessor:
         messages.append(final_message)
         
         
-        if hasattr(self.entity, 'session_histories') and user_input.conversation_id:
-            self._save_session_history(messages, filtered_content, user_input.conversation_id)
+        if user_input.conversation_id:
+            self._save_session_history(filtered_content, user_input.conversation_id)
+        
+        if cacheable and current_content and not pending_calls and (dependencies := tool_dependencies(self.entity.hass, executed, user_input.text, filtered_content)):
+            self.entity._response_cache.store(cache_key, filtered_content, dependencies)
         
         return filtered_content
     
     async def _execute_tool_calls(self, tool_calls, user_text):
-        tasks = []
-        for call in tool_calls:
-            tasks.append(self._execute_single_call(call, user_text))
-        return await asyncio.gather(*tasks)
+        tasks = [asyncio.ensure_future(self._execute_single_call(call, user_text)) for call in tool_calls]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
 
     async def _execute_single_call(self, tool_call, user_text):
         tool_name = ""
@@ -396,7 +448,7 @@ class ToolCallProcessor:
             
             LOGGER.debug("执行工具调用: %s, 参数: %s", tool_name, tool_args_json)
             
-            tool_args = json.loads(tool_args_json) if tool_args_json else {"text": tool_args_json}
+            tool_args = loads(tool_args_json) if tool_args_json else {"text": tool_args_json}
             
             
             tool_args["_window_id"] = self.window_id
@@ -408,7 +460,7 @@ class ToolCallProcessor:
             
             self.entity._last_tool_result = result
             
-            result_content = json.dumps(result, ensure_ascii=False) if isinstance(result, dict) else str(result)
+            result_content = dumps(result) if isinstance(result, dict) else str(result)
             
             if not result.get("success", True):
                 
@@ -421,7 +473,7 @@ class ToolCallProcessor:
                 "tool_name": tool_name, 
                 "content": result_content
             }
-        except json.JSONDecodeError as e:
+        except JSONDecodeError as e:
             
             original_error = str(e)
             self.entity._last_error_message = original_error
@@ -444,38 +496,15 @@ class ToolCallProcessor:
                 "content": json.dumps({"error": original_error}, ensure_ascii=False)
             }
 
-    def _save_session_history(self, messages, filtered_content, conversation_id):
-        filtered_history = []
-        
-        for msg in messages:
-            role = msg.get("role") if isinstance(msg, dict) else getattr(msg, "role", None)
-            
-            if role == "user":
-                if isinstance(msg, dict):
-                    filtered_history.append(msg)
-                else:
-                    filtered_history.append({"role": "user", "content": getattr(msg, "content", "")})
-            
-            elif role == "assistant":
-                content = msg.get("content") if isinstance(msg, dict) else getattr(msg, "content", "")
-                tool_calls = msg.get("tool_calls") if isinstance(msg, dict) else getattr(msg, "tool_calls", None)
-                
-                if content and not tool_calls:
-                    filtered_history.append({"role": "assistant", "content": content})
-        
-        if filtered_content:
-            if filtered_history and filtered_history[-1].get("role") == "assistant":
-                filtered_history[-1] = {"role": "assistant", "content": filtered_content}
-            else:
-                filtered_history.append({"role": "assistant", "content": filtered_content})
-        
-        self.entity.session_histories[conversation_id] = filtered_history
+    def _save_session_history(self, filtered_content, conversation_id):
+        self.entity.history.append(conversation_id, "assistant", filtered_content)
 
     async def _get_ai_response(self, payload, chat_log, entity_id):
         payload["stream"] = True
+        stream = content_stream = delta_stream = None
         
         try:
-            stream = send_ai_request(self.api_key, payload, self.options, 
+            stream = send_ai_request(self.entity.entry.entry_id, self.api_key, payload, self.options, 
                                   timeout=self.options.get(CONF_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT))
             content_stream = self.entity._transform_stream(stream, self.entity.llm_api)
             result = {"content": "", "tool_calls": []}
@@ -495,7 +524,8 @@ class ToolCallProcessor:
                 }
             }
             
-            async for content in chat_log.async_add_delta_content_stream(entity_id, content_stream):
+            delta_stream = chat_log.async_add_delta_content_stream(entity_id, content_stream)
+            async for content in delta_stream:
                 handler = content_handlers.get(type(content))
                 if handler:
                     processed = handler(content)
@@ -521,7 +551,9 @@ class ToolCallProcessor:
             return result
         except Exception as e:
             error_text = str(e)
-            return {"content": f"处理请求时出错: {error_text}", "tool_calls": []}
+            return {"content": f"处理请求时出错: {error_text}", "tool_calls": [], "error": error_text}
+        finally:
+            await _aclose_streams(delta_stream, content_stream, stream)
 
 class IdTracker:
     def __init__(self):
@@ -583,7 +615,7 @@ class ZhipuAIConversationEntity(conversation.ConversationEntity, conversation.Ab
     def __init__(self, entry: ConfigEntry, hass: HomeAssistant) -> None:
         self.entry = entry
         self.hass = hass
-        self.session_histories: dict[str, list[ChatCompletionMessageParam]] = {}
+        self.history = ConversationHistoryStore(hass, entry.entry_id, entry.options)
         self._current_session_id = None
         self._attr_unique_id = entry.entry_id
         self._attr_device_info = dr.DeviceInfo(
@@ -600,6 +632,10 @@ class ZhipuAIConversationEntity(conversation.ConversationEntity, conversation.Ab
         self.entity_registry = er.async_get(hass)
         self.device_registry = dr.async_get(hass)
         self.service_call_attempts = 0
+        self._prompt_renderer = SystemPromptRenderer(hass)
+        self._tool_cache = ToolSpecCache(hass, _format_tool, _describe_tools)
+        self._speculative = SpeculativeRace()
+        self._response_cache = ResponseCache(hass)
         self._attr_native_value = "就绪"
         self._attr_extra_state_attributes = {"response": ""}
 
@@ -623,33 +659,28 @@ class ZhipuAIConversationEntity(conversation.ConversationEntity, conversation.Ab
         await super().async_added_to_hass()
         assist_pipeline.async_migrate_engine(self.hass, "conversation", self.entry.entry_id, self.entity_id)
         conversation.async_set_agent(self.hass, self.entry, self)
+        await self.history.async_load()
+        self.async_on_remove(self._tool_cache.async_listen())
+        self.async_on_remove(self._response_cache.async_listen())
         self.entry.async_on_unload(self.entry.add_update_listener(self._async_entry_update_listener))
 
+    async def async_prepare(self, language: str | None = None) -> None:
+        if pool := get_pool(self.entry.entry_id):
+            pool.async_request_prewarm()
+
     async def async_will_remove_from_hass(self) -> None:
-        self.session_histories.clear()
+        await self.history.async_flush()
         conversation.async_unset_agent(self.hass, self.entry)
         await super().async_will_remove_from_hass()
 
     async def async_process(self, user_input: conversation.ConversationInput) -> conversation.ConversationResult:
         try:
-            if not hasattr(self, '_conversation_history'):
-                self._conversation_history = {}
-            
-            if user_input.conversation_id != getattr(self, '_last_conversation_id', None):
-                self._conversation_history[user_input.conversation_id] = []
-                self._last_conversation_id = user_input.conversation_id
-            
-            if len(user_input.text) <= 300:  
-                self._conversation_history[user_input.conversation_id].append({
-                    "role": "user",
-                    "content": user_input.text,
-                    "timestamp": time.time()
-                })
-
             is_internal_call = False
             if user_input.text and '[INTERNAL_CALL]' in user_input.text:
                 is_internal_call = True
                 user_input.text = user_input.text.replace('[INTERNAL_CALL]', '')
+            elif len(user_input.text) <= HISTORY_MAX_USER_MESSAGE_LENGTH:
+                self.history.append(user_input.conversation_id, "user", user_input.text)
             
             if is_internal_call and getattr(self, '_last_tool_call_time', 0) > time.time() - 2:
                 intent_response = intent.IntentResponse(language=user_input.language)
@@ -690,422 +721,436 @@ class ZhipuAIConversationEntity(conversation.ConversationEntity, conversation.Ab
                         intent.IntentResponseErrorCode.NO_VALID_TARGETS, result["message"])
                     return conversation.ConversationResult(response=intent_response, conversation_id=conversation_id)
                 
-                options = self.entry.options
-                tools = None
-                user_name = None
-                llm_context = llm.LLMContext(platform=DOMAIN, context=user_input.context, user_prompt=user_input.text, 
-                    language=user_input.language, assistant=conversation.DOMAIN, device_id=user_input.device_id)
+                if self.entry.options.get(CONF_SPECULATIVE_LOCAL, DEFAULT_SPECULATIVE_LOCAL) and not is_internal_call:
+                    local_result, result = await self._speculative.async_run(
+                        lambda: self._async_process_local(user_input),
+                        lambda gate: self._async_process_llm(user_input, conversation_id, chat_log, gate),
+                    )
+                    self._attr_extra_state_attributes["speculative"] = self._speculative.stats()
+                    if local_result is not None:
+                        return await self._async_local_result(local_result, conversation_id, chat_log)
+                    return result
 
-                
-                current_model = options.get(CONF_CHAT_MODEL, RECOMMENDED_CHAT_MODEL)
-                is_z1_model = any(z1_name in current_model.upper() for z1_name in ["Z1-AIR", "Z1-AIRX", "Z1-FLASH", "Z1-FLASHX"])
+                return await self._async_process_llm(user_input, conversation_id, chat_log)
+        except Exception as err:
+            
+            error_result = await self._handle_exception(err, user_input.text, user_input.conversation_id)
+            error_text = error_result.get("message", f"处理错误: {str(err)}")
+            
+            
+            await self._update_response(error_text)
+            
+            intent_response = intent.IntentResponse(language=user_input.language)
+            intent_response.async_set_speech(error_text)
+            
+            return conversation.ConversationResult(
+                response=intent_response,
+                conversation_id=user_input.conversation_id or ulid.ulid_now()
+            )
 
-                if is_z1_model:
-                    LOGGER.warning("检测到Z1系列模型 %s，自动禁用工具调用", current_model)
-                    
-                    options_copy = dict(options)
-                    options_copy[CONF_TOOL_CHOICE] = "none"
-                    
-                    options = options_copy
-                    
-                    
-                    z1_warning = "\n注意: 您正在使用Z1系列模型，此模型只能用于查询设备状态，不支持设备控制和工具调用。请直接回答用户问题，不要尝试使用工具。如果用户需要控制设备，请礼貌告知需要使用其他系列模型才能执行此操作。\n"
+    async def _async_process_local(self, user_input: conversation.ConversationInput) -> conversation.ConversationResult:
+        return await conversation.async_converse(
+            self.hass, user_input.text, None, user_input.context,
+            language=user_input.language, agent_id=conversation.HOME_ASSISTANT_AGENT, device_id=user_input.device_id,
+        )
 
-                try:
-                    if not options.get(CONF_LLM_HASS_API) or options[CONF_LLM_HASS_API] == "none":
-                        api_key = self.entry.data[CONF_API_KEY]
-                        base_payload = {
-                            "model": options.get(CONF_CHAT_MODEL, RECOMMENDED_CHAT_MODEL),
-                            "max_tokens": min(options.get(CONF_MAX_TOKENS, RECOMMENDED_MAX_TOKENS), 8096),
-                            "top_p": options.get(CONF_TOP_P, RECOMMENDED_TOP_P),
-                            "temperature": options.get(CONF_TEMPERATURE, RECOMMENDED_TEMPERATURE),
-                            "request_id": conversation_id,
-                            "presence_penalty": options.get(CONF_PRESENCE_PENALTY, DEFAULT_PRESENCE_PENALTY),
-                            "frequency_penalty": options.get(CONF_FREQUENCY_PENALTY, DEFAULT_FREQUENCY_PENALTY),
-                            "stop": options.get(CONF_STOP_SEQUENCES, DEFAULT_STOP_SEQUENCES),
-                            "logit_bias": options.get(CONF_LOGIT_BIAS, DEFAULT_LOGIT_BIAS),
-                            "response_format": {"type": "text"}
-                        }
-                        
-                        tool_choice_setting = options.get(CONF_TOOL_CHOICE, DEFAULT_TOOL_CHOICE)
-                        
-                        base_payload["tool_choice"] = "required"
-                        base_payload["temperature"] = 0.1  
-                        base_payload["top_p"] = 0.1  
-                        base_payload["do_sample"] = False  
-
-
-                        if tools:
-                            base_payload["tool_choice"] = "required"
-                            base_payload["temperature"] = 0.1
-                            base_payload["top_p"] = 0.1
-                            base_payload["do_sample"] = False
-                            base_payload["tools"] = tools
-
-                        if is_z1_model:
-                            base_payload["tool_choice"] = "none"
-                            
-                            if "tools" in base_payload:
-                                del base_payload["tools"]
-                            
-                            if "messages" not in base_payload:
-                                base_payload["messages"] = [ChatCompletionMessageParam(role="user", content=user_input.text)]
+    async def _async_record_reply(self, text: str, conversation_id: str, chat_log) -> None:
+        chat_log.async_add_assistant_content_without_tools(conversation.AssistantContent(agent_id=self.entity_id, content=text))
+        self.history.append(conversation_id, "assistant", text)
+        await self._update_response(text)
+
+    async def _async_local_result(self, local_result: conversation.ConversationResult, conversation_id: str, chat_log) -> conversation.ConversationResult:
+        if speech := local_result.response.speech.get("plain", {}).get("speech", ""):
+            await self._async_record_reply(speech, conversation_id, chat_log)
+        return conversation.ConversationResult(response=local_result.response, conversation_id=conversation_id)
+
+    async def _async_cached_result(self, text: str, user_input: conversation.ConversationInput, conversation_id: str, chat_log) -> conversation.ConversationResult:
+        await self._async_record_reply(text, conversation_id, chat_log)
+        intent_response = intent.IntentResponse(language=user_input.language)
+        intent_response.async_set_speech(text)
+        return conversation.ConversationResult(response=intent_response, conversation_id=conversation_id, continue_conversation=chat_log.continue_conversation)
+
+    async def _async_process_llm(self, user_input: conversation.ConversationInput, conversation_id: str, chat_log, gate: LocalGate | None = None) -> conversation.ConversationResult:
+        transform_stream = gate.wrap(self._transform_stream) if gate else self._transform_stream
+        options = self.entry.options
+        tools = None
+        tools_description = turn_tools_description = dynamic_prompts = ""
+        llm_context = llm.LLMContext(platform=DOMAIN, context=user_input.context, user_prompt=user_input.text, 
+            language=user_input.language, assistant=conversation.DOMAIN, device_id=user_input.device_id)
 
-                        try:
-                            final_content = await AIResponseStrategy.direct_stream(
-                                api_key, base_payload, options, chat_log, 
-                                self.entity_id, self._transform_stream, None, None
-                            )
-                            
-                            if final_content:
-                                filtered_content = self._filter_response_content(final_content)
-                                await self._update_response(filtered_content)
-                                intent_response = intent.IntentResponse(language=user_input.language)
-                                intent_response.async_set_speech(filtered_content)
-                                return conversation.ConversationResult(
-                                    response=intent_response,
-                                    conversation_id=conversation_id,
-                                    continue_conversation=chat_log.continue_conversation,
-                                )
-                        except Exception as e:
-                            intent_response = intent.IntentResponse(language=user_input.language)
-                            intent_response.async_set_speech(f"{str(e)}")
-                            return conversation.ConversationResult(
-                                response=intent_response,
-                                conversation_id=conversation_id
-                            )
-
-                    try:
-                        self.llm_api = await llm.async_get_api(self.hass, options[CONF_LLM_HASS_API], llm_context)
-                        chat_log.llm_api = self.llm_api
-                        tools_description = ""
-                        
-                        if self.llm_api and hasattr(self.llm_api, "tools"):
-                            tools = [_format_tool(tool, self.llm_api.custom_serializer) for tool in self.llm_api.tools]
-                            
-                            
-                            additional_tools = get_tools_for_text(user_input.text, tools)
-                            if additional_tools:
-                                tools.extend(additional_tools)
-                            
-                            if tools:
-                                tool_choice_setting = options.get(CONF_TOOL_CHOICE, DEFAULT_TOOL_CHOICE)
-                                
-                                
-                                tools_desc_parts = get_basic_tools_guide(tool_choice_setting)
-                                
-                                
-                                tools_desc_parts.append("\n")
-                                for tool in tools:
-                                    tool_name = tool["function"]["name"]
-                                    tool_desc = tool["function"].get("description", "")
-                                    params = tool["function"].get("parameters", {})
-                                    required = params.get("required", [])
-                                    
-                                    tools_desc_parts.append(f"- {tool_name}: {tool_desc}")
-                                    if required:
-                                        tools_desc_parts.append(f"  Required parameters: {', '.join(required)}")
-                                
-                                
-                                keywords = detect_keywords_in_text(user_input.text)
-                                dynamic_prompts = get_prompts_for_text(user_input.text)
-
-                                tools_desc_parts.append(f"\n\n{dynamic_prompts}")
-
-                                tools_description = "\n".join(tools_desc_parts)
-                        else:
-                            tools_description = ""
-                    except HomeAssistantError as err:
-                        api_key = self.entry.data[CONF_API_KEY]
-                        base_payload = {
-                            "model": options.get(CONF_CHAT_MODEL, RECOMMENDED_CHAT_MODEL),
-                            "max_tokens": min(options.get(CONF_MAX_TOKENS, RECOMMENDED_MAX_TOKENS), 4096),
-                            "top_p": options.get(CONF_TOP_P, RECOMMENDED_TOP_P),
-                            "temperature": options.get(CONF_TEMPERATURE, RECOMMENDED_TEMPERATURE),
-                            "request_id": conversation_id,
-                            "logit_bias": options.get(CONF_LOGIT_BIAS, DEFAULT_LOGIT_BIAS),
-                            "response_format": {"type": "text"}
-                        }
-                        final_content = await AIResponseStrategy.direct_stream(
-                            api_key, base_payload, options, chat_log, 
-                            self.entity_id, self._transform_stream, None, None
-                        )
-                        if final_content:
-                            filtered_content = self._filter_response_content(final_content)
-                            await self._update_response(filtered_content)
-                            intent_response = intent.IntentResponse(language=user_input.language)
-                            intent_response.async_set_speech(filtered_content)
-                            return conversation.ConversationResult(
-                                response=intent_response,
-                                conversation_id=conversation_id,
-                                continue_conversation=chat_log.continue_conversation,
-                            )
-
-                    web_search_keywords = ["联网", "搜索", "查询", "互联网", "上网", "百度", "谷歌", "必应"]
-                    has_web_search = any(keyword in user_input.text for keyword in web_search_keywords)
-                    if has_web_search and options.get(CONF_WEB_SEARCH, DEFAULT_WEB_SEARCH):
-                        
-                        additional_tools = get_tools_for_text(user_input.text, tools)
-                        if additional_tools:
-                            tools.extend(additional_tools)
-                except HomeAssistantError:
-                    pass
+        
+        current_model = options.get(CONF_CHAT_MODEL, RECOMMENDED_CHAT_MODEL)
+        is_z1_model = any(z1_name in current_model.upper() for z1_name in ["Z1-AIR", "Z1-AIRX", "Z1-FLASH", "Z1-FLASHX"])
 
-                
-                if user_input.context and user_input.context.user_id:
-                    user = await self.hass.auth.async_get_user(user_input.context.user_id)
-                    if user:
-                        user_name = user.name
+        if is_z1_model:
+            LOGGER.warning("检测到Z1系列模型 %s，自动禁用工具调用", current_model)
+            
+            options_copy = dict(options)
+            options_copy[CONF_TOOL_CHOICE] = "none"
+            
+            options = options_copy
+            
+            
+            z1_warning = "\n注意: 您正在使用Z1系列模型，此模型只能用于查询设备状态，不支持设备控制和工具调用。请直接回答用户问题，不要尝试使用工具。如果用户需要控制设备，请礼貌告知需要使用其他系列模型才能执行此操作。\n"
+
+        stages = {"user": self._async_get_user(user_input)}
+        if options.get(CONF_LLM_HASS_API) and options[CONF_LLM_HASS_API] != "none":
+            stages["llm_api"] = llm.async_get_api(self.hass, options[CONF_LLM_HASS_API], llm_context)
+            if options.get(CONF_HISTORY_ANALYSIS) and (entities := options.get(CONF_HISTORY_ENTITIES)):
+                stages["history_analysis"] = self._async_history_analysis(entities)
+        prework = await async_run_stages(stages)
+        self._attr_extra_state_attributes["prework_ms"] = prework.timings_ms()
+        LOGGER.debug("预处理阶段耗时(ms): %s", self._attr_extra_state_attributes["prework_ms"])
+        user = prework.get("user")
+        user_name = user.name if user else None
 
+        try:
+            if not options.get(CONF_LLM_HASS_API) or options[CONF_LLM_HASS_API] == "none":
+                api_key = self.entry.data[CONF_API_KEY]
+                base_payload = {
+                    "model": options.get(CONF_CHAT_MODEL, RECOMMENDED_CHAT_MODEL),
+                    "max_tokens": min(options.get(CONF_MAX_TOKENS, RECOMMENDED_MAX_TOKENS), 8096),
+                    "top_p": options.get(CONF_TOP_P, RECOMMENDED_TOP_P),
+                    "temperature": options.get(CONF_TEMPERATURE, RECOMMENDED_TEMPERATURE),
+                    "request_id": conversation_id,
+                    "presence_penalty": options.get(CONF_PRESENCE_PENALTY, DEFAULT_PRESENCE_PENALTY),
+                    "frequency_penalty": options.get(CONF_FREQUENCY_PENALTY, DEFAULT_FREQUENCY_PENALTY),
+                    "stop": options.get(CONF_STOP_SEQUENCES, DEFAULT_STOP_SEQUENCES),
+                    "logit_bias": options.get(CONF_LOGIT_BIAS, DEFAULT_LOGIT_BIAS),
+                    "response_format": {"type": "text"}
+                }
                 
-                try:
-                    er = entity_registry.async_get(self.hass)
-                    entities_dict = {entity_id: er.async_get(entity_id) for entity_id in self.hass.states.async_entity_ids()}
-                    exposed_entities = [entity for entity in entities_dict.values() if entity and not entity.hidden]
-                    
-                    max_history = options.get(CONF_MAX_HISTORY_MESSAGES, RECOMMENDED_MAX_HISTORY_MESSAGES)
-                    
-                    history_prompt = ""
-                    if user_input.conversation_id in self._conversation_history:
-                        history = self._conversation_history[user_input.conversation_id]
-                        history_messages = list(history)[-max_history:] if len(history) > max_history else history
-                        history_prompt = "\n用户历史消息\n" + "\n".join([
-                            f"- {msg['role']}: {msg['content']}" 
-                            for msg in history_messages
-                        ])
-                    
-                    
-                    media_player_prompt = ""
-                    if hasattr(self.hass, '_last_media_player') and self.hass._last_media_player.get('entity_id'):
-                        entity_id = self.hass._last_media_player.get('entity_id')
-                        state = self.hass.states.get(entity_id)
-                        if state:
-                            friendly_name = state.attributes.get('friendly_name', entity_id)
-                            media_player_prompt = f"\n当前活动的媒体播放器: {friendly_name} ({entity_id})"
-                    
-                    combined_prompt = "\n".join([
-                        llm.BASE_PROMPT,
-                        options.get(CONF_PROMPT, llm.DEFAULT_INSTRUCTIONS_PROMPT),
-                        history_prompt,
-                        media_player_prompt,  
-                    ])
-
-                    prompt_parts = [template.Template(combined_prompt, self.hass).async_render({
-                        "ha_name": self.hass.config.location_name,
-                        "user_name": user_name,
-                        "llm_context": llm_context,
-                        "exposed_entities": exposed_entities if self.entry.options.get(CONF_LLM_HASS_API) and self.entry.options.get(CONF_LLM_HASS_API) != "none" else [],
-                    }, parse_result=False)]
-
-
-                    if self.entry.options.get(CONF_LLM_HASS_API) and self.entry.options.get(CONF_LLM_HASS_API) != "none" and self.entry.options.get(CONF_HISTORY_ANALYSIS):
-                        if entities := self.entry.options.get(CONF_HISTORY_ENTITIES):
-                            await self._add_history_analysis(prompt_parts, entities)
-
-                    base_prompt = prompt_parts[0]
-                    base_instructions = [line.strip() if line.startswith(" ") else line for line in base_prompt.split('\n') if line.strip()]
-                    prompt_parts[0] = {"type": "system_instructions", "content": base_instructions}
-
-                    all_lines = []
-                    for part in prompt_parts:
-                        if isinstance(part["content"], list): 
-                            all_lines.extend([line.strip() if line.startswith(" ") else line for line in part["content"]])
-                        else: 
-                            all_lines.extend([line.strip() if line.startswith(" ") else line for line in part["content"].split('\n') if line.strip()])
+                tool_choice_setting = options.get(CONF_TOOL_CHOICE, DEFAULT_TOOL_CHOICE)
+                
+                base_payload["tool_choice"] = "required"
+                base_payload["temperature"] = 0.1  
+                base_payload["top_p"] = 0.1  
+                base_payload["do_sample"] = False  
 
-                    
-                    if self.llm_api and hasattr(self.llm_api, "api_prompt") and self.llm_api.api_prompt:
-                        all_lines.append(self.llm_api.api_prompt)
 
-                    
-                    system_content = "\n".join(all_lines)
-                    if dynamic_prompts:
-                        system_content = system_content + "\n\n" + dynamic_prompts
+                if tools:
+                    base_payload["tool_choice"] = "required"
+                    base_payload["temperature"] = 0.1
+                    base_payload["top_p"] = 0.1
+                    base_payload["do_sample"] = False
+                    base_payload["tools"] = tools
 
-                    if is_z1_model:
-                        z1_warning = "\n注意: 您正在使用Z1系列模型，此模型只能用于查询设备状态，不支持设备控制和工具调用。请直接回答用户问题，不要尝试使用工具。如果用户需要控制设备，请礼貌告知需要使用其他系列模型才能执行此操作。\n"
-                        system_content = system_content + z1_warning
-                        
-                        tools_description = ""
+                if is_z1_model:
+                    base_payload["tool_choice"] = "none"
                     
-                    messages_for_ai = [ChatCompletionMessageParam(role="system", content=system_content + "\n" + tools_description)]
-                    recent_messages = list(chat_log.content)[-max_history:] if len(chat_log.content) > max_history else chat_log.content
-
+                    if "tools" in base_payload:
+                        del base_payload["tools"]
                     
-                    filtered_recent_messages = []
-                    for msg in recent_messages:
-                        
-                        if msg.role == "user":
-                            filtered_recent_messages.append(msg)
-                        
-                        elif msg.role == "assistant" and msg.content and not getattr(msg, "tool_calls", None):
-                            filtered_recent_messages.append(msg)
-                        
+                    if "messages" not in base_payload:
+                        base_payload["messages"] = [ChatCompletionMessageParam(role="user", content=user_input.text)]
 
+                try:
+                    final_content = await AIResponseStrategy.direct_stream(
+                        self.entry.entry_id, api_key, base_payload, options, chat_log, 
+                        self.entity_id, transform_stream, None, None
+                    )
                     
-                    for msg in filtered_recent_messages:
-                        if msg.role == "user":
-                            messages_for_ai.append(ChatCompletionMessageParam(role="user", content=msg.content or ""))
-                        elif msg.role == "assistant":
-                            messages_for_ai.append(ChatCompletionMessageParam(role="assistant", content=msg.content))
-
-                    messages_for_ai.append(ChatCompletionMessageParam(role="user", content=user_input.text))
-                    api_key = self.entry.data[CONF_API_KEY]
-                    base_payload = {
-                        "model": options.get(CONF_CHAT_MODEL, RECOMMENDED_CHAT_MODEL),
-                        "max_tokens": min(options.get(CONF_MAX_TOKENS, RECOMMENDED_MAX_TOKENS), 4096),
-                        "top_p": options.get(CONF_TOP_P, RECOMMENDED_TOP_P),
-                        "temperature": options.get(CONF_TEMPERATURE, RECOMMENDED_TEMPERATURE),
-                        "request_id": conversation_id,
-                        "presence_penalty": options.get(CONF_PRESENCE_PENALTY, DEFAULT_PRESENCE_PENALTY),
-                        "frequency_penalty": options.get(CONF_FREQUENCY_PENALTY, DEFAULT_FREQUENCY_PENALTY),
-                        "stop": options.get(CONF_STOP_SEQUENCES, DEFAULT_STOP_SEQUENCES),
-                        "logit_bias": options.get(CONF_LOGIT_BIAS, DEFAULT_LOGIT_BIAS),
-                        "response_format": {"type": "text"}
-                    }
-                    if tools: base_payload["tools"] = tools
-
-                    if user_input.context and user_input.context.user_id:
-                        user = await self.hass.auth.async_get_user(user_input.context.user_id)
-                        if user and user.id:
-                            safe_user_id = f"ha_user_{user.id}"
-                            if 6 <= len(safe_user_id) <= 128:
-                                base_payload["user_id"] = safe_user_id
+                    if final_content:
+                        filtered_content = final_content.strip()
+                        await self._update_response(filtered_content)
+                        intent_response = intent.IntentResponse(language=user_input.language)
+                        intent_response.async_set_speech(filtered_content)
+                        return conversation.ConversationResult(
+                            response=intent_response,
+                            conversation_id=conversation_id,
+                            continue_conversation=chat_log.continue_conversation,
+                        )
+                except Exception as e:
+                    intent_response = intent.IntentResponse(language=user_input.language)
+                    intent_response.async_set_speech(f"{str(e)}")
+                    return conversation.ConversationResult(
+                        response=intent_response,
+                        conversation_id=conversation_id
+                    )
 
+            try:
+                self.llm_api = prework.result("llm_api")
+                chat_log.llm_api = self.llm_api
+                
+                if self.llm_api and hasattr(self.llm_api, "tools"):
+                    tool_spec = self._tool_cache.get(str(options[CONF_LLM_HASS_API]), self.llm_api)
+                    self._attr_extra_state_attributes["tool_cache"] = self._tool_cache.stats()
+                    tools = tool_spec.selector.select(user_input.text, options.get(CONF_TOOL_TOP_K, DEFAULT_TOOL_TOP_K))
+                    stable_tool_count = len(tools)
+                    if stable_tool_count < len(tool_spec.tools):
+                        LOGGER.debug("按相关度选择工具: %d/%d, %s", stable_tool_count, len(tool_spec.tools), [tool["function"]["name"] for tool in tools])
                     
-                    if is_z1_model:
-                        base_payload["tool_choice"] = "none"
-                        
-                        if "tools" in base_payload:
-                            del base_payload["tools"]
-                        
-                        if "messages" not in base_payload and len(messages_for_ai) > 0:
-                            base_payload["messages"] = messages_for_ai
-
-                    try:
-                        current_payload = dict(base_payload)
-                        current_payload["messages"] = messages_for_ai
-                        current_payload["stream"] = True
-                        
-                        if tools:
-                            current_payload["tools"] = tools
-                            current_payload["tool_choice"] = "required"
-                            current_payload["temperature"] = 0.1  
-                            current_payload["top_p"] = 0.1  
-                            current_payload["do_sample"] = False  
-
-                        final_content = await AIResponseStrategy.direct_stream(api_key, current_payload, options, chat_log, self.entity_id, self._transform_stream, self.llm_api, self._handle_tool_call)
-                        
-                        if final_content:
-                            filtered_content = self._filter_response_content(final_content)
-                            await self._update_response(filtered_content)
-                            intent_response = intent.IntentResponse(language=user_input.language)
-                            intent_response.async_set_speech(filtered_content)
-                            
-                            return conversation.ConversationResult(
-                                response=intent_response,
-                                conversation_id=conversation_id,
-                                continue_conversation=chat_log.continue_conversation,
-                            )
-                        
-                        
-                    except Exception:
-
-                        pass
-
-                    current_payload = dict(base_payload)
-                    current_payload["messages"] = messages_for_ai
-                    current_payload["stream"] = True
-
-                    try:
-                        
-                        ai_content, tool_calls_from_ai = await AIResponseStrategy.collect_stream(api_key, current_payload, options)
-                        if ai_content:
-                            filtered_content = self._filter_response_content(ai_content)
-                            await self._update_response(filtered_content)
-                        
-                        ai_history_message = ChatCompletionMessageParam(role="assistant", content=ai_content)
-                        if tool_calls_from_ai: ai_history_message["tool_calls"] = tool_calls_from_ai
-                        messages_for_ai.append(ai_history_message)
+                    additional_tools = get_tools_for_text(user_input.text, tools)
+                    if additional_tools:
+                        tools.extend(additional_tools)
+                    
+                    if tools:
+                        tool_choice_setting = options.get(CONF_TOOL_CHOICE, DEFAULT_TOOL_CHOICE)
                         
-                        if tool_calls_from_ai:
-                            final_response = await self._handle_tool_calls_parallel(tool_calls_from_ai, ai_content, messages_for_ai, user_input, base_payload, api_key, options)
-                            intent_response = intent.IntentResponse(language=user_input.language)
-                            intent_response.async_set_speech(final_response)
-                            if hasattr(self, 'session_histories') and conversation_id:
-                                self.session_histories[conversation_id] = messages_for_ai
-                            return conversation.ConversationResult(response=intent_response, conversation_id=conversation_id, continue_conversation=chat_log.continue_conversation)
-                        else:
-                            filtered_content = self._filter_response_content(ai_content)
-                            intent_response = intent.IntentResponse(language=user_input.language)
-                            intent_response.async_set_speech(filtered_content)
-                            return conversation.ConversationResult(response=intent_response, conversation_id=conversation_id, continue_conversation=chat_log.continue_conversation)
+                        tools_desc_parts = get_basic_tools_guide(tool_choice_setting)
+                        tools_desc_parts.append("\n")
+                        tools_desc_parts.extend(tool_spec.description if stable_tool_count == len(tool_spec.tools) else _describe_tools(tools[:stable_tool_count]))
+                        tools_description = "\n".join(tools_desc_parts)
+                        turn_tools_description = "\n".join(_describe_tools(tools[stable_tool_count:]))
+                        dynamic_prompts = get_prompts_for_text(user_input.text)
+            except HomeAssistantError as err:
+                api_key = self.entry.data[CONF_API_KEY]
+                base_payload = {
+                    "model": options.get(CONF_CHAT_MODEL, RECOMMENDED_CHAT_MODEL),
+                    "max_tokens": min(options.get(CONF_MAX_TOKENS, RECOMMENDED_MAX_TOKENS), 4096),
+                    "top_p": options.get(CONF_TOP_P, RECOMMENDED_TOP_P),
+                    "temperature": options.get(CONF_TEMPERATURE, RECOMMENDED_TEMPERATURE),
+                    "request_id": conversation_id,
+                    "logit_bias": options.get(CONF_LOGIT_BIAS, DEFAULT_LOGIT_BIAS),
+                    "response_format": {"type": "text"}
+                }
+                final_content = await AIResponseStrategy.direct_stream(
+                    self.entry.entry_id, api_key, base_payload, options, chat_log, 
+                    self.entity_id, transform_stream, None, None
+                )
+                if final_content:
+                    filtered_content = final_content.strip()
+                    await self._update_response(filtered_content)
+                    intent_response = intent.IntentResponse(language=user_input.language)
+                    intent_response.async_set_speech(filtered_content)
+                    return conversation.ConversationResult(
+                        response=intent_response,
+                        conversation_id=conversation_id,
+                        continue_conversation=chat_log.continue_conversation,
+                    )
 
-                    except Exception as e:
-                        error_text = str(e)
-                        intent_response = intent.IntentResponse(language=user_input.language)
-                        intent_response.async_set_speech(f"{error_text}")
-                        await self._update_response(error_text)
-                        return conversation.ConversationResult(response=intent_response, conversation_id=conversation_id)
+            web_search_keywords = ["联网", "搜索", "查询", "互联网", "上网", "百度", "谷歌", "必应"]
+            has_web_search = any(keyword in user_input.text for keyword in web_search_keywords)
+            if has_web_search and options.get(CONF_WEB_SEARCH, DEFAULT_WEB_SEARCH):
+                
+                additional_tools = get_tools_for_text(user_input.text, tools)
+                if additional_tools:
+                    tools.extend(additional_tools)
+        except HomeAssistantError:
+            pass
+
+        cache_key = None
+        # Only self-contained questions are cached; a follow-up such as "那卧室呢" leans on earlier turns.
+        if tools and not is_z1_model and options.get(CONF_RESPONSE_CACHE, DEFAULT_RESPONSE_CACHE) and not self._has_prior_turns(user_input, chat_log):
+            cache_key = self._response_cache.key(
+                user_input.text,
+                options.get(CONF_CHAT_MODEL, RECOMMENDED_CHAT_MODEL),
+                (options.get(CONF_PROMPT), options[CONF_LLM_HASS_API], user_input.language, user_name, tuple(tool["function"]["name"] for tool in tools)),
+            )
+            if cache_key is not None:
+                cached = self._response_cache.get(cache_key)
+                self._attr_extra_state_attributes["response_cache"] = self._response_cache.stats()
+                if cached is not None:
+                    LOGGER.debug("命中回答缓存: %s", cache_key[0])
+                    if gate is not None:
+                        # Like a streamed answer, a cached one waits for the race; a local win cancels this turn here.
+                        await gate.async_wait()
+                    return await self._async_cached_result(cached, user_input, conversation_id, chat_log)
 
-                except template.TemplateError as err:
-                    content_message = f"抱歉，Jinja2 模板解析出错，请检查配置模板: {err}"
-                    filtered_content = self._filter_response_content(content_message)
-                    intent_response = intent.IntentResponse(language=user_input.language)
-                    intent_response.async_set_error(intent.IntentResponseErrorCode.UNKNOWN, filtered_content)
-                    await self._update_response(filtered_content)
-                    return conversation.ConversationResult(response=intent_response, conversation_id=conversation_id)
-        except Exception as err:
+        
+        try:
+            if (entity_index := get_entity_index(self.hass)) is not None:
+                exposed_entities = entity_index.registry_entries
+            else:
+                er = entity_registry.async_get(self.hass)
+                entities_dict = {entity_id: er.async_get(entity_id) for entity_id in self.hass.states.async_entity_ids()}
+                exposed_entities = [entity for entity in entities_dict.values() if entity and not entity.hidden]
             
-            error_result = await self._handle_exception(err, user_input.text, user_input.conversation_id)
-            error_text = error_result.get("message", f"处理错误: {str(err)}")
+            max_history = options.get(CONF_MAX_HISTORY_MESSAGES, RECOMMENDED_MAX_HISTORY_MESSAGES)
             
+            turns, history_lines = merge_history(
+                chat_turns(chat_log.content, user_input.text),
+                self.history.get(user_input.conversation_id),
+                user_input.text,
+                max_history,
+            )
+            history_prompt = "\n用户历史消息\n" + "\n".join(history_lines) if history_lines else ""
             
-            await self._update_response(error_text)
             
-            intent_response = intent.IntentResponse(language=user_input.language)
-            intent_response.async_set_speech(error_text)
+            media_player_prompt = ""
+            if hasattr(self.hass, '_last_media_player') and self.hass._last_media_player.get('entity_id'):
+                entity_id = self.hass._last_media_player.get('entity_id')
+                state = self.hass.states.get(entity_id)
+                if state:
+                    friendly_name = state.attributes.get('friendly_name', entity_id)
+                    media_player_prompt = f"\n当前活动的媒体播放器: {friendly_name} ({entity_id})"
             
-            return conversation.ConversationResult(
-                response=intent_response,
-                conversation_id=user_input.conversation_id or ulid.ulid_now()
+            prompt_variables = {
+                "ha_name": self.hass.config.location_name,
+                "user_name": user_name,
+                "llm_context": llm_context,
+                "exposed_entities": exposed_entities if self.entry.options.get(CONF_LLM_HASS_API) and self.entry.options.get(CONF_LLM_HASS_API) != "none" else [],
+            }
+            stable_lines = self._prompt_renderer.async_render(options.get(CONF_PROMPT, llm.DEFAULT_INSTRUCTIONS_PROMPT), prompt_variables)
+            if self.llm_api and hasattr(self.llm_api, "api_prompt") and self.llm_api.api_prompt:
+                stable_lines.append(self.llm_api.api_prompt)
+
+            turn_lines = self._prompt_renderer.async_render(llm.BASE_PROMPT, prompt_variables)
+            analysis_lines = [line.strip() if line.startswith(" ") else line for line in prework.get("history_analysis") or ()]
+            turn_lines.extend(normalize_lines(history_prompt))
+            turn_lines.extend(normalize_lines(media_player_prompt))
+
+            if is_z1_model:
+                tools_description = turn_tools_description = ""
+                stable_lines.append(z1_warning.strip())
+
+            system_content = join_sections(
+                ["\n".join(stable_lines), tools_description],
+                ["\n".join(turn_lines), turn_tools_description, dynamic_prompts],
+            )
+            model = options.get(CONF_CHAT_MODEL, RECOMMENDED_CHAT_MODEL)
+            plan = ContextBuilder(context_budget(options, model)).build(
+                system_content, user_input.text, turns, None if is_z1_model else tools, analysis_lines
             )
+            messages_for_ai = plan.messages
+            self._attr_extra_state_attributes["context_tokens"] = plan.as_dict()
+            LOGGER.debug("上下文令牌分配: %s", self._attr_extra_state_attributes["context_tokens"])
+            api_key = self.entry.data[CONF_API_KEY]
+            base_payload = {
+                "model": options.get(CONF_CHAT_MODEL, RECOMMENDED_CHAT_MODEL),
+                "max_tokens": min(options.get(CONF_MAX_TOKENS, RECOMMENDED_MAX_TOKENS), 4096),
+                "top_p": options.get(CONF_TOP_P, RECOMMENDED_TOP_P),
+                "temperature": options.get(CONF_TEMPERATURE, RECOMMENDED_TEMPERATURE),
+                "request_id": conversation_id,
+                "presence_penalty": options.get(CONF_PRESENCE_PENALTY, DEFAULT_PRESENCE_PENALTY),
+                "frequency_penalty": options.get(CONF_FREQUENCY_PENALTY, DEFAULT_FREQUENCY_PENALTY),
+                "stop": options.get(CONF_STOP_SEQUENCES, DEFAULT_STOP_SEQUENCES),
+                "logit_bias": options.get(CONF_LOGIT_BIAS, DEFAULT_LOGIT_BIAS),
+                "response_format": {"type": "text"}
+            }
+            if tools: base_payload["tools"] = tools
+
+            if user and user.id:
+                safe_user_id = f"ha_user_{user.id}"
+                if 6 <= len(safe_user_id) <= 128:
+                    base_payload["user_id"] = safe_user_id
+
+            
+            if is_z1_model:
+                base_payload["tool_choice"] = "none"
+                
+                if "tools" in base_payload:
+                    del base_payload["tools"]
+                
+                if "messages" not in base_payload and len(messages_for_ai) > 0:
+                    base_payload["messages"] = messages_for_ai
 
-    async def _add_history_analysis(self, prompt_parts: list, entities: list) -> None:
+            try:
+                current_payload = dict(base_payload)
+                current_payload["messages"] = messages_for_ai
+                current_payload["stream"] = True
+                
+                if tools:
+                    current_payload["tools"] = tools
+                    current_payload["tool_choice"] = "required"
+                    current_payload["temperature"] = 0.1  
+                    current_payload["top_p"] = 0.1  
+                    current_payload["do_sample"] = False  
+
+                final_content = await AIResponseStrategy.direct_stream(self.entry.entry_id, api_key, current_payload, options, chat_log, self.entity_id, transform_stream, self.llm_api, self._handle_tool_call)
+                self._attr_extra_state_attributes["coalescing"] = get_coalesce_stats()
+                if pool := get_pool(self.entry.entry_id):
+                    self._attr_extra_state_attributes["connection_pool"] = pool.stats
+                
+                if final_content:
+                    filtered_content = final_content.strip()
+                    await self._update_response(filtered_content)
+                    intent_response = intent.IntentResponse(language=user_input.language)
+                    intent_response.async_set_speech(filtered_content)
+                    
+                    return conversation.ConversationResult(
+                        response=intent_response,
+                        conversation_id=conversation_id,
+                        continue_conversation=chat_log.continue_conversation,
+                    )
+                
+                
+            except Exception:
+
+                pass
+
+            current_payload = dict(base_payload)
+            current_payload["messages"] = messages_for_ai
+            current_payload["stream"] = True
+
+            try:
+                
+                if gate:
+                    await gate.async_wait()
+                ai_content, tool_calls_from_ai = await AIResponseStrategy.collect_stream(self.entry.entry_id, api_key, current_payload, options)
+                if ai_content:
+                    filtered_content = self._filter_response_content(ai_content)
+                    await self._update_response(filtered_content)
+                
+                ai_history_message = ChatCompletionMessageParam(role="assistant", content=ai_content)
+                if tool_calls_from_ai: ai_history_message["tool_calls"] = tool_calls_from_ai
+                messages_for_ai.append(ai_history_message)
+                
+                if tool_calls_from_ai:
+                    final_response = await self._handle_tool_calls_parallel(tool_calls_from_ai, ai_content, messages_for_ai, user_input, base_payload, api_key, options, cache_key)
+                    intent_response = intent.IntentResponse(language=user_input.language)
+                    intent_response.async_set_speech(final_response)
+                    return conversation.ConversationResult(response=intent_response, conversation_id=conversation_id, continue_conversation=chat_log.continue_conversation)
+                else:
+                    filtered_content = self._filter_response_content(ai_content)
+                    self.history.append(conversation_id, "assistant", filtered_content)
+                    intent_response = intent.IntentResponse(language=user_input.language)
+                    intent_response.async_set_speech(filtered_content)
+                    return conversation.ConversationResult(response=intent_response, conversation_id=conversation_id, continue_conversation=chat_log.continue_conversation)
+
+            except Exception as e:
+                error_text = str(e)
+                intent_response = intent.IntentResponse(language=user_input.language)
+                intent_response.async_set_speech(f"{error_text}")
+                await self._update_response(error_text)
+                return conversation.ConversationResult(response=intent_response, conversation_id=conversation_id)
+
+        except template.TemplateError as err:
+            content_message = f"抱歉，Jinja2 模板解析出错，请检查配置模板: {err}"
+            filtered_content = self._filter_response_content(content_message)
+            intent_response = intent.IntentResponse(language=user_input.language)
+            intent_response.async_set_error(intent.IntentResponseErrorCode.UNKNOWN, filtered_content)
+            await self._update_response(filtered_content)
+            return conversation.ConversationResult(response=intent_response, conversation_id=conversation_id)
+
+    def _has_prior_turns(self, user_input: conversation.ConversationInput, chat_log: conversation.ChatLog) -> bool:
+        if chat_turns(chat_log.content, user_input.text):
+            return True
+        # The current question was appended to the stored history already.
+        stored = self.history.get(user_input.conversation_id)
+        return len(stored) > 1 or any(message.content != user_input.text for message in stored)
+
+    async def _async_get_user(self, user_input: conversation.ConversationInput):
+        if user_input.context and user_input.context.user_id:
+            return await self.hass.auth.async_get_user(user_input.context.user_id)
+        return None
+
+    async def _async_history_analysis(self, entities: list) -> list[str]:
         try:
-            if (self.entry.options.get(CONF_LLM_HASS_API) and self.entry.options.get(CONF_LLM_HASS_API) != "none" and 
-                self.entry.options.get(CONF_HISTORY_ANALYSIS)):
-                if entities:
-                    now = datetime.now()
-                    days = self.entry.options.get(CONF_HISTORY_DAYS, DEFAULT_HISTORY_DAYS)
-                    interval_seconds = self.entry.options.get(CONF_HISTORY_INTERVAL, DEFAULT_HISTORY_INTERVAL) * 60
-                    history_text = [f"以下是询问者所关注的实体的历史数据分析（{days}天内）："]
-                    history_data = await get_instance(self.hass).async_add_executor_job(
-                        get_significant_states, self.hass, now - timedelta(days=days), now,
-                        entities, None, True, True)
-
-                def process_states(states, current_state):
-                    return ([f"- {current_state.state if current_state else 'unknown'} ({current_state.last_updated.astimezone().strftime('%m-%d %H:%M:%S') if current_state else 'unknown'})"] if not states else
-                            [f"- {state} ({time.strftime('%m-%d %H:%M:%S')})" for state, time, _ in sorted(
-                                ((s.state, s.last_updated.astimezone(), i) for i, s in enumerate(states) if s.state != "unavailable"),
-                                key=lambda x: x[1]) if not _ or time.timestamp() - states[_-1].last_updated.timestamp() >= interval_seconds])
-
-                for entity_id in entities:
+            days = self.entry.options.get(CONF_HISTORY_DAYS, DEFAULT_HISTORY_DAYS)
+            interval_seconds = self.entry.options.get(CONF_HISTORY_INTERVAL, DEFAULT_HISTORY_INTERVAL) * 60
+            history_text = [f"以下是询问者所关注的实体的历史数据分析（{days}天内）："]
+            history_data = await async_get_entity_history(self.hass, entities, days, interval_seconds)
+
+            for entity_id in entities:
+                samples = history_data.get(entity_id, [])
+                history_text.append(f"{entity_id} ({('历史状态变化' if samples else '当前状态')}):")
+                if samples:
+                    history_text.extend(f"- {state} ({when.astimezone().strftime('%m-%d %H:%M:%S')})" for state, when in samples)
+                else:
                     current_state = self.hass.states.get(entity_id)
-                    states = history_data.get(entity_id, [])
-                    history_text.append(f"{entity_id} ({('历史状态变化' if states else '当前状态')}):")
-                    history_text.extend(process_states(states, current_state))
-                
-                if len(history_text) > 1:
-                    prompt_parts.append({"type": "history_analysis", "content": history_text})
-        except Exception: pass
+                    history_text.append(f"- {current_state.state if current_state else 'unknown'} ({current_state.last_updated.astimezone().strftime('%m-%d %H:%M:%S') if current_state else 'unknown'})")
+
+            return history_text if len(history_text) > 1 else []
+        except Exception:
+            return []
 
     async def _handle_tool_call(self, tool_input: llm.ToolInput, user_text):
         try:
             
             LOGGER.debug("处理工具调用: %s, 参数: %s", 
                        tool_input.tool_name, 
-                       json.dumps(tool_input.tool_args, ensure_ascii=False))
+                       LazyJSON(tool_input.tool_args))
             
             if not self.llm_api or not hasattr(self.llm_api, "async_call_tool"):
                 error_msg = "LLM API未初始化"
@@ -1115,8 +1160,8 @@ class ZhipuAIConversationEntity(conversation.ConversationEntity, conversation.Ab
             
             if isinstance(tool_input.tool_args, str):
                 try: 
-                    tool_args_dict = json.loads(tool_input.tool_args)
-                except json.JSONDecodeError as json_err: 
+                    tool_args_dict = loads(tool_input.tool_args)
+                except JSONDecodeError as json_err: 
                     error_msg = str(json_err)
                     self._last_error_message = error_msg
                     tool_args_dict = {"text": tool_input.tool_args}
@@ -1186,6 +1231,10 @@ class ZhipuAIConversationEntity(conversation.ConversationEntity, conversation.Ab
         entity = hass.data[DOMAIN].get(entry.entry_id)
         if entity:
             entity.entry = entry
+            entity._prompt_renderer.invalidate()
+            entity._tool_cache.invalidate()
+            entity._response_cache.invalidate()
+            await entity.history.async_update_options(entry.options)
 
     async def _transform_stream(
         self, stream: AsyncGenerator[dict, None], llm_api: llm.AbstractLLMApi
@@ -1193,6 +1242,8 @@ class ZhipuAIConversationEntity(conversation.ConversationEntity, conversation.Ab
         is_first = True
         collected_content = ""
         collected_tool_calls = []
+        markdown = MarkdownStreamFilter() if self.entry.options.get(CONF_FILTER_MARKDOWN, DEFAULT_FILTER_MARKDOWN) == "on" else None
+        collected_ids = set()
         tool_call_fragments = {}  
         
         try:
@@ -1206,8 +1257,9 @@ class ZhipuAIConversationEntity(conversation.ConversationEntity, conversation.Ab
                     is_first = False
                 
                 if "content" in delta and delta["content"] is not None:
-                    collected_content += delta["content"]
-                    yield {"content": delta["content"]}
+                    if content := markdown.feed(delta["content"]) if markdown else delta["content"]:
+                        collected_content += content
+                        yield {"content": content}
                 
                 if "tool_calls" in delta and delta["tool_calls"]:
                     for tool_call in delta["tool_calls"]:
@@ -1233,15 +1285,14 @@ class ZhipuAIConversationEntity(conversation.ConversationEntity, conversation.Ab
                         
                         try:
                             fragment = tool_call_fragments[call_id]
-                            if fragment["function"]["name"] and fragment["function"]["arguments"]:
+                            if call_id not in collected_ids and fragment["function"]["name"] and fragment["function"]["arguments"]:
                                 args_str = fragment["function"]["arguments"].strip()
                                 if args_str.endswith("}"): 
                                     try:
-                                        json.loads(args_str)  
-                                        
-                                        if not any(c.get("id") == call_id for c in collected_tool_calls):
-                                            collected_tool_calls.append(fragment.copy())
-                                    except json.JSONDecodeError:
+                                        loads(args_str)  
+                                        collected_ids.add(call_id)
+                                        collected_tool_calls.append(fragment.copy())
+                                    except JSONDecodeError:
                                         pass  
                         except Exception as e:
                             LOGGER.debug("解析工具调用时出错: %s", str(e))
@@ -1250,21 +1301,32 @@ class ZhipuAIConversationEntity(conversation.ConversationEntity, conversation.Ab
                 if finish_reason:
                     if collected_tool_calls:
                         for call_id, fragment in tool_call_fragments.items():
-                            if not any(c.get("id") == call_id for c in collected_tool_calls):
+                            if call_id not in collected_ids:
                                 try:
                                     args_str = fragment["function"]["arguments"].strip()
-                                    json.loads(args_str)  
+                                    loads(args_str)  
+                                    collected_ids.add(call_id)
                                     collected_tool_calls.append(fragment.copy())
-                                except (json.JSONDecodeError, Exception):
+                                except (JSONDecodeError, Exception):
                                     pass  
-                                
+                        
+                        if markdown and (content := markdown.flush()):
+                            collected_content += content
+                            yield {"content": content}
                         yield {"collected_tool_calls": collected_tool_calls, "content": collected_content}
                         return
                     elif finish_reason in ["stop", "length"]:
                         break
+            
+            if markdown and (content := markdown.flush()):
+                yield {"content": content}
         except asyncio.CancelledError:
             raise
         except Exception as e:
+            # Text held back for a possible markdown marker is still part of the answer.
+            if markdown and (content := markdown.flush()):
+                collected_content += content
+                yield {"content": content}
             if collected_tool_calls:
                 yield {"collected_tool_calls": collected_tool_calls, "content": collected_content, "error": str(e)}
             else:
@@ -1287,14 +1349,15 @@ class ZhipuAIConversationEntity(conversation.ConversationEntity, conversation.Ab
                 pass
         return {"success": False, "message": str(exception)}
 
-    async def _handle_tool_calls_parallel(self, tool_calls, ai_content, messages_for_ai, user_input, base_payload, api_key, options):
+    async def _handle_tool_calls_parallel(self, tool_calls, ai_content, messages_for_ai, user_input, base_payload, api_key, options, cache_key=None):
         processor = ToolCallProcessor(self, api_key, options)
         return await processor.process(
             tool_calls, 
             ai_content, 
             messages_for_ai,
             user_input, 
-            base_payload
+            base_payload,
+            cache_key
         )
 
 async def async_setup_entry(
@@ -9,10 +9,9 @@ from typing import List
 from homeassistant.core import HomeAssistant, ServiceCall, State
 from homeassistant.exceptions import ServiceValidationError
 from homeassistant.helpers import entity_registry as er, config_validation as cv
-from homeassistant.components.recorder import get_instance
-from homeassistant.components.recorder.history import get_significant_states
 
 from .const import DOMAIN, LOGGER
+from .entity_history import async_get_entity_history
 
 ENTITY_ANALYSIS_SCHEMA = vol.Schema({
     vol.Required("entity_id"): vol.Any(cv.entity_id, [cv.entity_id]),
@@ -60,29 +59,12 @@ async def async_setup_entity_analysis(hass: HomeAssistant) -> None:
             history_text = []
             
             if valid_entity_ids:
-                instance = get_instance(hass)
-                history_data = await instance.async_add_executor_job(
-                    get_significant_states,
-                    hass,
-                    start_time,
-                    end_time,
-                    valid_entity_ids,
-                    None,
-                    True,
-                    True
-                )
-
-                if history_data:
-                    for entity_id in valid_entity_ids:
-                        if entity_id not in history_data:
-                            continue
-                        
-                        for state in history_data[entity_id]:
-                            if state is None:
-                                continue
-                            history_text.append(
-                                f"{entity_id}, {state.state}, {state.last_updated.strftime('%Y-%m-%d %H:%M:%S')}"
-                            )
+                history_data = await async_get_entity_history(hass, valid_entity_ids, days)
+                for entity_id in valid_entity_ids:
+                    for state, last_updated in history_data.get(entity_id, ()):
+                        history_text.append(
+                            f"{entity_id}, {state}, {last_updated.strftime('%Y-%m-%d %H:%M:%S')}"
+                        )
 
             for entity_id, state in current_states.items():
                 history_text.append(
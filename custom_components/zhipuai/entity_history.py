@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from itertools import chain
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from homeassistant.components.recorder import get_instance
+from homeassistant.components.recorder.history import get_significant_states
+from homeassistant.const import EVENT_STATE_CHANGED
+from homeassistant.core import Event, HomeAssistant, callback
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    DOMAIN,
+    ENTITY_HISTORY_MAX_ENTITIES,
+    ENTITY_HISTORY_MAX_SAMPLES,
+    LOGGER,
+    MAX_HISTORY_DAYS,
+)
+
+DATA_ENTITY_HISTORY = f"{DOMAIN}_entity_history"
+
+Sample = Tuple[str, datetime]
+
+
+def same_slot(first: datetime, second: datetime, interval: float) -> bool:
+    return bool(interval) and first.timestamp() // interval == second.timestamp() // interval
+
+
+def downsample(samples: Iterable[Sample], interval: float) -> List[Sample]:
+    """Keep the latest change of every ``interval`` second slot."""
+    result: List[Sample] = []
+    for sample in samples:
+        if result and same_slot(result[-1][1], sample[1], interval):
+            result[-1] = sample
+        else:
+            result.append(sample)
+    return result
+
+
+async def async_query_recorder(hass: HomeAssistant, entity_ids: Sequence[str], start: datetime, end: datetime) -> Dict[str, List[Sample]]:
+    history = await get_instance(hass).async_add_executor_job(
+        get_significant_states, hass, start, end, list(entity_ids), None, True, True)
+    return {
+        entity_id: [(state.state, state.last_updated) for state in states if state is not None and state.state != "unavailable"]
+        for entity_id, states in (history or {}).items()
+    }
+
+
+class EntityHistory:
+    __slots__ = ("samples", "since", "interval")
+
+    def __init__(self, since: datetime, interval: float) -> None:
+        self.samples: Deque[Sample] = deque(maxlen=ENTITY_HISTORY_MAX_SAMPLES)
+        self.since = since
+        self.interval = interval
+
+    def append(self, state: str, when: datetime) -> None:
+        if self.samples and state == self.samples[-1][0]:
+            return
+        if self.samples and same_slot(self.samples[-1][1], when, self.interval):
+            self.samples[-1] = (state, when)
+        else:
+            if len(self.samples) == self.samples.maxlen:
+                # What is evicted is no longer covered.
+                self.samples.popleft()
+                self.since = max(self.since, self.samples[0][1] if self.samples else when)
+            self.samples.append((state, when))
+        cutoff = dt_util.utcnow() - timedelta(days=MAX_HISTORY_DAYS)
+        while self.samples and self.samples[0][1] < cutoff:
+            self.samples.popleft()
+            self.since = max(self.since, cutoff)
+
+    def covers(self, start: datetime, interval: float) -> bool:
+        return self.since <= start and self.interval <= interval
+
+
+class EntityHistoryCache:
+    """Rolling in-memory state history for the entities the assistant reads.
+
+    Each entity is seeded once from the recorder, then kept current from
+    ``state_changed`` events, downsampled to the finest interval asked for.
+    At most ``ENTITY_HISTORY_MAX_ENTITIES`` entities of
+    ``ENTITY_HISTORY_MAX_SAMPLES`` samples are kept, least recently read
+    first out; the entities of the request being answered are never evicted.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self.hass = hass
+        self._series: OrderedDict[str, EntityHistory] = OrderedDict()
+        self._seeding: Dict[str, asyncio.Future] = {}
+        self._pending: Dict[str, List[Sample]] = {}
+        self._unsub = None
+        self._users = 0
+
+    def __contains__(self, entity_id: str) -> bool:
+        return entity_id in self._series
+
+    @callback
+    def async_start(self) -> None:
+        self._unsub = self.hass.bus.async_listen(EVENT_STATE_CHANGED, self._async_state_changed, event_filter=self._event_filter)
+
+    @callback
+    def async_stop(self) -> None:
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
+        self._series.clear()
+
+    @callback
+    def _event_filter(self, event_data: Dict[str, Any]) -> bool:
+        entity_id = event_data.get("entity_id")
+        if entity_id not in self._series and entity_id not in self._pending:
+            return False
+        old_state, new_state = event_data.get("old_state"), event_data.get("new_state")
+        return new_state is not None and new_state.state != "unavailable" and (old_state is None or old_state.state != new_state.state)
+
+    @callback
+    def _async_state_changed(self, event: Event) -> None:
+        entity_id, new_state = event.data["entity_id"], event.data["new_state"]
+        if entity_id in self._pending:
+            self._pending[entity_id].append((new_state.state, new_state.last_updated))
+        elif (series := self._series.get(entity_id)) is not None:
+            series.append(new_state.state, new_state.last_updated)
+
+    async def async_get(self, entity_ids: Sequence[str], days: float, interval: float = 0) -> Dict[str, List[Sample]]:
+        """Samples of the last ``days`` days, downsampled to ``interval`` seconds.
+
+        Only entities not yet covered for that window and interval hit the
+        recorder, in one query; concurrent callers share it.
+        """
+        now = dt_util.utcnow()
+        start = now - timedelta(days=days)
+        missing = [entity_id for entity_id in entity_ids if entity_id not in self._series or not self._series[entity_id].covers(start, interval)]
+        waiting = [self._seeding[entity_id] for entity_id in missing if entity_id in self._seeding]
+        missing = [entity_id for entity_id in missing if entity_id not in self._seeding]
+        history: Dict[str, List[Sample]] = {}
+        if missing:
+            # Reseeding never narrows what an entity already covered.
+            known = [self._series[entity_id] for entity_id in missing if entity_id in self._series]
+            history = await self._async_seed(
+                missing,
+                min([start] + [series.since for series in known]),
+                now,
+                min([interval] + [series.interval for series in known]),
+            )
+        if waiting:
+            await asyncio.gather(*waiting, return_exceptions=True)
+
+        # A series capped at ENTITY_HISTORY_MAX_SAMPLES may not reach back to
+        # start; the older part of the window comes from the recorder.
+        short = [entity_id for entity_id in entity_ids if entity_id not in history and entity_id in self._series and self._series[entity_id].since > start]
+        if short:
+            history.update(await async_query_recorder(self.hass, short, start, now))
+
+        result: Dict[str, List[Sample]] = {}
+        for entity_id in entity_ids:
+            if (series := self._series.get(entity_id)) is None:
+                continue
+            self._series.move_to_end(entity_id)
+            samples: Iterable[Sample] = (sample for sample in series.samples if sample[1] >= start)
+            if series.since > start:
+                samples = chain((sample for sample in history.get(entity_id, ()) if start <= sample[1] < series.since), samples)
+            result[entity_id] = downsample(samples, interval)
+        self._trim(entity_ids)
+        return result
+
+    def _trim(self, keep: Sequence[str]) -> None:
+        excess = len(self._series) - ENTITY_HISTORY_MAX_ENTITIES
+        if excess <= 0:
+            return
+        keep = set(keep)
+        for entity_id in [entity_id for entity_id in self._series if entity_id not in keep][:excess]:
+            del self._series[entity_id]
+
+    async def _async_seed(self, entity_ids: List[str], start: datetime, end: datetime, interval: float) -> Dict[str, List[Sample]]:
+        future = self.hass.loop.create_future()
+        for entity_id in entity_ids:
+            self._seeding[entity_id] = future
+            self._pending[entity_id] = []
+        try:
+            history = await async_query_recorder(self.hass, entity_ids, start, end)
+            for entity_id in entity_ids:
+                self._series.pop(entity_id, None)
+                series = EntityHistory(start, interval)
+                for state, when in history.get(entity_id, ()):
+                    series.append(state, when)
+                # Changes that landed while the recorder query ran.
+                for state, when in self._pending.get(entity_id, ()):
+                    if not series.samples or when > series.samples[-1][1]:
+                        series.append(state, when)
+                self._series[entity_id] = series
+            LOGGER.debug("已从记录器载入 %d 个实体的历史", len(entity_ids))
+            return history
+        finally:
+            for entity_id in entity_ids:
+                self._seeding.pop(entity_id, None)
+                self._pending.pop(entity_id, None)
+            future.set_result(None)
+
+
+@callback
+def async_acquire_entity_history(hass: HomeAssistant) -> EntityHistoryCache:
+    cache = hass.data.get(DATA_ENTITY_HISTORY)
+    if cache is None:
+        cache = hass.data[DATA_ENTITY_HISTORY] = EntityHistoryCache(hass)
+        cache.async_start()
+    cache._users += 1
+    return cache
+
+
+@callback
+def async_release_entity_history(hass: HomeAssistant) -> None:
+    cache = hass.data.get(DATA_ENTITY_HISTORY)
+    if cache is None:
+        return
+    cache._users -= 1
+    if cache._users <= 0:
+        cache.async_stop()
+        hass.data.pop(DATA_ENTITY_HISTORY, None)
+
+
+def get_entity_history(hass: HomeAssistant) -> Optional[EntityHistoryCache]:
+    return hass.data.get(DATA_ENTITY_HISTORY)
+
+
+async def async_get_entity_history(hass: HomeAssistant, entity_ids: Sequence[str], days: float, interval: float = 0) -> Dict[str, List[Sample]]:
+    if (cache := get_entity_history(hass)) is not None:
+        return await cache.async_get(entity_ids, days, interval)
+    end = dt_util.utcnow()
+    history = await async_query_recorder(hass, entity_ids, end - timedelta(days=days), end)
+    return {entity_id: downsample(samples, interval) for entity_id, samples in history.items()}
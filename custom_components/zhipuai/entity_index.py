@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
+
+from homeassistant.components import conversation
+from homeassistant.components.homeassistant.exposed_entities import (
+    async_listen_entity_updates,
+    async_should_expose,
+)
+from homeassistant.const import EVENT_STATE_CHANGED
+from homeassistant.core import Event, HomeAssistant, State, callback
+from homeassistant.helpers import entity_registry as er
+
+from .const import DOMAIN, LOGGER
+
+DATA_ENTITY_INDEX = f"{DOMAIN}_entity_index"
+
+
+class IndexedEntity:
+    __slots__ = ("entity_id", "domain", "object_id", "friendly_name", "aliases", "registry_entry")
+
+    def __init__(self, state: State, registry_entry: Optional[er.RegistryEntry]) -> None:
+        self.entity_id = state.entity_id
+        self.domain = state.domain
+        self.object_id = state.object_id.lower()
+        self.friendly_name = str(state.attributes.get("friendly_name") or "").lower()
+        self.aliases = tuple(alias.lower() for alias in (registry_entry.aliases if registry_entry else ()) if alias)
+        self.registry_entry = registry_entry
+
+    def matches_name(self, text: str) -> bool:
+        return (
+            text in self.object_id
+            or self.object_id in text
+            or bool(self.friendly_name) and (text in self.friendly_name or self.friendly_name in text)
+        )
+
+    def matches_alias(self, text: str) -> bool:
+        return any(text in alias or alias in text for alias in self.aliases)
+
+    def mentioned_in(self, text: str) -> bool:
+        return self.entity_id in text or any(len(name) > 1 and name in text for name in (self.friendly_name, *self.aliases))
+
+
+def _state_event_filter(event_data: Dict[str, Any]) -> bool:
+    old_state = event_data.get("old_state")
+    new_state = event_data.get("new_state")
+    return (
+        old_state is None
+        or new_state is None
+        or old_state.attributes.get("friendly_name") != new_state.attributes.get("friendly_name")
+    )
+
+
+class ExposedEntityIndex:
+    """Entities exposed to the conversation assistant.
+
+    Built once and then kept current from state added/removed, entity
+    registry and exposure change events, so a turn never has to walk the
+    whole state machine or registry.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self.hass = hass
+        self._entities: Dict[str, IndexedEntity] = {}
+        self._by_domain: Dict[str, Dict[str, IndexedEntity]] = {}
+        self._registry_entries: Optional[List[er.RegistryEntry]] = None
+        self._unsubs: list = []
+        self._users = 0
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+    def __contains__(self, entity_id: str) -> bool:
+        return entity_id in self._entities
+
+    def has_domain(self, domain: str) -> bool:
+        return domain in self._by_domain
+
+    @property
+    def registry_entries(self) -> List[er.RegistryEntry]:
+        if self._registry_entries is None:
+            self._registry_entries = [item.registry_entry for item in self._entities.values() if item.registry_entry]
+        return self._registry_entries
+
+    def entity_ids(self, domain: Optional[str] = None) -> List[str]:
+        if domain is None:
+            return list(self._entities)
+        return list(self._by_domain.get(domain, ()))
+
+    def find(self, domain: str, text: str) -> Optional[str]:
+        text = text.lower()
+        candidates = self._by_domain.get(domain)
+        if not candidates or not text:
+            return None
+        for item in candidates.values():
+            if item.matches_name(text):
+                return item.entity_id
+        for item in candidates.values():
+            if item.matches_alias(text):
+                return item.entity_id
+        return None
+
+    def mentioned(self, text: str) -> List[str]:
+        """Entities whose id, friendly name or alias appears in ``text``."""
+        text = text.lower()
+        return [entity_id for entity_id, item in self._entities.items() if item.mentioned_in(text)]
+
+    @callback
+    def async_start(self) -> None:
+        self.async_rebuild()
+        self._unsubs = [
+            self.hass.bus.async_listen(EVENT_STATE_CHANGED, self._async_state_changed, event_filter=_state_event_filter),
+            self.hass.bus.async_listen(er.EVENT_ENTITY_REGISTRY_UPDATED, self._async_registry_updated),
+            async_listen_entity_updates(self.hass, conversation.DOMAIN, self.async_rebuild),
+        ]
+
+    @callback
+    def async_stop(self) -> None:
+        for unsub in self._unsubs:
+            unsub()
+        self._unsubs.clear()
+        self._entities.clear()
+        self._by_domain.clear()
+        self._registry_entries = None
+
+    @callback
+    def async_rebuild(self) -> None:
+        self._entities.clear()
+        self._by_domain.clear()
+        self._registry_entries = None
+        ent_reg = er.async_get(self.hass)
+        for state in self.hass.states.async_all():
+            self._async_update(state.entity_id, state, ent_reg)
+        LOGGER.debug("已建立暴露实体索引: %d 个实体", len(self._entities))
+
+    @callback
+    def _async_update(self, entity_id: str, state: Optional[State] = None, ent_reg: Optional[er.EntityRegistry] = None) -> None:
+        self._async_remove(entity_id)
+        state = state or self.hass.states.get(entity_id)
+        if state is None or not async_should_expose(self.hass, conversation.DOMAIN, entity_id):
+            return
+        item = IndexedEntity(state, (ent_reg or er.async_get(self.hass)).async_get(entity_id))
+        self._entities[entity_id] = item
+        self._by_domain.setdefault(item.domain, {})[entity_id] = item
+        self._registry_entries = None
+
+    @callback
+    def _async_remove(self, entity_id: str) -> None:
+        item = self._entities.pop(entity_id, None)
+        if item is None:
+            return
+        self._registry_entries = None
+        domain_items = self._by_domain.get(item.domain)
+        if domain_items is not None:
+            domain_items.pop(entity_id, None)
+            if not domain_items:
+                del self._by_domain[item.domain]
+
+    @callback
+    def _async_state_changed(self, event: Event) -> None:
+        entity_id = event.data["entity_id"]
+        if (new_state := event.data.get("new_state")) is None:
+            self._async_remove(entity_id)
+        else:
+            self._async_update(entity_id, new_state)
+
+    @callback
+    def _async_registry_updated(self, event: Event) -> None:
+        if old_entity_id := event.data.get("old_entity_id"):
+            self._async_remove(old_entity_id)
+        entity_id = event.data["entity_id"]
+        if event.data.get("action") == "remove":
+            self._async_remove(entity_id)
+        else:
+            self._async_update(entity_id)
+
+
+@callback
+def async_acquire_entity_index(hass: HomeAssistant) -> ExposedEntityIndex:
+    index = hass.data.get(DATA_ENTITY_INDEX)
+    if index is None:
+        index = hass.data[DATA_ENTITY_INDEX] = ExposedEntityIndex(hass)
+        index.async_start()
+    index._users += 1
+    return index
+
+
+@callback
+def async_release_entity_index(hass: HomeAssistant) -> None:
+    index = hass.data.get(DATA_ENTITY_INDEX)
+    if index is None:
+        return
+    index._users -= 1
+    if index._users <= 0:
+        index.async_stop()
+        hass.data.pop(DATA_ENTITY_INDEX, None)
+
+
+def get_entity_index(hass: HomeAssistant) -> Optional[ExposedEntityIndex]:
+    return hass.data.get(DATA_ENTITY_INDEX)
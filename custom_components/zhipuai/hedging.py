@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import time
+from typing import Any, AsyncGenerator, Callable, Dict, Optional
+
+from .const import (
+    LOGGER,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_MIN_DELAY,
+    HEDGE_BUDGET_RATIO,
+    HEDGE_BUDGET_MIN_PER_SECOND,
+    HEDGE_BUDGET_MAX_TOKENS,
+    TTFT_WINDOW_SIZE,
+)
+from .metrics import RollingHistogram
+from .retry import RetryBudget
+
+StreamFactory = Callable[[Dict[str, Any]], AsyncGenerator[Dict[str, Any], None]]
+
+_EMPTY = object()
+
+
+class TTFTTracker(RollingHistogram):
+    def __init__(self, size: int = TTFT_WINDOW_SIZE) -> None:
+        super().__init__(size)
+
+
+class HedgeStats:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "budget_denied": self.budget_denied,
+            "hedge_rate": round(self.hedged / self.requests, 4) if self.requests else 0.0,
+        }
+
+
+_TRACKERS: Dict[str, TTFTTracker] = {}
+_HEDGE_BUDGET = RetryBudget(HEDGE_BUDGET_RATIO, HEDGE_BUDGET_MIN_PER_SECOND, HEDGE_BUDGET_MAX_TOKENS)
+_STATS = HedgeStats()
+
+
+def get_ttft_tracker(model: str) -> TTFTTracker:
+    if model not in _TRACKERS:
+        _TRACKERS[model] = TTFTTracker()
+    return _TRACKERS[model]
+
+
+def get_hedge_stats() -> Dict[str, Any]:
+    return _STATS.as_dict()
+
+
+def hedge_delay(model: str, percentile: float) -> Optional[float]:
+    tracker = get_ttft_tracker(model)
+    if len(tracker) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(HEDGE_MIN_DELAY, tracker.percentile(percentile))
+
+
+async def _first(stream: AsyncGenerator[Dict[str, Any], None]) -> Any:
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return _EMPTY
+
+
+async def _discard(task: asyncio.Task, stream: AsyncGenerator[Dict[str, Any], None]) -> None:
+    task.cancel()
+    await asyncio.wait([task])
+    with contextlib.suppress(Exception):
+        await stream.aclose()
+
+
+async def async_timed_stream(stream: AsyncGenerator[Dict[str, Any], None], model: str) -> AsyncGenerator[Dict[str, Any], None]:
+    start = time.monotonic()
+    first = True
+    try:
+        async for chunk in stream:
+            if first:
+                get_ttft_tracker(model).record(time.monotonic() - start)
+                first = False
+            yield chunk
+    finally:
+        await stream.aclose()
+
+
+async def async_hedged_stream(
+    factory: StreamFactory,
+    payload: Dict[str, Any],
+    percentile: float,
+    hedge_model: Optional[str] = None,
+) -> AsyncGenerator[Dict[str, Any], None]:
+    model = payload.get("model", "")
+    _STATS.requests += 1
+    _HEDGE_BUDGET.record_request()
+    delay = hedge_delay(model, percentile)
+
+    primary = factory(payload)
+    # Each stream's TTFT counts from its own start, under its own model.
+    started = {primary: (model, time.monotonic())}
+    pending: Dict[asyncio.Task, AsyncGenerator[Dict[str, Any], None]] = {
+        asyncio.ensure_future(_first(primary)): primary
+    }
+    winner: Optional[AsyncGenerator[Dict[str, Any], None]] = None
+    first_chunk: Any = _EMPTY
+    error: Optional[BaseException] = None
+
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                if _HEDGE_BUDGET.try_acquire():
+                    hedge_payload = dict(payload)
+                    hedge_payload["model"] = hedge_model or model
+                    if "request_id" in payload:
+                        hedge_payload["request_id"] = f"{payload['request_id']}_hedge"
+                    LOGGER.debug("首字延迟超过 %.2f 秒，发送对冲请求: %s", delay, hedge_payload["model"])
+                    _STATS.hedged += 1
+                    hedge = factory(hedge_payload)
+                    started[hedge] = (hedge_payload["model"], time.monotonic())
+                    pending[asyncio.ensure_future(_first(hedge))] = hedge
+                else:
+                    _STATS.budget_denied += 1
+
+        while pending and winner is None:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                stream = pending.pop(task)
+                if task.exception() is not None:
+                    error = task.exception()
+                    with contextlib.suppress(Exception):
+                        await stream.aclose()
+                    continue
+                if winner is None:
+                    winner = stream
+                    first_chunk = task.result()
+                    if stream is not primary:
+                        _STATS.hedge_wins += 1
+                else:
+                    with contextlib.suppress(Exception):
+                        await stream.aclose()
+
+        for task, stream in list(pending.items()):
+            await _discard(task, stream)
+        pending.clear()
+
+        if winner is None:
+            raise error
+
+        if first_chunk is _EMPTY:
+            return
+        winner_model, winner_start = started[winner]
+        get_ttft_tracker(winner_model).record(time.monotonic() - winner_start)
+        yield first_chunk
+        async for chunk in winner:
+            yield chunk
+    finally:
+        for task, stream in pending.items():
+            await _discard(task, stream)
+        if winner is not None:
+            await winner.aclose()
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import sys
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Iterable, List, Mapping, Optional
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.storage import Store
+
+from .const import (
+    CONF_MAX_HISTORY_MESSAGES,
+    CONF_PERSIST_HISTORY,
+    DEFAULT_PERSIST_HISTORY,
+    DOMAIN,
+    HISTORY_MAX_CHARS,
+    HISTORY_MAX_CONVERSATIONS,
+    HISTORY_SAVE_DELAY,
+    HISTORY_STORAGE_VERSION,
+    HISTORY_TTL,
+    LOGGER,
+    RECOMMENDED_MAX_HISTORY_MESSAGES,
+)
+
+
+def _history_store(hass: HomeAssistant, entry_id: str) -> Store:
+    return Store(hass, HISTORY_STORAGE_VERSION, f"{DOMAIN}.history.{entry_id}")
+
+
+async def async_remove_history(hass: HomeAssistant, entry_id: str) -> None:
+    """Delete the stored history of a removed config entry."""
+    await _history_store(hass, entry_id).async_remove()
+
+
+def _max_messages(options: Mapping[str, Any]) -> int:
+    return max(1, int(options.get(CONF_MAX_HISTORY_MESSAGES, RECOMMENDED_MAX_HISTORY_MESSAGES)))
+
+
+class HistoryMessage:
+    __slots__ = ("role", "content", "timestamp")
+
+    def __init__(self, role: str, content: str, timestamp: float) -> None:
+        self.role = sys.intern(role)
+        self.content = content
+        self.timestamp = timestamp
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"role": self.role, "content": self.content, "timestamp": self.timestamp}
+
+
+class ConversationHistory:
+    __slots__ = ("messages", "accessed", "size")
+
+    def __init__(self, max_messages: int, accessed: float, messages: Iterable[HistoryMessage] = ()) -> None:
+        self.messages: Deque[HistoryMessage] = deque(maxlen=max_messages)
+        self.accessed = accessed
+        self.size = 0
+        for message in messages:
+            self.append(message)
+
+    def append(self, message: HistoryMessage) -> int:
+        """Append and return the change in stored characters."""
+        removed = len(self.messages[0].content) if len(self.messages) == self.messages.maxlen else 0
+        self.messages.append(message)
+        delta = len(message.content) - removed
+        self.size += delta
+        return delta
+
+
+class ConversationHistoryStore:
+    """Per-conversation message history with LRU, TTL and size bounds.
+
+    Conversations untouched for ``ttl`` seconds expire, the least recently
+    used ones are evicted past ``max_conversations`` or ``max_chars`` stored
+    characters, and each keeps at most ``max_messages`` messages. With
+    persistence on, the store is written through HA ``Store`` with a delay so
+    a busy conversation costs one write per burst.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry_id: str,
+        options: Mapping[str, Any],
+        ttl: float = HISTORY_TTL,
+        max_conversations: int = HISTORY_MAX_CONVERSATIONS,
+        max_chars: int = HISTORY_MAX_CHARS,
+    ) -> None:
+        self.hass = hass
+        self.entry_id = entry_id
+        self.ttl = ttl
+        self.max_conversations = max_conversations
+        self.max_chars = max_chars
+        self.max_messages = _max_messages(options)
+        self._conversations: OrderedDict[str, ConversationHistory] = OrderedDict()
+        self._size = 0
+        self._store: Optional[Store] = self._create_store(options)
+
+    def _create_store(self, options: Mapping[str, Any]) -> Optional[Store]:
+        if not options.get(CONF_PERSIST_HISTORY, DEFAULT_PERSIST_HISTORY):
+            return None
+        return _history_store(self.hass, self.entry_id)
+
+    async def async_update_options(self, options: Mapping[str, Any]) -> None:
+        max_messages = _max_messages(options)
+        if max_messages != self.max_messages:
+            self.max_messages = max_messages
+            self._size = 0
+            for conversation_id, history in self._conversations.items():
+                history = self._conversations[conversation_id] = ConversationHistory(max_messages, history.accessed, history.messages)
+                self._size += history.size
+        persist = bool(options.get(CONF_PERSIST_HISTORY, DEFAULT_PERSIST_HISTORY))
+        if persist != (self._store is not None):
+            if self._store is not None:
+                await self._store.async_remove()
+            self._store = self._create_store(options)
+        self._schedule_save()
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self._conversations
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, conversation_id: Optional[str], roles: Optional[Iterable[str]] = None) -> List[HistoryMessage]:
+        if not conversation_id:
+            return []
+        self.prune()
+        history = self._conversations.get(conversation_id)
+        if history is None:
+            return []
+        history.accessed = time.time()
+        self._conversations.move_to_end(conversation_id)
+        if roles is None:
+            return list(history.messages)
+        roles = set(roles)
+        return [message for message in history.messages if message.role in roles]
+
+    def append(self, conversation_id: Optional[str], role: str, content: str, timestamp: Optional[float] = None) -> None:
+        if not conversation_id or not content:
+            return
+        now = time.time()
+        history = self._conversations.get(conversation_id)
+        if history is None:
+            history = self._conversations[conversation_id] = ConversationHistory(self.max_messages, now)
+        else:
+            self._conversations.move_to_end(conversation_id)
+        history.accessed = now
+        self._size += history.append(HistoryMessage(role, content, timestamp or now))
+        self.prune(now)
+        self._schedule_save()
+
+    def reset(self, conversation_id: Optional[str]) -> None:
+        if conversation_id and (history := self._conversations.pop(conversation_id, None)) is not None:
+            self._size -= history.size
+            self._schedule_save()
+
+    def clear(self) -> None:
+        self._conversations.clear()
+        self._size = 0
+        self._schedule_save()
+
+    def prune(self, now: Optional[float] = None) -> int:
+        now = now or time.time()
+        evicted = 0
+        while self._conversations:
+            conversation_id, history = next(iter(self._conversations.items()))
+            if (
+                now - history.accessed <= self.ttl
+                and len(self._conversations) <= self.max_conversations
+                and (self._size <= self.max_chars or len(self._conversations) == 1)
+            ):
+                break
+            del self._conversations[conversation_id]
+            self._size -= history.size
+            evicted += 1
+        if evicted:
+            LOGGER.debug("已清理 %d 个过期对话历史，剩余 %d 个", evicted, len(self._conversations))
+        return evicted
+
+    async def async_load(self) -> None:
+        if self._store is None:
+            return
+        try:
+            data = await self._store.async_load()
+        except Exception as err:
+            LOGGER.warning("读取对话历史失败: %s", err)
+            return
+        if not data:
+            return
+        for conversation_id, item in data.get("conversations", {}).items():
+            messages = (HistoryMessage(role, content, timestamp) for role, content, timestamp in item.get("messages", ()))
+            history = self._conversations[conversation_id] = ConversationHistory(self.max_messages, float(item.get("accessed", 0)), messages)
+            self._size += history.size
+        self.prune()
+        LOGGER.debug("已恢复 %d 个对话历史", len(self._conversations))
+
+    @callback
+    def _schedule_save(self) -> None:
+        if self._store is not None:
+            self._store.async_delay_save(self._data_to_save, HISTORY_SAVE_DELAY)
+
+    @callback
+    def _data_to_save(self) -> Dict[str, Any]:
+        self.prune()
+        return {
+            "conversations": {
+                conversation_id: {
+                    "accessed": history.accessed,
+                    "messages": [[message.role, message.content, message.timestamp] for message in history.messages],
+                }
+                for conversation_id, history in self._conversations.items()
+            }
+        }
+
+    async def async_flush(self) -> None:
+        if self._store is not None:
+            await self._store.async_save(self._data_to_save())
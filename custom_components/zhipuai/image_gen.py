@@ -13,6 +13,10 @@ from .const import (
     IMAGE_SIZES,
     DEFAULT_IMAGE_SIZE,
 )
+from .connection_pool import async_get_session
+from .ai_request import resolve_api_url
+from .metrics import RequestTimer
+from .retry import ENDPOINT_IMAGES, CircuitOpenError, async_call_with_retry
 
 IMAGE_GEN_SCHEMA = vol.Schema({
     vol.Required("prompt"): str,
@@ -46,15 +50,24 @@ async def async_setup_image_gen(hass: HomeAssistant) -> None:
             }
 
             try:
-                async with aiohttp.ClientSession() as session:
+                session = await async_get_session(config_entries[0].entry_id)
+                timer = RequestTimer(ENDPOINT_IMAGES, model)
+
+                async def _send() -> dict:
+                    timer.begin_attempt()
                     async with session.post(
-                        ZHIPUAI_IMAGE_GEN_URL,
+                        resolve_api_url(config_entries[0].options, ZHIPUAI_IMAGE_GEN_URL),
                         headers=headers,
                         json=payload,
-                        timeout=300
+                        timeout=aiohttp.ClientTimeout(total=300),
+                        trace_request_ctx=timer
                     ) as response:
                         response.raise_for_status()
-                        result = await response.json()
+                        timer.mark_first_byte()
+                        return await response.json()
+
+                result = await async_call_with_retry(ENDPOINT_IMAGES, _send)
+                timer.finish()
 
                 if not result.get("data") or not result["data"][0].get("url"):
                     raise ValueError("API 未返回有效的图片 URL")
@@ -69,14 +82,13 @@ async def async_setup_image_gen(hass: HomeAssistant) -> None:
                 filename = os.path.basename(image_url.split('?')[0]) or 'zhipuai_sc.png'
                 local_path = os.path.join(img_dir, filename)
                 
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(image_url) as response:
-                        if response.status == 200:
-                            content = await response.content.read()
-                            with open(local_path, "wb") as f:
-                                f.write(content)
-                            
-                            local_url = f"/local/zhipuai_img/{filename}"
+                async with session.get(image_url) as response:
+                    if response.status == 200:
+                        content = await response.content.read()
+                        with open(local_path, "wb") as f:
+                            f.write(content)
+                        
+                        local_url = f"/local/zhipuai_img/{filename}"
                 
                 hass.bus.async_fire(f"{DOMAIN}_response", {
                     "type": "image_gen",
@@ -90,7 +102,7 @@ async def async_setup_image_gen(hass: HomeAssistant) -> None:
                     "original_url": image_url
                 }
 
-            except aiohttp.ClientError as e:
+            except (aiohttp.ClientError, CircuitOpenError) as e:
                 LOGGER.error(f"API请求失败: {str(e)}")
                 raise ServiceValidationError(f"API请求失败: {str(e)}")
 
@@ -24,6 +24,7 @@ from homeassistant.const import ATTR_DEVICE_CLASS, ATTR_ENTITY_ID
 from homeassistant.core import Context, HomeAssistant, ServiceResponse, State
 from homeassistant.helpers import area_registry, device_registry, entity_registry, intent
 from .const import DOMAIN, LOGGER
+from .entity_index import get_entity_index
 import json
 import random
 import urllib.parse
@@ -1124,7 +1125,7 @@ class MassPlayMediaAssist(intent.IntentHandler):
             return await self._build_playlist_request(playlist_id, name, area, shuffle)
         
         try:
-            result = await async_search_song(clean_query)
+            result = await async_search_song(self.hass, clean_query)
             LOGGER.info("网易云音乐搜索结果: %s", result)
             
             if not result.get("success", False):
@@ -1143,7 +1144,7 @@ class MassPlayMediaAssist(intent.IntentHandler):
                 
                 if artist and song_name:
                     search_query = f"{artist} {song_name}"
-                    result = await async_search_song(search_query)
+                    result = await async_search_song(self.hass, search_query)
                     LOGGER.info("网易云音乐搜索结果(歌手+歌名): %s", result)
             
             if result.get("success") and "url" in result:
@@ -1185,7 +1186,7 @@ class MassPlayMediaAssist(intent.IntentHandler):
     async def _build_playlist_request(self, playlist_id: str, name: str = None, area: str = None, shuffle: bool = False) -> dict:
 
         try:
-            playlist_result = await async_get_playlist_songs(playlist_id)
+            playlist_result = await async_get_playlist_songs(self.hass, playlist_id)
             
             if not playlist_result.get("success", False):
                 return {"error": playlist_result.get("message", "获取播放列表失败")}
@@ -1198,7 +1199,7 @@ class MassPlayMediaAssist(intent.IntentHandler):
                 random.shuffle(songs)
                 
             first_song = songs[0]
-            song_result = await async_search_song(f"{first_song['name']} {first_song['artist']}")
+            song_result = await async_search_song(self.hass, f"{first_song['name']} {first_song['artist']}")
             
             if not song_result.get("success", False):
                 return {"error": "无法播放播放列表中的歌曲"}
@@ -1289,7 +1290,7 @@ class MassPlayMediaAssist(intent.IntentHandler):
         self.hass._playlist_info['current_index'] = next_index
         
         next_song = songs[next_index]
-        song_result = await async_search_song(f"{next_song['name']} {next_song['artist']}")
+        song_result = await async_search_song(self.hass, f"{next_song['name']} {next_song['artist']}")
         
         if not song_result.get("success", False):
             return await self._play_next_song()
@@ -1455,8 +1456,10 @@ def extract_intent_info(user_input: str, hass: HomeAssistant) -> Optional[Dict[s
             }
         return None
     
-    all_domains = set(domain for entity_id in hass.states.async_entity_ids() for domain in [entity_id.split(".")[0]])
-    if domain not in all_domains:
+    if (entity_index := get_entity_index(hass)) is not None:
+        if not entity_index.has_domain(domain):
+            return None
+    elif not hass.states.async_entity_ids(domain):
         return None
     
     intent_mappings = {
@@ -1,44 +1,170 @@
 import re
+from functools import lru_cache
+
+from .const import MARKDOWN_STREAM_MAX_PENDING
+
+# Rules run per line, in this order, each only when one of its trigger
+# characters is on the line; later rules see what earlier ones left, as the
+# old whole-text passes did. Lines without any marker skip them all.
+_MARKERS = frozenset("#-*+>|`_~[<")
+_HEADING = re.compile(r'^#{1,6}\s+.*$')
+_LINE_RULES = [(frozenset(triggers), pattern) for triggers, pattern in (
+    ("#", _HEADING),
+    ("-*+", re.compile(r'^\s*[-*+]\s+')),
+    (">", re.compile(r'^\s*>\s+')),
+    ("`", re.compile(r'```[a-zA-Z0-9_-]*')),
+    ("`", re.compile(r'```\s*$')),
+    ("*", re.compile(r'\*\*[^*]*\*\*')),
+    ("*", re.compile(r'\*[^*]*\*')),
+    ("_", re.compile(r'__[^_]*__')),
+    ("_", re.compile(r'_[^_]*_')),
+    ("|", re.compile(r'^\|.*\|$')),
+    ("|", re.compile(r'^\|[\s-]*\|[\s-]*\|$')),
+    ("~", re.compile(r'~~[^~]*~~')),
+    ("`", re.compile(r'`[^`]*`')),
+    ("-_*", re.compile(r'^-{3,}$|^_{3,}$|^\*{3,}$')),
+    ("[", re.compile(r'\[\^[^\]]*\]')),
+    ("[", re.compile(r'^\[\^[^\]]*\]:.*$')),
+    ("<", re.compile(r'<[^>]*>')),
+    ("`", re.compile(r'^`[a-zA-Z0-9_-]*$')),
+)]
+# What may run on the rest of a line after its start was emitted.
+_INLINE_RULES = [rule for rule in _LINE_RULES if not rule[1].pattern.startswith("^")]
+_LIST_PREFIX = re.compile(r'^\s*(?:[-*+]|>)\s+')
+_INLINE_MARKER = re.compile(r'[*_~`<\[]')
+
+# One scan over the text stops only at lines holding a marker; matching from
+# the newline lets the scan skip ahead instead of trying every position. A
+# list item or quote takes the blank and heading lines right above it along,
+# since the leading ``\s*`` of its rule used to eat them.
+_MARKED = re.compile(
+    r'\n(?:(?:[^\S\n]*\n|#{1,6}[^\S\n]+[^\n]*\n)*(?=[^\S\n]*(?:[-*+]|>)[^\S\n])([^\n]*)'
+    r'|[^\n#\-*+>|`_~\[<]*[#\-*+>|`_~\[<][^\n]*)'
+)
+_BLANK_LINES = re.compile(r'\n(?:[^\S\n]*\n)+')
+
+
+@lru_cache(maxsize=None)
+def _dispatch(inline: bool, found: frozenset) -> tuple:
+    """The rules a line holding the markers ``found`` has to go through."""
+    rules = _INLINE_RULES if inline else _LINE_RULES
+    return tuple(pattern for triggers, pattern in rules if not found.isdisjoint(triggers))
+
+
+def _apply(inline: bool, text: str) -> str:
+    found = _MARKERS.intersection(text)
+    if not found:
+        return text
+    for pattern in _dispatch(inline, found):
+        text = pattern.sub('', text)
+    return text
+
+
+def _filter_line(line: str) -> str:
+    return _apply(False, line)
+
+
+def _filter_inline(text: str) -> str:
+    return _apply(True, text)
+
+
+def _filter_marked(match: re.Match) -> str:
+    line = match.group(1)
+    return "\n" + _filter_line(match.group()[1:] if line is None else line)
 
-_MARKDOWN_FILTER_PATTERNS = [
-    re.compile(r'^#{1,6}\s+.*$', re.MULTILINE),
-    re.compile(r'^\s*[-*+]\s+', re.MULTILINE),
-    re.compile(r'^\s*>\s+', re.MULTILINE),
-    re.compile(r'```[a-zA-Z0-9_-]*', re.MULTILINE),
-    re.compile(r'```\s*$', re.MULTILINE),
-    re.compile(r'\n{3,}'),
-    re.compile(r'\*\*[^*\n]*\*\*'),
-    re.compile(r'\*[^*\n]*\*'),
-    re.compile(r'__[^_\n]*__'),
-    re.compile(r'_[^_\n]*_'),
-    re.compile(r'^\|[^\n]*\|$', re.MULTILINE),
-    re.compile(r'^\|[\s-]*\|[\s-]*\|$', re.MULTILINE),
-    re.compile(r'~~[^~\n]*~~'),
-    re.compile(r'`[^`\n]*`'),
-    re.compile(r'^-{3,}$|^_{3,}$|^\*{3,}$', re.MULTILINE),
-    re.compile(r'\[\^[^\]]*\]'),
-    re.compile(r'^\[\^[^\]]*\]:.*$', re.MULTILINE),
-    re.compile(r'<[^>]*>'),
-    re.compile(r'^\s*$\n^\s*$', re.MULTILINE),
-    re.compile(r'^`[a-zA-Z0-9_-]*$', re.MULTILINE)
-]
-
-_BASE_FILTER_PATTERNS = [re.compile(r'')]
 
 def filter_markdown_content(content: str, filter_enabled: bool = False) -> str:
     if not content:
         return ""
-    
-    for pattern in _BASE_FILTER_PATTERNS:
-        content = pattern.sub('', content)
-    
-    if filter_enabled:
-        for pattern in _MARKDOWN_FILTER_PATTERNS:
-            if pattern.pattern == r'\n{3,}':
-                continue  
-            content = pattern.sub('', content)
-        
-        content = re.sub(r'\n{3,}', '\n\n', content)  
-        content = re.sub(r'^\s+$', '', content, flags=re.MULTILINE)  
-    
-    return content.strip() 
\ No newline at end of file
+    if not filter_enabled:
+        return content.strip()
+    content = _MARKED.sub(_filter_marked, "\n" + content)
+    # Runs of blank lines, left or made by the rules, collapse to one.
+    return _BLANK_LINES.sub('\n\n', content).strip()
+
+
+class MarkdownStreamFilter:
+    """Incremental ``filter_markdown_content(..., True)`` for streamed deltas.
+
+    Works a line at a time. A line opening with plain text is passed through
+    as it arrives up to its first inline marker; from there, and for a line
+    opening with a markdown marker, text is held until the newline, or until
+    ``max_pending`` characters. Runs of blank lines collapse to one and the
+    answer's outer whitespace is dropped, as in the full-text filter.
+    """
+
+    def __init__(self, max_pending: int = MARKDOWN_STREAM_MAX_PENDING) -> None:
+        self._max_pending = max_pending
+        self._line = ""
+        self._mode = None
+        self._started = False
+        self._space = ""
+        self._breaks = 0
+        self._blank_run = 0
+
+    def feed(self, delta: str) -> str:
+        self._line += delta
+        out = []
+        while (index := self._line.find("\n")) != -1:
+            rest = self._line[index + 1:]
+            self._line = self._line[:index]
+            out.append(self._end_line())
+            if self._started:
+                self._breaks += 1
+            self._line = rest
+        out.append(self._emit_partial())
+        return "".join(out)
+
+    def flush(self) -> str:
+        text = self._end_line()
+        self._space = ""
+        return text
+
+    def _write(self, text: str) -> str:
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._started = True
+        body = text.rstrip()
+        if not body:
+            self._space += text
+            return ""
+        out = self._space + "\n" * min(self._breaks, 2) + body
+        self._space = text[len(body):]
+        self._breaks = 0
+        return out
+
+    def _emit_partial(self) -> str:
+        if self._mode is None:
+            head = self._line.lstrip()
+            if not head:
+                return ""
+            self._mode = "hold" if head[0] in _MARKERS else "plain"
+        if self._mode != "plain":
+            if len(self._line) <= self._max_pending:
+                return ""
+            text = _filter_line(self._line) if self._mode == "hold" else _filter_inline(self._line)
+            self._line, self._mode = "", "plain"
+            return self._write(text)
+        match = _INLINE_MARKER.search(self._line)
+        safe = self._line[:match.start()] if match else self._line
+        self._line = self._line[len(safe):]
+        if match:
+            self._mode = "inline"
+        return self._write(safe) if safe else ""
+
+    def _end_line(self) -> str:
+        line, mode = self._line, self._mode
+        self._line, self._mode = "", None
+        blank_run, self._blank_run = self._blank_run, 0
+        if mode in ("plain", "inline"):
+            return self._write(_filter_inline(line))
+        if not line.strip() or _HEADING.match(line):
+            self._blank_run = blank_run + 1
+        text = _filter_line(line)
+        if not text.strip():
+            return ""
+        if _LIST_PREFIX.match(line):
+            self._breaks -= blank_run
+        return self._write(text)
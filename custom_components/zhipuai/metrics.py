@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import math
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Mapping, Optional, Tuple
+
+from .const import LOGGER, METRICS_WINDOW_SIZE
+
+METRIC_CONNECT = "connect"
+METRIC_TTFB = "ttfb"
+METRIC_TTFT = "ttft"
+METRIC_INTER_TOKEN = "inter_token"
+METRIC_TOTAL = "total"
+
+METRICS = (METRIC_CONNECT, METRIC_TTFB, METRIC_TTFT, METRIC_INTER_TOKEN, METRIC_TOTAL)
+PERCENTILES = (50, 95, 99)
+
+SeriesKey = Tuple[str, str]
+
+
+def _nearest_rank(ordered: List[float], pct: float) -> float:
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+
+class RollingHistogram:
+    def __init__(self, size: int = METRICS_WINDOW_SIZE) -> None:
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        return _nearest_rank(sorted(self._samples), pct)
+
+    def as_dict(self) -> Dict[str, Any]:
+        if not self._samples:
+            return {"count": 0, **{f"p{pct}": None for pct in PERCENTILES}}
+        ordered = sorted(self._samples)
+        return {"count": len(ordered), **{f"p{pct}": round(_nearest_rank(ordered, pct) * 1000, 1) for pct in PERCENTILES}}
+
+
+class TokenUsage:
+    """Prompt and cached prompt tokens over the last ``size`` responses."""
+
+    def __init__(self, size: int = METRICS_WINDOW_SIZE) -> None:
+        self._samples: Deque[Tuple[int, int]] = deque(maxlen=size)
+
+    def record(self, prompt_tokens: int, cached_tokens: int) -> None:
+        self._samples.append((prompt_tokens, min(cached_tokens, prompt_tokens)))
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(prompt for prompt, _ in self._samples)
+
+    @property
+    def cached_tokens(self) -> int:
+        return sum(cached for _, cached in self._samples)
+
+    @property
+    def cache_hit_ratio(self) -> Optional[float]:
+        prompt_tokens = self.prompt_tokens
+        return self.cached_tokens / prompt_tokens if prompt_tokens else None
+
+    def as_dict(self) -> Dict[str, Any]:
+        ratio = self.cache_hit_ratio
+        return {
+            "responses": len(self._samples),
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cache_hit_ratio": round(ratio, 4) if ratio is not None else None,
+        }
+
+
+def parse_usage(usage: Any) -> Optional[Tuple[int, int]]:
+    """Prompt and cached token counts from an OpenAI style ``usage`` block."""
+    if not isinstance(usage, Mapping):
+        return None
+    try:
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        details = usage.get("prompt_tokens_details") or {}
+        cached_tokens = int(details.get("cached_tokens") or 0) if isinstance(details, Mapping) else 0
+    except (TypeError, ValueError):
+        return None
+    return (prompt_tokens, cached_tokens) if prompt_tokens > 0 else None
+
+
+class LatencyMetrics:
+    def __init__(self, size: int = METRICS_WINDOW_SIZE) -> None:
+        self._size = size
+        self._series: Dict[SeriesKey, Dict[str, RollingHistogram]] = {}
+        self._usage: Dict[SeriesKey, TokenUsage] = {}
+        self._listeners: List[Callable[[SeriesKey], None]] = []
+
+    def _series_for(self, endpoint: str, model: str) -> Dict[str, RollingHistogram]:
+        key = (endpoint, model or "unknown")
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = {name: RollingHistogram(self._size) for name in METRICS}
+            self._usage[key] = TokenUsage(self._size)
+            for listener in list(self._listeners):
+                try:
+                    listener(key)
+                except Exception as err:
+                    LOGGER.debug("延迟指标监听器出错: %s", err)
+        return series
+
+    def record(self, endpoint: str, model: str, metric: str, seconds: float) -> None:
+        self._series_for(endpoint, model)[metric].record(max(0.0, seconds))
+
+    def record_usage(self, endpoint: str, model: str, usage: Any) -> None:
+        if (parsed := parse_usage(usage)) is None:
+            return
+        self._series_for(endpoint, model)
+        self._usage[(endpoint, model or "unknown")].record(*parsed)
+        LOGGER.debug("上游上下文缓存命中: %d/%d tokens (%s)", parsed[1], parsed[0], model)
+
+    def get(self, endpoint: str, model: str, metric: str) -> Optional[RollingHistogram]:
+        series = self._series.get((endpoint, model))
+        return series.get(metric) if series else None
+
+    def get_usage(self, endpoint: str, model: str) -> Optional[TokenUsage]:
+        return self._usage.get((endpoint, model))
+
+    def series(self) -> List[SeriesKey]:
+        return list(self._series)
+
+    def add_listener(self, listener: Callable[[SeriesKey], None]) -> Callable[[], None]:
+        self._listeners.append(listener)
+
+        def _remove() -> None:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+        return _remove
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            f"{endpoint}/{model}": {
+                **{metric: histogram.as_dict() for metric, histogram in series.items()},
+                "usage": self._usage[(endpoint, model)].as_dict(),
+            }
+            for (endpoint, model), series in self._series.items()
+        }
+
+
+_METRICS = LatencyMetrics()
+
+
+def get_latency_metrics() -> LatencyMetrics:
+    return _METRICS
+
+
+class RequestTimer:
+    """Latency marks for one logical upstream call.
+
+    Time to first byte is measured from the start of the attempt that
+    succeeded, everything else from the start of the call so retries and
+    backoff show up where the user feels them.  Passed to aiohttp as
+    ``trace_request_ctx`` so the pool can report connect time.
+    """
+
+    __slots__ = ("endpoint", "model", "start", "_attempt", "_first_byte", "_last_token", "_done")
+
+    def __init__(self, endpoint: str, model: Optional[str] = None) -> None:
+        self.endpoint = endpoint
+        self.model = model or "unknown"
+        self.start = time.monotonic()
+        self._attempt = self.start
+        self._first_byte = False
+        self._last_token: Optional[float] = None
+        self._done = False
+
+    def _record(self, metric: str, seconds: float) -> None:
+        _METRICS.record(self.endpoint, self.model, metric, seconds)
+
+    def begin_attempt(self) -> None:
+        self._attempt = time.monotonic()
+
+    def record_connect(self, seconds: float) -> None:
+        self._record(METRIC_CONNECT, seconds)
+
+    def mark_first_byte(self) -> None:
+        if not self._first_byte:
+            self._first_byte = True
+            self._record(METRIC_TTFB, time.monotonic() - self._attempt)
+
+    def mark_token(self) -> None:
+        now = time.monotonic()
+        if self._last_token is None:
+            self._record(METRIC_TTFT, now - self.start)
+        else:
+            self._record(METRIC_INTER_TOKEN, now - self._last_token)
+        self._last_token = now
+
+    def record_usage(self, usage: Any) -> None:
+        _METRICS.record_usage(self.endpoint, self.model, usage)
+
+    def finish(self) -> None:
+        if not self._done:
+            self._done = True
+            self._record(METRIC_TOTAL, time.monotonic() - self.start)
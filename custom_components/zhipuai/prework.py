@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Awaitable, Dict, Mapping
+
+_MISSING = object()
+
+
+class StageResults:
+    """Results, errors and wall time of concurrently run pre-LLM stages."""
+
+    def __init__(self, values: Dict[str, Any], errors: Dict[str, BaseException], timings: Dict[str, float], total: float) -> None:
+        self._values = values
+        self._errors = errors
+        self.timings = timings
+        self.total = total
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._values or name in self._errors
+
+    def result(self, name: str) -> Any:
+        """Value of a stage, re-raising what the stage raised."""
+        if name in self._errors:
+            raise self._errors[name]
+        return self._values[name]
+
+    def get(self, name: str, default: Any = None) -> Any:
+        value = self._values.get(name, _MISSING)
+        return default if value is _MISSING else value
+
+    def timings_ms(self) -> Dict[str, float]:
+        timings = {name: round(seconds * 1000, 1) for name, seconds in self.timings.items()}
+        timings["total"] = round(self.total * 1000, 1)
+        return timings
+
+
+async def async_run_stages(stages: Mapping[str, Awaitable[Any]]) -> StageResults:
+    """Run independent stages together; the wait is the slowest, not the sum.
+
+    A failing stage does not cancel the others; its exception is kept and
+    raised again by :meth:`StageResults.result`.
+    """
+    timings: Dict[str, float] = {}
+
+    async def _timed(name: str, awaitable: Awaitable[Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            timings[name] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*(_timed(name, awaitable) for name, awaitable in stages.items()), return_exceptions=True)
+    values: Dict[str, Any] = {}
+    errors: Dict[str, BaseException] = {}
+    for name, outcome in zip(stages, outcomes):
+        if isinstance(outcome, asyncio.CancelledError):
+            raise outcome
+        if isinstance(outcome, BaseException):
+            errors[name] = outcome
+        else:
+            values[name] = outcome
+    return StageResults(values, errors, timings, time.perf_counter() - start)
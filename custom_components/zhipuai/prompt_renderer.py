@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers import template
+
+_TEMPLATE_MARKERS = ("{{", "{%", "{#")
+_WHOLE_TEMPLATE = re.compile(
+    r"\{%-?\s*(?:set|macro|import|from|include|extends|raw|call)\b|\{%-|-%\}|\{\{-|-\}\}|\{#-|-#\}"
+)
+_BLOCK_OPEN = re.compile(r"\{%-?\s*(?:if|for|filter|with|block|autoescape|trans)\b")
+_BLOCK_CLOSE = re.compile(r"\{%-?\s*end\w+")
+
+Region = Union[List[str], template.Template]
+
+
+def normalize_lines(text: str) -> List[str]:
+    return [line.strip() if line.startswith(" ") else line for line in text.split("\n") if line.strip()]
+
+
+def join_sections(stable: Iterable[str], per_turn: Iterable[str]) -> str:
+    """Join prompt sections with everything stable for a config version first.
+
+    Upstream context caching only matches a byte-identical prefix, so the
+    sections that change every turn (time, history, keyword prompts) go last.
+    """
+    sections = [section.strip("\n") for section in (*stable, *per_turn) if section and section.strip()]
+    return "\n".join(sections)
+
+
+def split_regions(source: str) -> List[Tuple[bool, str]]:
+    """Split a prompt template into literal and templated runs of whole lines.
+
+    A templated run stays open until every ``{{``/``{%``/``{#`` and every
+    block tag opened in it is closed, so ``{% if %}`` spanning several lines
+    is rendered as one piece.
+    """
+    regions: List[Tuple[bool, str]] = []
+    literal: List[str] = []
+    dynamic: List[str] = []
+    depth = 0
+    for line in source.split("\n"):
+        if not dynamic and not any(marker in line for marker in _TEMPLATE_MARKERS):
+            literal.append(line)
+            continue
+        if literal:
+            regions.append((False, "\n".join(literal)))
+            literal = []
+        dynamic.append(line)
+        depth += len(_BLOCK_OPEN.findall(line)) - len(_BLOCK_CLOSE.findall(line))
+        depth += sum(line.count(open_) - line.count(close) for open_, close in (("{{", "}}"), ("{%", "%}"), ("{#", "#}")))
+        if depth <= 0:
+            regions.append((True, "\n".join(dynamic)))
+            dynamic = []
+            depth = 0
+    if dynamic:
+        regions.append((True, "\n".join(dynamic)))
+    if literal:
+        regions.append((False, "\n".join(literal)))
+    return regions
+
+
+class SystemPromptRenderer:
+    """Renders prompt templates from regions compiled once per source.
+
+    Literal lines are normalised once and reused; only the templated regions
+    (time, user name, exposed entities, ...) are rendered per request.
+    Templates that share state between lines (``set``, macros, whitespace
+    control) are kept whole and only compiled once.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self.hass = hass
+        self._compiled: Dict[str, List[Region]] = {}
+
+    def _compile(self, source: str) -> List[Region]:
+        specs = [(True, source)] if _WHOLE_TEMPLATE.search(source) else split_regions(source)
+        regions: List[Region] = []
+        for dynamic, text in specs:
+            if not dynamic:
+                regions.append(normalize_lines(text))
+                continue
+            compiled = template.Template(text, self.hass)
+            compiled.ensure_valid()
+            regions.append(compiled)
+        return regions
+
+    def async_render(self, source: str, variables: Dict[str, Any]) -> List[str]:
+        regions = self._compiled.get(source)
+        if regions is None:
+            regions = self._compiled[source] = self._compile(source)
+        lines: List[str] = []
+        for region in regions:
+            if isinstance(region, list):
+                lines.extend(region)
+            else:
+                lines.extend(normalize_lines(region.async_render(variables, parse_result=False)))
+        return lines
+
+    def invalidate(self) -> None:
+        self._compiled.clear()
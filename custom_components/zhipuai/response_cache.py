@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from homeassistant.const import EVENT_STATE_CHANGED
+from homeassistant.core import Event, HomeAssistant, callback
+
+from .const import LOGGER, RESPONSE_CACHE_READ_ONLY_TOOLS, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
+from .entity_index import get_entity_index
+
+_NOISE = re.compile(r"[\s\u3000-\u303f\uff61-\uff65!-/:-@\[-`{-~]+")
+_ENTITY_ID = re.compile(r"\b[a-z_]+\.[a-z0-9_]+\b")
+
+CacheKey = Tuple[str, str, Hashable]
+
+
+def normalize_utterance(text: str) -> str:
+    """NFKC-folded and lowercased, with whitespace and punctuation removed."""
+    return _NOISE.sub("", unicodedata.normalize("NFKC", text or "")).lower()
+
+
+def tool_dependencies(hass: HomeAssistant, results: Iterable[Dict[str, Any]], question: str, answer: str) -> Optional[Set[str]]:
+    """Entities a tool-backed answer depends on, or ``None`` if it must not be cached.
+
+    Only turns whose tools all succeeded and only read state qualify. Entity
+    ids in the tool output count directly. Every entity named in a
+    ``GetLiveContext`` output counts, since a question such as "哪些灯开着"
+    depends on entities the answer never names; for other tools an entity
+    named in the output counts when the question or the answer names it too.
+    """
+    results = list(results)
+    if not results or any(not result.get("success") or result.get("tool_name") not in RESPONSE_CACHE_READ_ONLY_TOOLS for result in results):
+        return None
+    output = "\n".join(str(result.get("content", "")) for result in results)
+    dependencies = {entity_id for entity_id in _ENTITY_ID.findall(output) if hass.states.get(entity_id) is not None}
+    if (index := get_entity_index(hass)) is not None:
+        named = set(index.mentioned(f"{question}\n{answer}"))
+        for result in results:
+            mentioned = index.mentioned(str(result.get("content", "")))
+            if result.get("tool_name") == "GetLiveContext":
+                dependencies.update(mentioned)
+            else:
+                dependencies.update(entity_id for entity_id in mentioned if entity_id in named)
+    return dependencies or None
+
+
+class CachedResponse:
+    __slots__ = ("text", "versions", "expires")
+
+    def __init__(self, text: str, versions: Dict[str, Any], expires: float) -> None:
+        self.text = text
+        self.versions = versions
+        self.expires = expires
+
+
+class ResponseCache:
+    """Answers of deterministic tool turns, valid while their entities are unchanged.
+
+    Entries record the ``last_updated`` of every dependency; a
+    ``state_changed`` event for one drops the entries depending on it, and a
+    lookup re-checks the versions in case an event was missed.
+    """
+
+    def __init__(self, hass: HomeAssistant, ttl: float = RESPONSE_CACHE_TTL, size: int = RESPONSE_CACHE_SIZE) -> None:
+        self.hass = hass
+        self._ttl = ttl
+        self._size = size
+        self._entries: OrderedDict[CacheKey, CachedResponse] = OrderedDict()
+        self._by_entity: Dict[str, Set[CacheKey]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(text: str, model: str, prompt_version: Hashable) -> Optional[CacheKey]:
+        utterance = normalize_utterance(text)
+        return (utterance, model, prompt_version) if utterance else None
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else None,
+            "invalidations": self.invalidations,
+        }
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None and (entry.expires < time.monotonic() or not self._current(entry)):
+            self._drop(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry.text
+
+    def store(self, key: CacheKey, text: str, dependencies: Iterable[str]) -> bool:
+        versions = {}
+        for entity_id in dependencies:
+            if (state := self.hass.states.get(entity_id)) is None:
+                return False
+            versions[entity_id] = state.last_updated
+        if not versions or not text:
+            return False
+        self._drop(key)
+        self._entries[key] = CachedResponse(text, versions, time.monotonic() + self._ttl)
+        for entity_id in versions:
+            self._by_entity.setdefault(entity_id, set()).add(key)
+        while len(self._entries) > self._size:
+            self._drop(next(iter(self._entries)))
+        LOGGER.debug("已缓存回答: %s, 依赖 %s", key[0], sorted(versions))
+        return True
+
+    @callback
+    def invalidate(self, *_: Any) -> None:
+        self._entries.clear()
+        self._by_entity.clear()
+
+    def _current(self, entry: CachedResponse) -> bool:
+        for entity_id, version in entry.versions.items():
+            state = self.hass.states.get(entity_id)
+            if state is None or state.last_updated != version:
+                return False
+        return True
+
+    def _drop(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for entity_id in entry.versions:
+            if (keys := self._by_entity.get(entity_id)) is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_entity[entity_id]
+
+    @callback
+    def _async_state_changed(self, event: Event) -> None:
+        keys: List[CacheKey] = list(self._by_entity.get(event.data["entity_id"], ()))
+        self.invalidations += len(keys)
+        for key in keys:
+            self._drop(key)
+
+    @callback
+    def async_listen(self) -> Callable[[], None]:
+        @callback
+        def _event_filter(event_data: Dict[str, Any]) -> bool:
+            return event_data.get("entity_id") in self._by_entity
+
+        return self.hass.bus.async_listen(EVENT_STATE_CHANGED, self._async_state_changed, event_filter=_event_filter)
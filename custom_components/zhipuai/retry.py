@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import aiohttp
+from homeassistant.exceptions import HomeAssistantError
+
+from .const import (
+    LOGGER,
+    MAX_RETRIES,
+    RETRY_DELAY,
+    RETRY_MAX_DELAY,
+    MAX_RETRY_AFTER,
+    RETRY_BUDGET_RATIO,
+    RETRY_BUDGET_MIN_PER_SECOND,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+    ERROR_CIRCUIT_OPEN,
+)
+
+T = TypeVar("T")
+
+ENDPOINT_CHAT = "chat"
+ENDPOINT_TOOL_CALLS = "tool_calls"
+ENDPOINT_WEB_SEARCH = "web_search"
+ENDPOINT_IMAGES = "images"
+ENDPOINT_VISION = "vision"
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+_TRANSIENT_ERRORS = (
+    aiohttp.ClientConnectorError,
+    aiohttp.ServerTimeoutError,
+    aiohttp.ServerDisconnectedError,
+    aiohttp.ClientOSError,
+    asyncio.TimeoutError,
+)
+
+
+class UpstreamStatusError(HomeAssistantError):
+    def __init__(self, message: str, status: int, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(HomeAssistantError):
+    def __init__(self, endpoint: str, retry_in: float) -> None:
+        super().__init__(ERROR_CIRCUIT_OPEN)
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(err: BaseException) -> bool:
+    if isinstance(err, UpstreamStatusError):
+        return err.status in RETRY_STATUSES
+    if isinstance(err, aiohttp.ClientResponseError):
+        return err.status in RETRY_STATUSES
+    return isinstance(err, _TRANSIENT_ERRORS)
+
+
+def _retry_after_of(err: BaseException) -> Optional[float]:
+    if isinstance(err, UpstreamStatusError):
+        return err.retry_after
+    if isinstance(err, aiohttp.ClientResponseError) and err.headers:
+        return parse_retry_after(err.headers.get("Retry-After"))
+    return None
+
+
+class RetryBudget:
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_per_second: float = RETRY_BUDGET_MIN_PER_SECOND, max_tokens: float = 10.0) -> None:
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self.exhausted = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def record_request(self) -> None:
+        self._refill()
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        self.exhausted += 1
+        return False
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+
+class CircuitBreaker:
+    def __init__(self, endpoint: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT) -> None:
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.rejected = 0
+        self.opened_count = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            return STATE_HALF_OPEN
+        return self._state
+
+    def before_request(self) -> None:
+        state = self.state
+        if state == STATE_CLOSED:
+            return
+        if state == STATE_HALF_OPEN and not self._probe_in_flight:
+            self._state = STATE_HALF_OPEN
+            self._probe_in_flight = True
+            LOGGER.info("熔断器 %s 进入半开状态，发送探测请求", self.endpoint)
+            return
+        self.rejected += 1
+        raise CircuitOpenError(self.endpoint, max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)))
+
+    def record_success(self) -> None:
+        if self._state != STATE_CLOSED:
+            LOGGER.info("熔断器 %s 已恢复", self.endpoint)
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._state == STATE_HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != STATE_OPEN:
+                self.opened_count += 1
+                LOGGER.warning("熔断器 %s 已打开，连续失败 %s 次", self.endpoint, self._failures)
+            self._state = STATE_OPEN
+            self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def release(self) -> None:
+        self._probe_in_flight = False
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "opened_count": self.opened_count,
+            "rejected": self.rejected,
+        }
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = MAX_RETRIES, base_delay: float = RETRY_DELAY, max_delay: float = RETRY_MAX_DELAY, max_retry_after: float = MAX_RETRY_AFTER) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def next_delay(self, attempt: int, err: BaseException, budget: Optional[RetryBudget] = None) -> Optional[float]:
+        if attempt + 1 >= self.max_attempts or not is_retryable(err):
+            return None
+        retry_after = _retry_after_of(err)
+        if retry_after is not None and retry_after > self.max_retry_after:
+            return None
+        if budget is not None and not budget.try_acquire():
+            LOGGER.debug("重试预算已耗尽，放弃重试")
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+_BUDGETS: Dict[str, RetryBudget] = {}
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    if endpoint not in _BREAKERS:
+        _BREAKERS[endpoint] = CircuitBreaker(endpoint)
+    return _BREAKERS[endpoint]
+
+
+def get_retry_budget(endpoint: str) -> RetryBudget:
+    if endpoint not in _BUDGETS:
+        _BUDGETS[endpoint] = RetryBudget()
+    return _BUDGETS[endpoint]
+
+
+def get_breaker_states() -> Dict[str, Dict[str, Any]]:
+    return {endpoint: breaker.as_dict() for endpoint, breaker in _BREAKERS.items()}
+
+
+async def async_call_with_retry(endpoint: str, send: Callable[[], Awaitable[T]], policy: RetryPolicy = DEFAULT_RETRY_POLICY) -> T:
+    breaker = get_breaker(endpoint)
+    budget = get_retry_budget(endpoint)
+    budget.record_request()
+    attempt = 0
+    while True:
+        breaker.before_request()
+        try:
+            result = await send()
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as err:
+            if is_retryable(err):
+                breaker.record_failure()
+            elif isinstance(err, (UpstreamStatusError, aiohttp.ClientResponseError)):
+                breaker.record_success()
+            else:
+                breaker.release()
+            delay = policy.next_delay(attempt, err, budget)
+            if delay is None:
+                raise
+            LOGGER.debug("%s 请求失败（%s），%.2f 秒后第 %s 次重试", endpoint, err, delay, attempt + 1)
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+from datetime import timedelta
+
+from homeassistant.components.sensor import SensorDeviceClass, SensorEntity, SensorStateClass
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import PERCENTAGE, EntityCategory, UnitOfTime
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers import device_registry as dr
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .const import DOMAIN, METRICS_SCAN_INTERVAL
+from .metrics import METRICS, PERCENTILES, SeriesKey, get_latency_metrics
+from .retry import (
+    ENDPOINT_CHAT,
+    ENDPOINT_IMAGES,
+    ENDPOINT_TOOL_CALLS,
+    ENDPOINT_VISION,
+    ENDPOINT_WEB_SEARCH,
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+    get_breaker_states,
+)
+
+SCAN_INTERVAL = timedelta(seconds=METRICS_SCAN_INTERVAL)
+
+
+class ZhipuAILatencySensor(SensorEntity):
+    _attr_has_entity_name = True
+    _attr_device_class = SensorDeviceClass.DURATION
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_native_unit_of_measurement = UnitOfTime.MILLISECONDS
+    _attr_suggested_display_precision = 0
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(self, entry: ConfigEntry, key: SeriesKey, metric: str, pct: int) -> None:
+        self._endpoint, self._model = key
+        self._metric = metric
+        self._pct = pct
+        self._attr_unique_id = f"{entry.entry_id}_latency_{self._endpoint}_{self._model}_{metric}_p{pct}"
+        self._attr_translation_key = f"latency_{metric}"
+        self._attr_translation_placeholders = {"endpoint": self._endpoint, "model": self._model, "percentile": f"p{pct}"}
+        self._attr_device_info = dr.DeviceInfo(identifiers={(DOMAIN, entry.entry_id)})
+
+    async def async_update(self) -> None:
+        histogram = get_latency_metrics().get(self._endpoint, self._model, self._metric)
+        value = histogram.percentile(self._pct) if histogram is not None else None
+        self._attr_native_value = round(value * 1000, 1) if value is not None else None
+        self._attr_extra_state_attributes = {
+            "endpoint": self._endpoint,
+            "model": self._model,
+            "samples": len(histogram) if histogram is not None else 0,
+        }
+
+
+class ZhipuAIPromptCacheSensor(SensorEntity):
+    _attr_has_entity_name = True
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_native_unit_of_measurement = PERCENTAGE
+    _attr_suggested_display_precision = 1
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_translation_key = "prompt_cache_hit_ratio"
+
+    def __init__(self, entry: ConfigEntry, key: SeriesKey) -> None:
+        self._endpoint, self._model = key
+        self._attr_unique_id = f"{entry.entry_id}_prompt_cache_{self._endpoint}_{self._model}"
+        self._attr_translation_placeholders = {"endpoint": self._endpoint, "model": self._model}
+        self._attr_device_info = dr.DeviceInfo(identifiers={(DOMAIN, entry.entry_id)})
+
+    async def async_update(self) -> None:
+        usage = get_latency_metrics().get_usage(self._endpoint, self._model)
+        ratio = usage.cache_hit_ratio if usage is not None else None
+        self._attr_native_value = round(ratio * 100, 1) if ratio is not None else None
+        self._attr_extra_state_attributes = {
+            "endpoint": self._endpoint,
+            "model": self._model,
+            "responses": len(usage) if usage is not None else 0,
+            "prompt_tokens": usage.prompt_tokens if usage is not None else 0,
+            "cached_tokens": usage.cached_tokens if usage is not None else 0,
+        }
+
+
+class ZhipuAICircuitBreakerSensor(SensorEntity):
+    _attr_has_entity_name = True
+    _attr_device_class = SensorDeviceClass.ENUM
+    _attr_options = [STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN]
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_translation_key = "circuit_breaker"
+
+    def __init__(self, entry: ConfigEntry, endpoint: str) -> None:
+        self._endpoint = endpoint
+        self._attr_unique_id = f"{entry.entry_id}_circuit_breaker_{endpoint}"
+        self._attr_translation_placeholders = {"endpoint": endpoint}
+        self._attr_device_info = dr.DeviceInfo(identifiers={(DOMAIN, entry.entry_id)})
+
+    async def async_update(self) -> None:
+        breaker = get_breaker_states().get(self._endpoint, {})
+        self._attr_native_value = breaker.get("state", STATE_CLOSED)
+        self._attr_extra_state_attributes = {
+            "endpoint": self._endpoint,
+            "consecutive_failures": breaker.get("consecutive_failures", 0),
+            "opened_count": breaker.get("opened_count", 0),
+            "rejected": breaker.get("rejected", 0),
+        }
+
+
+async def async_setup_entry(
+    hass: HomeAssistant,
+    config_entry: ConfigEntry,
+    async_add_entities: AddEntitiesCallback,
+) -> None:
+    entries = hass.config_entries.async_entries(DOMAIN)
+    if entries and entries[0].entry_id != config_entry.entry_id:
+        return
+
+    metrics = get_latency_metrics()
+
+    def _entities(key: SeriesKey) -> list[SensorEntity]:
+        entities: list[SensorEntity] = [ZhipuAILatencySensor(config_entry, key, metric, pct) for metric in METRICS for pct in PERCENTILES]
+        if key[0] == ENDPOINT_CHAT:
+            entities.append(ZhipuAIPromptCacheSensor(config_entry, key))
+        return entities
+
+    @callback
+    def _async_new_series(key: SeriesKey) -> None:
+        async_add_entities(_entities(key), update_before_add=True)
+
+    config_entry.async_on_unload(metrics.add_listener(_async_new_series))
+    async_add_entities([entity for key in metrics.series() for entity in _entities(key)], update_before_add=True)
+    async_add_entities(
+        [ZhipuAICircuitBreakerSensor(config_entry, endpoint) for endpoint in (ENDPOINT_CHAT, ENDPOINT_TOOL_CALLS, ENDPOINT_WEB_SEARCH, ENDPOINT_IMAGES, ENDPOINT_VISION)],
+        update_before_add=True,
+    )
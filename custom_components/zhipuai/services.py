@@ -12,10 +12,9 @@ from homeassistant.helpers import config_validation as cv
 from homeassistant.components import camera
 from homeassistant.components.camera.const import DOMAIN as CAMERA_DOMAIN
 from homeassistant.exceptions import ServiceValidationError
-import requests
+import aiohttp
 import json
 import time
-import asyncio
 
 from .const import (
     DOMAIN,
@@ -26,6 +25,10 @@ from .const import (
     CONF_MAX_TOKENS,
     RECOMMENDED_MAX_TOKENS,
 )
+from .connection_pool import async_get_session
+from .ai_request import resolve_api_url
+from .metrics import RequestTimer
+from .retry import ENDPOINT_VISION, CircuitOpenError, async_call_with_retry
 
 class ImageProcessor:
     def __init__(self, hass: HomeAssistant):
@@ -199,6 +202,106 @@ VIDEO_ANALYZER_SCHEMA = vol.Schema(
 async def async_setup_services(hass: HomeAssistant) -> None:
     image_processor = ImageProcessor(hass)
     
+    def _request_timeout(stream: bool) -> aiohttp.ClientTimeout:
+        if stream:
+            return aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+        return aiohttp.ClientTimeout(total=30)
+
+    async def _async_post_chat(entry_id: str, options: dict, headers: dict, payload: dict, stream: bool, timer: RequestTimer) -> aiohttp.ClientResponse:
+        async def _send() -> aiohttp.ClientResponse:
+            session = await async_get_session(entry_id)
+            timer.begin_attempt()
+            response = await session.post(resolve_api_url(options, ZHIPUAI_URL), headers=headers, json=payload, timeout=_request_timeout(stream), trace_request_ctx=timer)
+            if response.status != 200:
+                response.release()
+                response.raise_for_status()
+            timer.mark_first_byte()
+            return response
+        return await async_call_with_retry(ENDPOINT_VISION, _send)
+
+    async def _async_process_image_stream(response: aiohttp.ClientResponse, timer: RequestTimer) -> dict:
+        event_id = f"zhipuai_response_{int(time.time())}"
+        
+        try:
+            hass.bus.async_fire(f"{DOMAIN}_stream_start", {"event_id": event_id, "type": "image_analysis"})
+            
+            accumulated_text = ""
+            async for line in response.content:
+                if line.strip():
+                    try:
+                        data = line.decode('utf-8').strip().replace('data: ', '')
+                        if data == '[DONE]':
+                            break
+                        
+                        json_data = json.loads(data)
+                        timer.mark_token()
+                        if 'choices' in json_data and len(json_data['choices']) > 0:
+                            content = json_data['choices'][0].get('delta', {}).get('content', '')
+                            if content:
+                                accumulated_text += content
+                                hass.bus.async_fire(f"{DOMAIN}_stream_token", {"event_id": event_id, "content": content, "full_content": accumulated_text})
+                                
+                    except json.JSONDecodeError as e:
+                        LOGGER.error(f"解析流式响应失败: {str(e)}")
+                        continue
+            
+            timer.finish()
+            hass.bus.async_fire(f"{DOMAIN}_stream_end", {"event_id": event_id, "full_content": accumulated_text})
+            
+            hass.bus.async_fire(f"{DOMAIN}_response", {"type": "image_analysis", "content": accumulated_text, "success": True})
+            return {"success": True, "event_id": event_id, "message": accumulated_text}
+            
+        except Exception as e:
+            error_msg = f"处理流式响应时出错: {str(e)}"
+            LOGGER.info(error_msg)
+            hass.bus.async_fire(f"{DOMAIN}_stream_error", {"event_id": event_id, "error": error_msg})
+            return {"success": False, "message": error_msg}
+
+    async def _async_process_video_stream(response: aiohttp.ClientResponse, timer: RequestTimer) -> dict:
+        event_id = f"zhipuai_response_{int(time.time())}"
+        
+        try:
+            hass.bus.async_fire(f"{DOMAIN}_stream_start", {"event_id": event_id, "type": "video_analysis"})
+            
+            accumulated_text = ""
+            async for line in response.content:
+                if line.strip():
+                    try:
+                        line_text = line.decode('utf-8').strip()
+                        if line_text.startswith('data: '):
+                            line_text = line_text[6:]
+                        if line_text == '[DONE]':
+                            break
+                        
+                        json_data = json.loads(line_text)
+                        timer.mark_token()
+                        if 'choices' in json_data and json_data['choices']:
+                            choice = json_data['choices'][0]
+                            if 'delta' in choice and 'content' in choice['delta']:
+                                content = choice['delta']['content']
+                                accumulated_text += content
+                                hass.bus.async_fire(
+                                    f"{DOMAIN}_stream_token",
+                                    {
+                                        "event_id": event_id,
+                                        "token": content,
+                                        "complete_text": accumulated_text
+                                    }
+                                )
+                    except json.JSONDecodeError as e:
+                        LOGGER.error(f"解析流式响应失败: {str(e)}")
+                        continue
+            
+            timer.finish()
+            hass.bus.async_fire(f"{DOMAIN}_stream_end", {
+                "event_id": event_id,
+                "complete_text": accumulated_text
+            })
+            return {"success": True, "message": accumulated_text}
+        except Exception as e:
+            LOGGER.error(f"处理流式响应时出错: {str(e)}")
+            return {"success": False, "message": f"处理流式响应时出错: {str(e)}"}
+
     async def handle_image_analyzer(call: ServiceCall) -> None:
         try:
             config_entries = hass.config_entries.async_entries(DOMAIN)
@@ -316,56 +419,24 @@ async def async_setup_services(hass: HomeAssistant) -> None:
             }
 
             try:
-                response = await hass.async_add_executor_job(lambda: requests.post(ZHIPUAI_URL, headers=headers, json=payload, stream=call.data.get("stream", False), timeout=30))
-                response.raise_for_status()
-            except requests.exceptions.RequestException as e:
+                stream = call.data.get("stream", False)
+                timer = RequestTimer(ENDPOINT_VISION, payload["model"])
+                async with await _async_post_chat(config_entries[0].entry_id, config_entries[0].options, headers, payload, stream, timer) as response:
+                    if stream:
+                        return await _async_process_image_stream(response, timer)
+                    result = await response.json(content_type=None)
+                timer.finish()
+            except (aiohttp.ClientError, CircuitOpenError) as e:
                 LOGGER.error(f"API请求失败: {str(e)}")
                 return {"success": False, "message": f"API请求失败: {str(e)}"}
 
-            if call.data.get("stream", False):
-                event_id = f"zhipuai_response_{int(time.time())}"
-                
-                try:
-                    hass.bus.async_fire(f"{DOMAIN}_stream_start", {"event_id": event_id, "type": "image_analysis"})
-                    
-                    accumulated_text = ""
-                    for line in response.iter_lines():
-                        if line:
-                            try:
-                                data = line.decode('utf-8').replace('data: ', '')
-                                if data == '[DONE]':
-                                    break
-                                
-                                json_data = json.loads(data)
-                                if 'choices' in json_data and len(json_data['choices']) > 0:
-                                    content = json_data['choices'][0].get('delta', {}).get('content', '')
-                                    if content:
-                                        accumulated_text += content
-                                        hass.bus.async_fire(f"{DOMAIN}_stream_token", {"event_id": event_id, "content": content, "full_content": accumulated_text})
-                                        
-                            except json.JSONDecodeError as e:
-                                LOGGER.error(f"解析流式响应失败: {str(e)}")
-                                continue
-                    
-                    hass.bus.async_fire(f"{DOMAIN}_stream_end", {"event_id": event_id, "full_content": accumulated_text})
-                    
-                    hass.bus.async_fire(f"{DOMAIN}_response", {"type": "image_analysis", "content": accumulated_text, "success": True})
-                    return {"success": True, "event_id": event_id, "message": accumulated_text}
-                    
-                except Exception as e:
-                    error_msg = f"处理流式响应时出错: {str(e)}"
-                    LOGGER.info(error_msg)
-                    hass.bus.async_fire(f"{DOMAIN}_stream_error", {"event_id": event_id, "error": error_msg})
-                    return {"success": False, "message": error_msg}
+            if result.get("choices") and len(result["choices"]) > 0:
+                content = result["choices"][0].get("message", {}).get("content", "")
+                hass.bus.async_fire(f"{DOMAIN}_response", {"type": "image_analysis", "content": content, "success": True})
+                return {"success": True, "message": content}
             else:
-                result = response.json()
-                if result.get("choices") and len(result["choices"]) > 0:
-                    content = result["choices"][0].get("message", {}).get("content", "")
-                    hass.bus.async_fire(f"{DOMAIN}_response", {"type": "image_analysis", "content": content, "success": True})
-                    return {"success": True, "message": content}
-                else:
-                    error_msg = "No response from API"
-                    return {"success": False, "message": error_msg}
+                error_msg = "No response from API"
+                return {"success": False, "message": error_msg}
         except Exception as e:
             error_msg = f"Image analysis failed: {str(e)}"
             LOGGER.info(f"图像分析错误: {str(e)}")
@@ -454,81 +525,24 @@ async def async_setup_services(hass: HomeAssistant) -> None:
             }
 
             try:
-                for attempt in range(3):
-                    try:
-                        response = await hass.async_add_executor_job(
-                            lambda: requests.post(
-                                ZHIPUAI_URL,
-                                headers=headers,
-                                json=payload,
-                                stream=call.data.get("stream", False),
-                                timeout=30
-                            )
-                        )
-                        response.raise_for_status()
-                        break
-                    except requests.exceptions.RequestException as e:
-                        if attempt == 2:  
-                            raise
-                        if response.status_code == 429:  
-                            await asyncio.sleep(2)  
-                        else:
-                            raise
-            except requests.exceptions.RequestException as e:
+                stream = call.data.get("stream", False)
+                timer = RequestTimer(ENDPOINT_VISION, payload["model"])
+                async with await _async_post_chat(config_entries[0].entry_id, config_entries[0].options, headers, payload, stream, timer) as response:
+                    if stream:
+                        return await _async_process_video_stream(response, timer)
+                    result = await response.json(content_type=None)
+                timer.finish()
+            except (aiohttp.ClientError, CircuitOpenError) as e:
                 LOGGER.error(f"API请求失败: {str(e)}")
                 return {"success": False, "message": f"API请求失败: {str(e)}"}
 
-            if call.data.get("stream", False):
-                event_id = f"zhipuai_response_{int(time.time())}"
-                
-                try:
-                    hass.bus.async_fire(f"{DOMAIN}_stream_start", {"event_id": event_id, "type": "video_analysis"})
-                    
-                    accumulated_text = ""
-                    for line in response.iter_lines():
-                        if line:
-                            try:
-                                line_text = line.decode('utf-8').strip()
-                                if line_text.startswith('data: '):
-                                    line_text = line_text[6:]
-                                if line_text == '[DONE]':
-                                    break
-                                
-                                json_data = json.loads(line_text)
-                                if 'choices' in json_data and json_data['choices']:
-                                    choice = json_data['choices'][0]
-                                    if 'delta' in choice and 'content' in choice['delta']:
-                                        content = choice['delta']['content']
-                                        accumulated_text += content
-                                        hass.bus.async_fire(
-                                            f"{DOMAIN}_stream_token",
-                                            {
-                                                "event_id": event_id,
-                                                "token": content,
-                                                "complete_text": accumulated_text
-                                            }
-                                        )
-                            except json.JSONDecodeError as e:
-                                LOGGER.error(f"解析流式响应失败: {str(e)}")
-                                continue
-                    
-                    hass.bus.async_fire(f"{DOMAIN}_stream_end", {
-                        "event_id": event_id,
-                        "complete_text": accumulated_text
-                    })
-                    return {"success": True, "message": accumulated_text}
-                except Exception as e:
-                    LOGGER.error(f"处理流式响应时出错: {str(e)}")
-                    return {"success": False, "message": f"处理流式响应时出错: {str(e)}"}
+            if result.get("choices") and len(result["choices"]) > 0:
+                content = result["choices"][0].get("message", {}).get("content", "")
+                hass.bus.async_fire(f"{DOMAIN}_response", {"type": "video_analysis", "content": content, "success": True})
+                return {"success": True, "message": content}
             else:
-                result = response.json()
-                if result.get("choices") and len(result["choices"]) > 0:
-                    content = result["choices"][0].get("message", {}).get("content", "")
-                    hass.bus.async_fire(f"{DOMAIN}_response", {"type": "video_analysis", "content": content, "success": True})
-                    return {"success": True, "message": content}
-                else:
-                    error_msg = "API 无响应"
-                    return {"success": False, "message": error_msg}
+                error_msg = "API 无响应"
+                return {"success": False, "message": error_msg}
         except Exception as e:
             error_msg = f"Video analysis failed: {str(e)}"
             LOGGER.error(f"视频分析错误: {str(e)}")
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import statistics
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from homeassistant.helpers import intent
+
+from .const import LOGGER, SPECULATIVE_STATS_WINDOW
+
+_T = TypeVar("_T")
+
+CONFIDENT_RESPONSE_TYPES = (intent.IntentResponseType.ACTION_DONE, intent.IntentResponseType.QUERY_ANSWER)
+
+
+def is_confident(result: Any) -> bool:
+    """Whether a local agent result answered the request outright."""
+    response = getattr(result, "response", None)
+    return response is not None and response.response_type in CONFIDENT_RESPONSE_TYPES
+
+
+class LocalGate:
+    """Holds back LLM output until the local agent has answered.
+
+    The LLM request is already in flight, so connection setup and prefill
+    overlap the local match; nothing reaches the chat log, TTS or a tool
+    before the race is decided.
+    """
+
+    def __init__(self, local: asyncio.Future) -> None:
+        self._local = local
+
+    async def async_wait(self) -> None:
+        with contextlib.suppress(Exception):
+            await asyncio.shield(self._local)
+
+    def wrap(self, transform: Callable[..., AsyncGenerator]) -> Callable[..., AsyncGenerator]:
+        async def _gated(stream: AsyncGenerator) -> AsyncGenerator:
+            waited = False
+            async for chunk in stream:
+                if not waited:
+                    await self.async_wait()
+                    waited = True
+                yield chunk
+
+        def _transform(stream: AsyncGenerator, *args: Any) -> AsyncGenerator:
+            return transform(_gated(stream), *args)
+
+        return _transform
+
+
+class SpeculativeRace:
+    """Runs the built-in agent and the LLM turn side by side.
+
+    A confident local answer cancels the LLM turn, closing its stream after
+    at most the first chunk; anything else lets the held LLM turn go on.
+    Keeps the local-win rate and the latency saved over recent races.
+    """
+
+    def __init__(self) -> None:
+        self.races = 0
+        self.local_wins = 0
+        self.saved_ms = 0.0
+        self._local_ms: Deque[float] = deque(maxlen=SPECULATIVE_STATS_WINDOW)
+        self._llm_ms: Deque[float] = deque(maxlen=SPECULATIVE_STATS_WINDOW)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "races": self.races,
+            "local_wins": self.local_wins,
+            "win_rate": round(self.local_wins / self.races, 3) if self.races else None,
+            "local_ms_p50": round(statistics.median(self._local_ms), 1) if self._local_ms else None,
+            "llm_ms_p50": round(statistics.median(self._llm_ms), 1) if self._llm_ms else None,
+            "saved_ms": round(self.saved_ms, 1),
+        }
+
+    async def async_run(
+        self,
+        local: Callable[[], Awaitable[Any]],
+        llm: Callable[[LocalGate], Awaitable[_T]],
+    ) -> tuple[Optional[Any], Optional[_T]]:
+        """Return ``(local_result, None)`` on a local win, else ``(None, llm_result)``."""
+        start = time.perf_counter()
+        local_task = asyncio.ensure_future(local())
+        llm_task = asyncio.ensure_future(llm(LocalGate(local_task)))
+        try:
+            try:
+                local_result = await asyncio.shield(local_task)
+            except Exception as err:
+                LOGGER.debug("本地意图预判失败: %s", err)
+                local_result = None
+            local_ms = (time.perf_counter() - start) * 1000
+            self.races += 1
+            self._local_ms.append(local_ms)
+
+            if is_confident(local_result):
+                llm_task.cancel()
+                with contextlib.suppress(asyncio.CancelledError, Exception):
+                    await llm_task
+                self.local_wins += 1
+                if self._llm_ms:
+                    # A serial LLM turn would have taken about as long as recent lost races.
+                    self.saved_ms += max(0.0, statistics.median(self._llm_ms) - local_ms)
+                LOGGER.debug("本地意图胜出 (%.1f ms), 已取消大模型请求", local_ms)
+                return local_result, None
+
+            result = await llm_task
+            llm_ms = (time.perf_counter() - start) * 1000
+            self._llm_ms.append(llm_ms)
+            # Serially, the local attempt would have come before the LLM turn.
+            self.saved_ms += min(local_ms, llm_ms)
+            return None, result
+        finally:
+            for task in (local_task, llm_task):
+                if not task.done():
+                    task.cancel()
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from typing import List, Optional
+
+
+class SSEEvent:
+    __slots__ = ("event", "data", "id", "retry")
+
+    def __init__(self, event: str = "message", data: str = "", id: Optional[str] = None, retry: Optional[int] = None) -> None:
+        self.event = event
+        self.data = data
+        self.id = id
+        self.retry = retry
+
+    def __repr__(self) -> str:
+        return f"SSEEvent(event={self.event!r}, data={self.data!r}, id={self.id!r})"
+
+
+class SSEDecoder:
+    __slots__ = ("_buffer", "_scan_pos", "_data", "_event", "_id", "_retry", "last_event_id")
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._scan_pos = 0
+        self._data: List[bytes] = []
+        self._event: Optional[bytes] = None
+        self._id: Optional[bytes] = None
+        self._retry: Optional[int] = None
+        self.last_event_id: Optional[str] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        # aiohttp mostly hands over one whole line at a time, so a lone data
+        # line or blank line skips the buffer. Integer membership is a plain
+        # memchr, far cheaper than find() on every line.
+        if chunk == b"\n" and not self._buffer:
+            data = self._data
+            if len(data) == 1 and self._event is None and self._id is None:
+                return [SSEEvent("message", data.pop().decode("utf-8", "replace"), self.last_event_id, self._retry)]
+            event = self._dispatch()
+            return [event] if event is not None else []
+        if chunk[:6] == b"data: " and chunk[-1] == 0x0A and 0x0A not in chunk[:-1] and 0x0D not in chunk and not self._buffer:
+            self._data.append(chunk[6:-1])
+            return []
+        if not chunk:
+            return []
+        buffer = self._buffer
+        if not buffer and chunk[-1] == 0x0A:
+            complete = chunk
+        else:
+            buffer += chunk
+            last = buffer.rfind(b"\n", self._scan_pos)
+            if last == -1:
+                self._scan_pos = len(buffer)
+                return []
+            complete = bytes(buffer[:last + 1])
+            del buffer[:last + 1]
+            self._scan_pos = 0
+        events: List[SSEEvent] = []
+        data = self._data
+        for line in complete.splitlines():
+            if not line:
+                if data and self._event is None and self._id is None and len(data) == 1:
+                    events.append(SSEEvent("message", data[0].decode("utf-8", "replace"), self.last_event_id, self._retry))
+                    data.clear()
+                elif (event := self._dispatch()) is not None:
+                    events.append(event)
+            elif line[:6] == b"data: ":
+                data.append(line[6:])
+            else:
+                self._process_field(line)
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        if self._buffer:
+            line = bytes(self._buffer).rstrip(b"\r")
+            self._buffer.clear()
+            self._scan_pos = 0
+            if line:
+                self._process_field(line)
+        event = self._dispatch()
+        return [event] if event is not None else []
+
+    def _process_field(self, line: bytes) -> None:
+        if line[0] == 0x3A:
+            return
+        field, sep, value = line.partition(b":")
+        if sep and value[:1] == b" ":
+            value = value[1:]
+        if field == b"data":
+            self._data.append(value)
+        elif field == b"event":
+            self._event = value
+        elif field == b"id":
+            if b"\x00" not in value:
+                self._id = value
+        elif field == b"retry":
+            if value.isdigit():
+                self._retry = int(value)
+
+    def _dispatch(self) -> Optional[SSEEvent]:
+        if self._id is not None:
+            self.last_event_id = self._id.decode("utf-8", "replace")
+        if not self._data:
+            self._event = None
+            self._id = None
+            return None
+        data = self._data[0] if len(self._data) == 1 else b"\n".join(self._data)
+        event = SSEEvent(
+            self._event.decode("utf-8", "replace") if self._event else "message",
+            data.decode("utf-8", "replace"),
+            self.last_event_id,
+            self._retry,
+        )
+        self._data.clear()
+        self._event = None
+        self._id = None
+        return event
+
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from types import BuiltinFunctionType, FunctionType
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import voluptuous as vol
+from homeassistant.components import conversation
+from homeassistant.components.homeassistant.exposed_entities import async_listen_entity_updates
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers import entity_registry as er, llm, selector
+
+from .const import LOGGER, TOOL_CACHE_SIZE
+from .tool_selector import ToolSelector
+
+ToolFormatter = Callable[[llm.Tool, Any], Dict[str, Any]]
+ToolDescriber = Callable[[List[Dict[str, Any]]], List[str]]
+
+
+def _stable_schema(value: Any) -> Any:
+    """Hashable form of a parameter schema that leaves out object addresses.
+
+    A nested ``vol.Schema`` and HA selectors have no value-based ``repr``,
+    and script tools build new ones on every API lookup, so their ``repr``
+    differs each turn. Validators point back at their parent schema, so
+    only the parts that describe the tool are walked.
+    """
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, dict):
+        # Schemas built from the same config list their fields in the same order.
+        return tuple((_stable_schema(key), _stable_schema(item)) for key, item in value.items())
+    if isinstance(value, vol.Marker):
+        default = getattr(value, "default", vol.UNDEFINED)
+        return (
+            type(value).__name__,
+            _stable_schema(value.schema),
+            value.description,
+            _stable_schema(default()) if default is not vol.UNDEFINED and callable(default) else None,
+        )
+    if isinstance(value, (type, FunctionType, BuiltinFunctionType)):
+        return f"{value.__module__}.{value.__qualname__}"
+    if isinstance(value, (list, tuple)):
+        return tuple(_stable_schema(item) for item in value)
+    if isinstance(value, vol.Schema):
+        return _stable_schema(value.schema)
+    if isinstance(value, selector.Selector):
+        return value.selector_type, _stable_schema(value.config)
+    if isinstance(validators := getattr(value, "validators", None), (list, tuple)):
+        return type(value).__name__, _stable_schema(validators)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(repr(_stable_schema(item)) for item in value))
+    if type(value).__repr__ is object.__repr__:
+        return type(value).__qualname__
+    return repr(value)
+
+
+def tool_set_hash(tools: Sequence[llm.Tool]) -> int:
+    """Hash of tool names, descriptions and parameter schemas.
+
+    Scripts and intents rebuild their ``llm.Tool`` objects on every API
+    lookup, so identity is useless as a key; the schema's contents only
+    change when a field does.
+    """
+    return hash(tuple(
+        (tool.name, tool.description, _stable_schema(getattr(tool.parameters, "schema", tool.parameters)))
+        for tool in tools
+    ))
+
+
+class ToolSpec:
+    __slots__ = ("tools", "description", "_selector")
+
+    def __init__(self, tools: List[Dict[str, Any]], description: List[str]) -> None:
+        self.tools = tools
+        self.description = description
+        self._selector: Optional[ToolSelector] = None
+
+    @property
+    def selector(self) -> ToolSelector:
+        if self._selector is None:
+            self._selector = ToolSelector(self.tools)
+        return self._selector
+
+
+class ToolSpecCache:
+    """Converted tool schemas and their prompt description per LLM API.
+
+    Keyed by API id and :func:`tool_set_hash`, so a changed script or
+    exposure misses on its own; registry and exposure events also clear the
+    cache so stale tool sets do not linger.
+    """
+
+    def __init__(self, hass: HomeAssistant, format_tool: ToolFormatter, describe_tools: ToolDescriber, size: int = TOOL_CACHE_SIZE) -> None:
+        self.hass = hass
+        self._format_tool = format_tool
+        self._describe_tools = describe_tools
+        self._size = size
+        self._entries: OrderedDict[Tuple[str, int], ToolSpec] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_ratio(self) -> Optional[float]:
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def stats(self) -> Dict[str, Any]:
+        ratio = self.hit_ratio
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": round(ratio, 3) if ratio is not None else None}
+
+    def get(self, api_id: str, llm_api: llm.APIInstance) -> ToolSpec:
+        key = (api_id, tool_set_hash(llm_api.tools))
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        tools = sorted(
+            (self._format_tool(tool, llm_api.custom_serializer) for tool in llm_api.tools),
+            key=lambda tool: tool["function"]["name"],
+        )
+        entry = self._entries[key] = ToolSpec(tools, self._describe_tools(tools))
+        while len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+        LOGGER.debug("工具定义缓存未命中: %s, %d 个工具, 命中率 %s", api_id, len(tools), self.stats()["hit_ratio"])
+        return entry
+
+    @callback
+    def invalidate(self, *_: Any) -> None:
+        self._entries.clear()
+
+    @callback
+    def async_listen(self) -> Callable[[], None]:
+        """Clear on script registry changes and exposure changes."""
+
+        @callback
+        def _registry_filter(event_data: Dict[str, Any]) -> bool:
+            return str(event_data.get("entity_id", "")).startswith("script.")
+
+        unsubs = [
+            self.hass.bus.async_listen(er.EVENT_ENTITY_REGISTRY_UPDATED, self.invalidate, event_filter=_registry_filter),
+            async_listen_entity_updates(self.hass, conversation.DOMAIN, self.invalidate),
+        ]
+
+        @callback
+        def _unsub() -> None:
+            for unsub in unsubs:
+                unsub()
+
+        return _unsub
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import math
+import re
+from collections import defaultdict
+from typing import Any, Dict, List, Sequence, Set
+
+from .const import TOOL_CORE_SET, TOOL_SCORE_RATIO
+from .prompts import ALL_FEATURES
+
+_CJK_RUN = re.compile(r"[\u2e80-\u9fff\uf900-\ufaff]+")
+_WORD = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+_STOP_WORDS = frozenset({"hass", "the", "and", "for", "with", "from", "this", "that", "use", "used", "tool", "when", "or", "to", "of", "in", "on", "is", "a", "an", "by", "it"})
+
+
+# Chinese aliases for the built-in Assist intents, whose descriptions are English.
+INTENT_ALIASES = {
+    "GetLiveContext": ["状态", "多少", "几度", "开着吗", "关着吗", "现在", "当前", "温度", "湿度", "电量"],
+    "HassTurnOn": ["打开", "开启", "启动", "开灯", "执行", "激活"],
+    "HassTurnOff": ["关闭", "关掉", "关灯", "停止"],
+    "HassLightSet": ["亮度", "调光", "颜色", "色温", "调亮", "调暗", "百分之"],
+    "HassClimateSetTemperature": ["空调", "温度", "度", "制冷", "制热", "暖气"],
+    "HassMediaPause": ["暂停"],
+    "HassMediaUnpause": ["继续播放", "恢复播放"],
+    "HassMediaNext": ["下一首", "下一曲", "切歌"],
+    "HassMediaPrevious": ["上一首", "上一曲"],
+    "HassSetVolume": ["音量", "声音", "大声", "小声"],
+    "HassMediaSearchAndPlay": ["播放", "放一首", "听", "的歌", "音乐"],
+    "HassSetPosition": ["窗帘", "位置", "一半", "百叶窗", "阀门"],
+    "HassVacuumStart": ["扫地", "打扫", "清扫", "吸尘"],
+    "HassVacuumReturnToBase": ["充电", "回充", "回去", "回到基座"],
+    "HassShoppingListAddItem": ["购物清单", "购物单", "要买"],
+    "HassListAddItem": ["待办", "清单", "列表"],
+    "HassStartTimer": ["计时", "定时", "倒计时", "分钟后"],
+    "HassCancelAllTimers": ["取消计时", "取消定时"],
+    "HassGetWeather": ["天气", "下雨", "气温"],
+    "HassFanSetSpeed": ["风扇", "风速", "风量"],
+}
+
+
+def tool_terms(text: str) -> Set[str]:
+    """Lowercase English words (CamelCase and snake_case split) and CJK bigrams."""
+    terms = {word.lower() for word in _WORD.findall(text or "")}
+    for run in _CJK_RUN.findall(text or ""):
+        terms.update(run[index:index + 2] for index in range(max(1, len(run) - 1)))
+    return {term for term in terms if len(term) > 1 and term not in _STOP_WORDS}
+
+
+def _tool_name(tool: Dict[str, Any]) -> str:
+    return tool.get("function", {}).get("name", "")
+
+
+class ToolSelector:
+    """Ranks the tools of one tool set against an utterance.
+
+    Two indexes are built once per tool set: the ``prompts.ALL_FEATURES``
+    keywords mapped to the tools each feature names, and the words and CJK
+    bigrams of every tool name and description weighted by rarity. The core
+    set is always sent; when nothing else scores the full set is sent, so a
+    miss costs tokens, never a missing tool.
+    """
+
+    def __init__(self, tools: Sequence[Dict[str, Any]]) -> None:
+        self.tools = list(tools)
+        names = [_tool_name(tool) for tool in self.tools]
+        self._core = {name for name in names if name in TOOL_CORE_SET}
+        self._keywords: Dict[str, Set[str]] = defaultdict(set)
+        for feature in ALL_FEATURES:
+            targets = {name for name in names for wanted in feature.get("tools", ()) if name == wanted or name.endswith(wanted)}
+            if targets:
+                for keyword in feature["keywords"]:
+                    self._keywords[keyword.lower()].update(targets)
+        for name in names:
+            for alias in INTENT_ALIASES.get(name, ()):
+                self._keywords[alias].add(name)
+        self._terms: Dict[str, Set[str]] = defaultdict(set)
+        for name, tool in zip(names, self.tools):
+            for term in tool_terms(f"{name} {tool.get('function', {}).get('description', '')}"):
+                self._terms[term].add(name)
+        self._weights = {term: math.log(1 + len(names) / len(owners)) for term, owners in self._terms.items()}
+
+    def scores(self, text: str) -> Dict[str, float]:
+        text_lower = (text or "").lower()
+        scores: Dict[str, float] = defaultdict(float)
+        for keyword, targets in self._keywords.items():
+            if keyword in text_lower:
+                for name in targets:
+                    scores[name] += 3 + min(len(keyword), 4)
+        for term in tool_terms(text):
+            for name in self._terms.get(term, ()):
+                scores[name] += self._weights[term]
+        return scores
+
+    def select(self, text: str, top_k: int) -> List[Dict[str, Any]]:
+        if top_k <= 0 or len(self.tools) <= len(self._core) + top_k:
+            return list(self.tools)
+        scores = self.scores(text)
+        ranked = sorted((name for name in scores if name not in self._core), key=lambda name: (-scores[name], name))
+        if not ranked:
+            return list(self.tools)
+        floor = scores[ranked[0]] * TOOL_SCORE_RATIO
+        chosen = self._core | {name for name in ranked[:top_k] if scores[name] >= floor}
+        return [tool for tool in self.tools if _tool_name(tool) in chosen]
@@ -6,7 +6,7 @@ import time
 from typing import Any, Dict
 
 import voluptuous as vol
-import requests
+import aiohttp
 from homeassistant.core import HomeAssistant, ServiceCall, callback
 from homeassistant.exceptions import HomeAssistantError, ServiceValidationError
 from homeassistant.helpers import config_validation as cv
@@ -18,6 +18,10 @@ from .const import (
     CONF_WEB_SEARCH,
     DEFAULT_WEB_SEARCH
 )
+from .connection_pool import async_get_session
+from .ai_request import resolve_api_url
+from .metrics import RequestTimer
+from .retry import ENDPOINT_WEB_SEARCH, CircuitOpenError, async_call_with_retry
 
 WEB_SEARCH_API_URL = "https://open.bigmodel.cn/api/paas/v4/web_search"
 
@@ -30,6 +34,67 @@ WEB_SEARCH_SCHEMA = vol.Schema({
 
 async def async_setup_web_search(hass: HomeAssistant) -> None:
     
+    async def _async_process_stream(response: aiohttp.ClientResponse, timer: RequestTimer) -> dict:
+        event_id = f"zhipuai_response_{int(time.time())}"
+        
+        try:
+            hass.bus.async_fire(f"{DOMAIN}_stream_start", {
+                "event_id": event_id,
+                "type": "web_search"
+            })
+            
+            accumulated_text = ""
+            async for line in response.content:
+                if line.strip():
+                    try:
+                        line_text = line.decode('utf-8').strip()
+                        if line_text.startswith('data: '):
+                            line_text = line_text[6:]
+                        if line_text == '[DONE]':
+                            break
+                        
+                        json_data = json.loads(line_text)
+                        timer.mark_token()
+                        if 'search_result' in json_data:
+                            search_results = json_data.get('search_result', [])
+                            for result in search_results:
+                                if result_content := result.get('content'):
+                                    accumulated_text += result_content + "\n"
+                                    if link := result.get('link'):
+                                        accumulated_text += f"来源: {link}\n"
+                                    accumulated_text += "---\n"
+                                    hass.bus.async_fire(
+                                        f"{DOMAIN}_stream_token",
+                                        {
+                                            "event_id": event_id,
+                                            "content": result_content,
+                                            "full_content": accumulated_text
+                                        }
+                                    )
+                    except json.JSONDecodeError:
+                        continue
+
+            timer.finish()
+            hass.bus.async_fire(f"{DOMAIN}_stream_end", {
+                "event_id": event_id,
+                "full_content": accumulated_text
+            })
+            
+            hass.bus.async_fire(f"{DOMAIN}_response", {
+                "type": "web_search",
+                "content": accumulated_text,
+                "success": True
+            })
+            return {"success": True, "event_id": event_id, "message": accumulated_text}
+            
+        except Exception as e:
+            error_msg = f"处理流式响应时出错: {str(e)}"
+            hass.bus.async_fire(f"{DOMAIN}_stream_error", {
+                "event_id": event_id,
+                "error": error_msg
+            })
+            return {"success": False, "message": error_msg}
+
     async def handle_web_search(call: ServiceCall) -> None:
         try:
             config_entries = hass.config_entries.async_entries(DOMAIN)
@@ -68,109 +133,62 @@ async def async_setup_web_search(hass: HomeAssistant) -> None:
             }
             
             try:
-                response = await hass.async_add_executor_job(
-                    lambda: requests.post(
-                        WEB_SEARCH_API_URL,
+                timer = RequestTimer(ENDPOINT_WEB_SEARCH, search_engine)
+
+                async def _send() -> aiohttp.ClientResponse:
+                    session = await async_get_session(entry.entry_id)
+                    timer.begin_attempt()
+                    response = await session.post(
+                        resolve_api_url(entry.options, WEB_SEARCH_API_URL),
                         headers=headers,
                         json=payload,
-                        stream=stream,
-                        timeout=300
+                        timeout=aiohttp.ClientTimeout(total=300),
+                        trace_request_ctx=timer
                     )
-                )
-                response.raise_for_status()
-            except requests.exceptions.RequestException as e:
+                    if response.status != 200:
+                        response.release()
+                        response.raise_for_status()
+                    timer.mark_first_byte()
+                    return response
+
+                async with await async_call_with_retry(ENDPOINT_WEB_SEARCH, _send) as response:
+                    if stream:
+                        return await _async_process_stream(response, timer)
+                    result = await response.json(content_type=None)
+                timer.finish()
+            except (aiohttp.ClientError, CircuitOpenError) as e:
                 raise ServiceValidationError(f"API请求失败: {str(e)}")
 
-            if stream:
-                event_id = f"zhipuai_response_{int(time.time())}"
-                
-                try:
-                    hass.bus.async_fire(f"{DOMAIN}_stream_start", {
-                        "event_id": event_id,
-                        "type": "web_search"
-                    })
-                    
-                    accumulated_text = ""
-                    for line in response.iter_lines():
-                        if line:
-                            try:
-                                line_text = line.decode('utf-8').strip()
-                                if line_text.startswith('data: '):
-                                    line_text = line_text[6:]
-                                if line_text == '[DONE]':
-                                    break
-                                
-                                json_data = json.loads(line_text)
-                                if 'search_result' in json_data:
-                                    search_results = json_data.get('search_result', [])
-                                    for result in search_results:
-                                        if result_content := result.get('content'):
-                                            accumulated_text += result_content + "\n"
-                                            if link := result.get('link'):
-                                                accumulated_text += f"来源: {link}\n"
-                                            accumulated_text += "---\n"
-                                            hass.bus.async_fire(
-                                                f"{DOMAIN}_stream_token",
-                                                {
-                                                    "event_id": event_id,
-                                                    "content": result_content,
-                                                    "full_content": accumulated_text
-                                                }
-                                            )
-                            except json.JSONDecodeError:
-                                continue
-                    
-                    hass.bus.async_fire(f"{DOMAIN}_stream_end", {
-                        "event_id": event_id,
-                        "full_content": accumulated_text
-                    })
-                    
-                    hass.bus.async_fire(f"{DOMAIN}_response", {
-                        "type": "web_search",
-                        "content": accumulated_text,
-                        "success": True
-                    })
-                    return {"success": True, "event_id": event_id, "message": accumulated_text}
+            content = ""
+            
+            if "error" in result:
+                return {"success": False, "message": f"API返回错误: {result.get('error')}"}
+            
+            if "search_result" in result:
+                search_results = result.get("search_result", [])
+                for result_item in search_results:
+                    title = result_item.get("title", "")
+                    if title:
+                        content += f"标题: {title}\n"
                     
-                except Exception as e:
-                    error_msg = f"处理流式响应时出错: {str(e)}"
-                    hass.bus.async_fire(f"{DOMAIN}_stream_error", {
-                        "event_id": event_id,
-                        "error": error_msg
-                    })
-                    return {"success": False, "message": error_msg}
-            else:
-                result = response.json()
-                content = ""
-                
-                if "error" in result:
-                    return {"success": False, "message": f"API返回错误: {result.get('error')}"}
-                
-                if "search_result" in result:
-                    search_results = result.get("search_result", [])
-                    for result_item in search_results:
-                        title = result_item.get("title", "")
-                        if title:
-                            content += f"标题: {title}\n"
+                    if result_content := result_item.get("content"):
+                        content += f"{result_content}\n"
                         
-                        if result_content := result_item.get("content"):
-                            content += f"{result_content}\n"
-                            
-                        if link := result_item.get("link"):
-                            content += f"来源: {link}\n"
-                            
-                        content += "---\n"
-                
-                if content:
-                    hass.bus.async_fire(f"{DOMAIN}_response", {
-                        "type": "web_search",
-                        "content": content,
-                        "success": True
-                    })
-                    return {"success": True, "message": content}
-                else:
-                    error_msg = "未从API获取到搜索结果"
-                    return {"success": False, "message": error_msg}
+                    if link := result_item.get("link"):
+                        content += f"来源: {link}\n"
+                        
+                    content += "---\n"
+            
+            if content:
+                hass.bus.async_fire(f"{DOMAIN}_response", {
+                    "type": "web_search",
+                    "content": content,
+                    "success": True
+                })
+                return {"success": True, "message": content}
+            else:
+                error_msg = "未从API获取到搜索结果"
+                return {"success": False, "message": error_msg}
 
         except Exception as e:
             error_msg = f"Web search failed: {str(e)}"